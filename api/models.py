@@ -408,6 +408,25 @@ class SettingsUpdate(BaseModel):
     theme: Optional[str] = None
 
 
+class BandwidthLimitRequest(BaseModel):
+    """Set global download bandwidth cap request."""
+    limit: int = Field(..., ge=0, description="Bytes per second; 0 removes the cap")
+
+
+class BandwidthTransfer(BaseModel):
+    """Active download drawing from the bandwidth scheduler."""
+    name: str
+    priority: str
+    weight: float
+    bytes: int
+
+
+class BandwidthStatus(BaseModel):
+    """Global bandwidth cap and active transfers."""
+    limit: int
+    transfers: List[BandwidthTransfer] = []
+
+
 # ============================================================================
 # Health & Diagnostics
 # ============================================================================
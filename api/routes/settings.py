@@ -11,10 +11,11 @@ from datetime import datetime, timezone
 from fastapi import APIRouter, HTTPException, status, Depends
 
 from api.models import (
-    AppSettings, SettingsUpdate, GameDirectoryRequest
+    AppSettings, SettingsUpdate, GameDirectoryRequest, BandwidthLimitRequest, BandwidthStatus
 )
 from api.security import get_current_user
 from api.config import settings as config_settings
+from bandwidth import get_scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -289,6 +290,66 @@ async def set_language(
     return {"language": language}
 
 
+# ============================================================================
+# Bandwidth
+# ============================================================================
+
+def bandwidth_status() -> BandwidthStatus:
+    """Snapshot of the process-wide bandwidth scheduler."""
+    current = get_scheduler().status()
+    return BandwidthStatus(limit=current['rate'], transfers=current['transfers'])
+
+
+@router.get("/bandwidth", response_model=BandwidthStatus)
+async def get_bandwidth(
+    current_user: Dict[str, Any] = Depends(get_current_user)
+) -> BandwidthStatus:
+    """
+    Get the global download bandwidth cap.
+
+    Args:
+        current_user: Current authenticated user
+
+    Returns:
+        Cap in bytes/sec (0 = unlimited) and active transfers
+    """
+    return bandwidth_status()
+
+
+@router.put("/bandwidth", response_model=BandwidthStatus)
+async def set_bandwidth(
+    request: BandwidthLimitRequest,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+) -> BandwidthStatus:
+    """
+    Set the global download bandwidth cap.
+
+    Applies immediately, including to downloads already running. The cap is
+    shared by all users of this process.
+
+    Args:
+        request: Cap in bytes/sec (0 removes it)
+        current_user: Current authenticated user
+
+    Returns:
+        Updated bandwidth status
+
+    Raises:
+        HTTPException: If the limit is invalid
+    """
+    logger.info(f"Setting bandwidth limit: {request.limit} B/s")
+
+    try:
+        get_scheduler().set_rate(request.limit)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    return bandwidth_status()
+
+
 # ============================================================================
 # Reset Settings
 # ============================================================================
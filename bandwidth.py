@@ -0,0 +1,254 @@
+"""
+Bandwidth scheduling for downloads.
+
+Provides:
+- BandwidthScheduler: A global bytes/sec cap shared by every transfer, with
+  strict priority between classes and weighted fair sharing within a class
+- Transfer: One download drawing bytes from a scheduler
+- priority_for: Maps a manifest entry to its priority class
+- get_scheduler: The process-wide scheduler the sidecar and API adjust
+
+Downloaders call Transfer.consume(n) after receiving n bytes. While the cap is
+reached, the reader stops pulling from the socket and TCP flow control slows
+the sender. With no cap (rate 0) consume returns immediately.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, Dict, Optional
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+# Highest priority first: the base game finishes before optional packs, and
+# packs before language files
+PRIORITY_CLASSES = ("base", "pack", "language")
+DEFAULT_PRIORITY = "pack"
+
+def validate_priority(priority: str) -> str:
+    """
+    Normalizes a priority class name.
+
+    Raises:
+        ValueError: If the priority class is unknown
+    """
+    name = str(priority).lower()
+    if name not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class: {priority}")
+    return name
+
+def priority_for(entry: Dict[str, Any]) -> str:
+    """Returns the priority class of a manifest file entry (category/pack_id)."""
+    category = str(entry.get("category", "Base")).lower()
+    if category == "language":
+        return "language"
+    if category == "base" and entry.get("pack_id", "Base") == "Base":
+        return "base"
+    return "pack"
+
+class _Request:
+    __slots__ = ("transfer", "nbytes", "finish", "seq")
+
+    def __init__(self, transfer, nbytes, finish, seq):
+        self.transfer = transfer
+        self.nbytes = nbytes
+        self.finish = finish
+        self.seq = seq
+
+    def key(self):
+        return (PRIORITY_CLASSES.index(self.transfer.priority), self.finish, self.seq)
+
+class Transfer:
+    """A download registered with a BandwidthScheduler; use as a context manager."""
+    def __init__(self, scheduler, name: str, priority: str, weight: float):
+        self.scheduler = scheduler
+        self.name = name
+        self.priority = priority
+        self.weight = weight
+        self.bytes = 0
+        # Virtual finish time of this transfer's last request (weighted fair queueing)
+        self.finish = 0.0
+
+    def consume(self, nbytes: int):
+        """Blocks until nbytes may be counted against the cap."""
+        self.scheduler._consume(self, nbytes)
+
+    async def consume_async(self, nbytes: int):
+        """consume() for event loops: waits without blocking other tasks."""
+        await self.scheduler._consume_async(self, nbytes)
+
+    def close(self):
+        self.scheduler._close(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+class BandwidthScheduler:
+    """
+    Token bucket refilled at rate bytes/sec, handing bytes out by priority.
+
+    Waiting requests are served one at a time: the highest priority class with
+    a waiter goes first, and within a class the request with the smallest
+    weighted virtual finish time (bytes / weight, accumulated per transfer).
+    Lower classes are only held back while a higher class is actually waiting,
+    so bandwidth a base-game mirror cannot use still goes to packs.
+    """
+    # Longest single wait, so rate changes and new arrivals are noticed promptly
+    MAX_WAIT = 0.25
+    MIN_BURST = 64 * 1024
+
+    def __init__(self, rate: int = 0, clock=time.monotonic):
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._rate = 0
+        self._burst = self.MIN_BURST
+        self._tokens = 0.0
+        self._last = clock()
+        self._waiting = []
+        self._seq = 0
+        # Per-class virtual time: finish time of the last request granted in the class
+        self._vtime = {c: 0.0 for c in PRIORITY_CLASSES}
+        self._transfers = []
+        self.set_rate(rate)
+
+    @property
+    def rate(self) -> int:
+        """Cap in bytes/sec; 0 means unlimited."""
+        return self._rate
+
+    def set_rate(self, rate: int):
+        """
+        Changes the cap; takes effect for transfers already running.
+
+        Raises:
+            ValueError: If rate is negative or not a number
+        """
+        if isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate < 0:
+            raise ValueError(f"Invalid bandwidth limit: {rate!r}")
+        with self._cond:
+            self._refill()
+            self._rate = int(rate)
+            # A quarter second of credit smooths chunk-sized bursts without allowing spikes
+            self._burst = max(self.MIN_BURST, self._rate // 4)
+            self._tokens = min(self._tokens, self._burst)
+            self._cond.notify_all()
+        logger.info(f"Bandwidth limit set to {self._rate} B/s" if self._rate else "Bandwidth limit removed")
+
+    def open(self, name: str, priority: str = DEFAULT_PRIORITY, weight: float = 1.0) -> Transfer:
+        """
+        Registers a transfer.
+
+        Raises:
+            ValueError: If priority is unknown or weight is not positive
+        """
+        if weight <= 0:
+            raise ValueError(f"Transfer weight must be positive: {weight}")
+        transfer = Transfer(self, name, validate_priority(priority), weight)
+        with self._cond:
+            self._transfers.append(transfer)
+        return transfer
+
+    def status(self) -> Dict[str, Any]:
+        """Returns the cap and the active transfers, highest priority first."""
+        with self._cond:
+            transfers = sorted(self._transfers, key=lambda t: PRIORITY_CLASSES.index(t.priority))
+            return {
+                'rate': self._rate,
+                'transfers': [
+                    {'name': t.name, 'priority': t.priority, 'weight': t.weight, 'bytes': t.bytes}
+                    for t in transfers
+                ]
+            }
+
+    def _close(self, transfer):
+        with self._cond:
+            if transfer in self._transfers:
+                self._transfers.remove(transfer)
+            self._cond.notify_all()
+
+    def _refill(self):
+        now = self._clock()
+        if self._rate:
+            self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def _enqueue(self, transfer, nbytes) -> _Request:
+        # Called with the lock held
+        start = max(self._vtime[transfer.priority], transfer.finish)
+        transfer.finish = start + nbytes / transfer.weight
+        self._seq += 1
+        request = _Request(transfer, nbytes, transfer.finish, self._seq)
+        self._waiting.append(request)
+        return request
+
+    def _poll(self, request) -> Optional[float]:
+        """
+        Grants request if it is next in line and the bucket allows it.
+
+        Called with the lock held. Returns None once granted, else the seconds
+        to wait before polling again.
+        """
+        if self._rate:
+            self._refill()
+            head = min(self._waiting, key=_Request.key)
+            # A request larger than the bucket only needs a full bucket; the
+            # balance goes negative and delays whoever comes next
+            if head is not request or self._tokens < min(request.nbytes, self._burst):
+                missing = min(head.nbytes, self._burst) - self._tokens
+                return min(self.MAX_WAIT, max(missing / self._rate, 0.001))
+            self._tokens -= request.nbytes
+            priority = request.transfer.priority
+            self._vtime[priority] = max(self._vtime[priority], request.finish - request.nbytes / request.transfer.weight)
+        self._waiting.remove(request)
+        request.transfer.bytes += request.nbytes
+        self._cond.notify_all()
+        return None
+
+    def _consume(self, transfer, nbytes):
+        if not self._rate:
+            transfer.bytes += nbytes
+            return
+        with self._cond:
+            request = self._enqueue(transfer, nbytes)
+            while True:
+                wait = self._poll(request)
+                if wait is None:
+                    return
+                self._cond.wait(wait)
+
+    async def _consume_async(self, transfer, nbytes):
+        if not self._rate:
+            transfer.bytes += nbytes
+            return
+        with self._cond:
+            request = self._enqueue(transfer, nbytes)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._poll(request)
+                if wait is None:
+                    return
+                await asyncio.sleep(wait)
+        except BaseException:
+            with self._cond:
+                if request in self._waiting:
+                    self._waiting.remove(request)
+                    self._cond.notify_all()
+            raise
+
+_scheduler: Optional[BandwidthScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> BandwidthScheduler:
+    """Returns the process-wide scheduler (unlimited until set_rate is called)."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = BandwidthScheduler()
+        return _scheduler
@@ -0,0 +1,182 @@
+"""
+Patch bundles: many deltas in one archive, read as a single stream.
+
+Provides:
+- PatchBundle: Iterates the deltas of a bundle read front to back
+- open_bundle: Opens a bundle from a local path or an HTTP(S) URL
+- write_bundle: Builds a bundle from delta files
+- entry_matches: Whether an index entry is the delta a patch operation needs
+- BundleError: Raised for malformed bundles
+
+A bundle is an uncompressed tar archive (deltas are already compressed)
+whose first member is "index.json":
+
+    {"version": 1, "members": [{"name": "0001.vcdiff", "file": "Data/x.package",
+      "hash_from": "...", "hash_to": "...", "size": <bytes>}, ...]}
+
+with MD5_from/MD5_to accepted as in manifest entries. Members are read in
+archive order straight from the stream and handed to Patcher.apply_patch_stream,
+so a bundle is never written to disk.
+"""
+
+import io
+import os
+import json
+import tarfile
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from http_client import get_client
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+INDEX_NAME = "index.json"
+BUNDLE_VERSION = 1
+
+class BundleError(Exception):
+    """The bundle is malformed or does not start with its index."""
+
+def _hash(entry: Dict[str, Any], kind: str) -> Optional[str]:
+    digest = entry.get(f"hash_{kind}") or entry.get(f"MD5_{kind}")
+    return digest.upper() if digest else None
+
+def entry_matches(entry: Dict[str, Any], task: Dict[str, Any]) -> bool:
+    """True if the index entry patches task's file from its source to its target hash."""
+    if entry.get("file") != task.get("file") or _hash(entry, "to") != (task.get("target_md5") or "").upper():
+        return False
+    source = _hash(entry, "from")
+    return source is None or not task.get("source_md5") or source == task["source_md5"].upper()
+
+class _IterReader(io.RawIOBase):
+    """Readable stream over an iterator of byte chunks."""
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buf = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buf:
+            try:
+                self._buf = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+class _Counting:
+    """Passes reads through, reporting bytes read as download progress."""
+    def __init__(self, stream, name: str, total: Optional[int], callback: Callable[[Dict], None]):
+        self.stream = stream
+        self.name = name
+        self.total = total
+        self.callback = callback
+        self.done = 0
+
+    def read(self, n: int = -1) -> bytes:
+        chunk = self.stream.read(n)
+        self.done += len(chunk)
+        self.callback({
+            'file': self.name, 'completed_bytes': self.done, 'total_bytes': self.total,
+            'percentage': round(self.done * 100 / self.total, 1) if self.total else 0
+        })
+        return chunk
+
+class PatchBundle:
+    def __init__(self, stream):
+        # Stream mode: members are read in order, without seeking
+        try:
+            self._tar = tarfile.open(fileobj=stream, mode="r|")
+            first = self._tar.next()
+        except tarfile.TarError as e:
+            raise BundleError(f"Not a patch bundle: {e}")
+        if first is None or first.name != INDEX_NAME:
+            raise BundleError(f"Bundle does not start with {INDEX_NAME}")
+        try:
+            index = json.load(self._tar.extractfile(first))
+        except (ValueError, AttributeError) as e:
+            raise BundleError(f"Bundle index is unreadable: {e}")
+        if not isinstance(index, dict) or not isinstance(index.get("members"), list):
+            raise BundleError("Bundle index has no member list")
+        if index.get("version", BUNDLE_VERSION) > BUNDLE_VERSION:
+            raise BundleError(f"Unsupported bundle version {index['version']}")
+        self.index: Dict[str, Dict[str, Any]] = {m["name"]: m for m in index["members"]
+                                                 if isinstance(m, dict) and m.get("name")}
+
+    def __iter__(self) -> Iterator[Tuple[Dict[str, Any], Any]]:
+        """
+        Yields (index entry, stream) per delta in archive order. Each stream is
+        only readable until the next item is requested; members missing from
+        the index are skipped.
+        """
+        members = iter(self._tar)
+        while True:
+            try:
+                member = next(members)
+            except StopIteration:
+                return
+            except tarfile.TarError as e:
+                raise BundleError(f"Bundle is truncated or corrupt: {e}")
+            entry = self.index.get(member.name)
+            if entry is None or not member.isfile():
+                continue
+            yield entry, self._tar.extractfile(member)
+
+    def close(self):
+        self._tar.close()
+
+@contextmanager
+def open_bundle(location: str, client=None, callback: Optional[Callable[[Dict], None]] = None):
+    """
+    Opens the bundle at a local path or http(s) URL for one front-to-back pass.
+
+    Args:
+        client: httpx.Client for URLs (default: the shared pooled client)
+        callback: Receives download progress dicts as the bundle is read
+
+    Raises:
+        BundleError: If the bundle is malformed
+        OSError, httpx.HTTPError: If it cannot be read
+    """
+    if location.startswith(("http://", "https://")):
+        client = client or get_client()
+        with client.stream("GET", location) as response:
+            response.raise_for_status()
+            total = int(response.headers["Content-Length"]) if "Content-Length" in response.headers else None
+            stream = io.BufferedReader(_IterReader(response.iter_bytes()))
+            if callback:
+                stream = _Counting(stream, location, total, callback)
+            bundle = PatchBundle(stream)
+            try:
+                yield bundle
+            finally:
+                bundle.close()
+    else:
+        with open(location, "rb") as f:
+            stream = _Counting(f, location, os.path.getsize(location), callback) if callback else f
+            bundle = PatchBundle(stream)
+            try:
+                yield bundle
+            finally:
+                bundle.close()
+
+def write_bundle(path, members: List[Tuple[Dict[str, Any], str]]):
+    """
+    Writes a bundle from (index entry, delta file) pairs; entries need "file"
+    and a target hash, and get "name" and "size" filled in.
+    """
+    entries = []
+    for n, (entry, delta_path) in enumerate(members):
+        entries.append({**entry, "name": entry.get("name") or f"{n:04d}.delta",
+                        "size": os.path.getsize(delta_path)})
+    index = json.dumps({"version": BUNDLE_VERSION, "members": entries}, indent=2).encode()
+    with tarfile.open(path, "w") as tar:
+        info = tarfile.TarInfo(INDEX_NAME)
+        info.size = len(index)
+        tar.addfile(info, io.BytesIO(index))
+        for entry, (_, delta_path) in zip(entries, members):
+            tar.add(delta_path, arcname=entry["name"])
@@ -0,0 +1,339 @@
+"""
+Change journal module for incremental verification.
+
+Provides:
+- ChangeJournal: Records which paths under a game directory changed since the
+  last successful verification, plus the digests that verification produced
+- InotifyWatcher: Feeds a journal from Linux inotify events
+- PollingWatcher: Feeds a journal by periodically comparing stat tuples
+- start_watcher: Starts the best watcher available on this platform
+
+A journal is only trustworthy while a watcher has been running continuously
+since the last verification. Until the first verification after a watcher
+starts (or after the kernel drops events), the journal reports that a full
+scan is needed.
+"""
+
+import os
+import sys
+import errno
+import random
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+class ChangeJournal:
+    def __init__(self, game_dir, audit_count: int = 16, seed=None):
+        self.game_dir = os.path.abspath(game_dir)
+        # Untouched files re-hashed per incremental verification, in rolling order
+        self.audit_count = audit_count
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._reset_seq = 0
+        self._dirty: Dict[str, int] = {}
+        self._all_dirty = True
+        self._algorithm = None
+        self._hashes: Dict[str, str] = {}
+        self._audit_order: List[str] = []
+        self._audit_cursor = 0
+
+    def mark_dirty(self, path: str):
+        """Records that a path (file or directory) changed."""
+        with self._lock:
+            self._seq += 1
+            self._dirty[os.path.abspath(path)] = self._seq
+
+    def mark_all_dirty(self):
+        """Forgets everything; the next verification must hash every file."""
+        with self._lock:
+            self._seq += 1
+            self._reset_seq = self._seq
+            self._all_dirty = True
+            self._dirty.clear()
+
+    def needs_full_scan(self, algorithm: str) -> bool:
+        with self._lock:
+            return self._all_dirty or algorithm != self._algorithm
+
+    def snapshot(self) -> int:
+        """Returns a marker to pass to mark_verified once hashing is done."""
+        with self._lock:
+            return self._seq
+
+    def is_dirty(self, path: str) -> bool:
+        path = os.path.abspath(path)
+        with self._lock:
+            if self._all_dirty or path not in self._hashes:
+                return True
+            # A changed directory (rename, delete) taints everything below it
+            while True:
+                if path in self._dirty:
+                    return True
+                parent = os.path.dirname(path)
+                if parent == path or len(parent) < len(self.game_dir):
+                    return False
+                path = parent
+
+    def known_hash(self, path: str) -> Optional[str]:
+        with self._lock:
+            return self._hashes.get(os.path.abspath(path))
+
+    def plan(self, paths: Iterable[str], algorithm: str) -> Tuple[List[str], Dict[str, str]]:
+        """
+        Splits paths into those that must be hashed and those whose last
+        verified digest can be reused.
+
+        Changed paths, paths never verified and a rolling audit sample of
+        untouched paths are hashed; the audit walks a random permutation of the
+        install so every file is eventually re-read.
+
+        Returns:
+            (paths to hash, {path: reused digest})
+        """
+        paths = list(paths)
+        if self.needs_full_scan(algorithm):
+            return paths, {}
+
+        to_hash = []
+        reused = {}
+        for p in paths:
+            if self.is_dirty(p):
+                to_hash.append(p)
+            else:
+                reused[p] = self.known_hash(p)
+
+        for p in self._next_audit(reused):
+            to_hash.append(p)
+            del reused[p]
+        return to_hash, reused
+
+    def _next_audit(self, candidates: Dict[str, str]) -> List[str]:
+        with self._lock:
+            if len(self._audit_order) != len(candidates) or set(self._audit_order) != candidates.keys():
+                self._audit_order = sorted(candidates)
+                self._random.shuffle(self._audit_order)
+                self._audit_cursor = 0
+            count = min(self.audit_count, len(self._audit_order))
+            picked = [self._audit_order[(self._audit_cursor + i) % len(self._audit_order)] for i in range(count)]
+            if self._audit_order:
+                self._audit_cursor = (self._audit_cursor + count) % len(self._audit_order)
+            return picked
+
+    def mark_verified(self, snapshot: int, hashes: Dict[str, str], algorithm: str):
+        """
+        Records the digests of a successful verification.
+
+        Changes seen after snapshot was taken stay dirty, since the hashing may
+        have read the file before they happened.
+        """
+        with self._lock:
+            if self._reset_seq > snapshot:
+                return
+            if self._all_dirty or algorithm != self._algorithm:
+                self._hashes = {}
+            self._all_dirty = False
+            self._algorithm = algorithm
+            self._hashes.update({os.path.abspath(p): h for p, h in hashes.items() if h})
+            self._dirty = {p: seq for p, seq in self._dirty.items() if seq > snapshot}
+
+class PollingWatcher:
+    """Detects changes by re-stat'ing the tree every interval seconds."""
+    name = "polling"
+
+    def __init__(self, journal: ChangeJournal, interval: float = 5.0):
+        self.journal = journal
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._state: Dict[str, tuple] = {}
+
+    def _scan(self) -> Dict[str, tuple]:
+        state = {}
+        for root, dirs, files in os.walk(self.journal.game_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                state[path] = (st.st_size, st.st_mtime_ns, st.st_ino)
+        return state
+
+    def poll(self):
+        """Runs one comparison pass; called by the watcher thread."""
+        state = self._scan()
+        for path in self._state.keys() | state.keys():
+            if self._state.get(path) != state.get(path):
+                self.journal.mark_dirty(path)
+        self._state = state
+
+    def start(self):
+        self._state = self._scan()
+        self._thread = threading.Thread(target=self._run, name="change-journal-poll", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Change journal poll failed, forcing full verification: {e}")
+                self.journal.mark_all_dirty()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+class InotifyWatcher:
+    """Watches every directory under the game dir with Linux inotify."""
+    name = "inotify"
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, journal: ChangeJournal):
+        self.journal = journal
+        self._libc = self._load_libc()
+        if self._libc is None:
+            raise OSError("inotify is not available on this platform")
+        self._fd = None
+        self._wds: Dict[int, str] = {}
+        self._stop_r, self._stop_w = None, None
+        self._thread = None
+
+    @staticmethod
+    def _load_libc():
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            libc.inotify_init1, libc.inotify_add_watch
+        except (OSError, AttributeError):
+            return None
+        return libc
+
+    @classmethod
+    def available(cls) -> bool:
+        return cls._load_libc() is not None
+
+    def _add_tree(self, top: str):
+        for root, dirs, files in os.walk(top):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), self.WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    raise OSError(err, "inotify watch limit reached (fs.inotify.max_user_watches)")
+                continue
+            self._wds[wd] = root
+
+    def start(self):
+        self._fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        try:
+            self._add_tree(self.journal.game_dir)
+        except OSError:
+            os.close(self._fd)
+            raise
+        self._stop_r, self._stop_w = os.pipe()
+        self._thread = threading.Thread(target=self._run, name="change-journal-inotify", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                ready, _, _ = select.select([self._fd, self._stop_r], [], [])
+                if self._stop_r in ready:
+                    return
+                self._handle(os.read(self._fd, 64 * 1024))
+        except Exception as e:
+            logger.warning(f"Change journal watcher failed, forcing full verification: {e}")
+            self.journal.mark_all_dirty()
+        finally:
+            os.close(self._fd)
+
+    def _handle(self, data: bytes):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflowed; next verification will be full")
+                self.journal.mark_all_dirty()
+                continue
+            if mask & self.IN_IGNORED:
+                self._wds.pop(wd, None)
+                continue
+
+            directory = self._wds.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            self.journal.mark_dirty(path)
+            # New or moved-in directories need their own watches
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self._add_tree(path)
+
+    def stop(self):
+        if self._thread:
+            os.write(self._stop_w, b"x")
+            self._thread.join()
+            os.close(self._stop_r)
+            os.close(self._stop_w)
+            self._thread = None
+
+def start_watcher(journal: ChangeJournal, prefer: str = "auto", poll_interval: float = 5.0):
+    """
+    Starts a watcher feeding journal: inotify where available, else polling.
+
+    The journal is reset first, so the next verification is a full one.
+
+    Raises:
+        ValueError: If prefer is not "auto", "inotify" or "polling"
+    """
+    if prefer not in ("auto", "inotify", "polling"):
+        raise ValueError(f"Unknown watcher: {prefer}")
+    journal.mark_all_dirty()
+
+    if prefer != "polling" and InotifyWatcher.available():
+        try:
+            watcher = InotifyWatcher(journal)
+            watcher.start()
+            return watcher
+        except OSError as e:
+            if prefer == "inotify":
+                raise
+            logger.warning(f"inotify unavailable ({e}), falling back to polling")
+    elif prefer == "inotify":
+        raise OSError("inotify is not available on this platform")
+
+    watcher = PollingWatcher(journal, interval=poll_interval)
+    watcher.start()
+    return watcher
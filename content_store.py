@@ -0,0 +1,268 @@
+"""
+Content-addressed store of downloaded game files.
+
+Provides:
+- ContentStore: Files keyed by (algorithm, digest) under app data, shared by
+  every game directory, with a size budget and least-recently-used eviction
+- clone_file: Copies a file as a reflink (copy-on-write clone) where the
+  filesystem supports it, falling back to a regular copy
+
+Several installs at different versions mostly share identical payloads. A
+file downloaded for one install is deposited here after verification, and
+later installs that need the same target digest copy it locally instead of
+downloading it again. Copies are reflinks on Btrfs, XFS, APFS and other
+copy-on-write filesystems, so they cost no extra space until modified. By
+default files are only deposited where they can be reflinked; elsewhere the
+store would cost a second full copy of every download.
+
+Entries are never hard links: a game writing to its copy must not alter the
+store.
+"""
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import threading
+import ctypes
+import ctypes.util
+from pathlib import Path
+from typing import Optional
+from paths import get_app_data_path
+from hash_backends import digest_file_multi
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+# ioctl request number of FICLONE (linux/fs.h)
+_FICLONE = 0x40049409
+
+def _reflink(src: str, dst: str) -> bool:
+    """Clones src to a new file dst sharing its extents; False if unsupported."""
+    if sys.platform.startswith("linux"):
+        import fcntl
+        try:
+            with open(src, "rb") as s, open(dst, "wb") as d:
+                fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+            return True
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+            return False
+    if sys.platform == "darwin":
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            return libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0
+        except (OSError, AttributeError):
+            return False
+    return False
+
+def clone_file(src, dst) -> str:
+    """
+    Copies src to dst, preferring a reflink.
+
+    Returns:
+        str: "reflink" or "copy"
+    """
+    src, dst = str(src), str(dst)
+    if _reflink(src, dst):
+        return "reflink"
+    shutil.copyfile(src, dst)
+    return "copy"
+
+class ContentStore:
+    """
+    Verified files keyed by their digest, evicted least-recently-used first
+    once the store exceeds max_bytes.
+
+    The index is an SQLite database in WAL mode, like HashCache, so several
+    processes can share one store. Objects are written to a temporary name
+    and renamed into place, so a reader never sees a partial object.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS objects (
+            algorithm TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            last_access REAL NOT NULL,
+            PRIMARY KEY (algorithm, digest)
+        )
+    """
+    DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+
+    def __init__(self, root: Optional[Path] = None, max_bytes: int = DEFAULT_MAX_BYTES, timeout: float = 30.0,
+                 clone_only: bool = True):
+        self.root = Path(root) if root else get_app_data_path() / "content_store"
+        self.max_bytes = max_bytes
+        # Deposit only files that can be reflinked into the store: a full copy
+        # would read and write every download a second time
+        self.clone_only = clone_only
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.root / "index.db"), timeout=timeout, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(self.SCHEMA)
+            self._conn.commit()
+
+    def object_path(self, digest: str, algorithm: str = "md5") -> Path:
+        digest = digest.upper()
+        return self.root / "objects" / algorithm / digest[:2] / digest
+
+    def lookup(self, digest: str, algorithm: str = "md5") -> Optional[Path]:
+        """Returns the stored file for a digest, or None if it is absent or damaged."""
+        if not digest:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size FROM objects WHERE algorithm = ? AND digest = ?", (algorithm, digest.upper())
+            ).fetchone()
+        if row is None:
+            return None
+        path = self.object_path(digest, algorithm)
+        try:
+            if os.path.getsize(path) == row[0]:
+                return path
+        except OSError:
+            pass
+        logger.warning(f"Content store object {algorithm}:{digest} is missing or truncated; dropping it")
+        self._forget(algorithm, digest.upper())
+        return None
+
+    def materialize(self, digest: str, dest, algorithm: str = "md5") -> Optional[str]:
+        """
+        Copies the stored file for digest to dest, replacing it atomically.
+
+        The copy is hashed before it replaces dest; an object whose contents
+        no longer match its digest is dropped from the store and dest is left
+        untouched.
+
+        Returns:
+            "reflink" or "copy" on success, None if the digest is not stored,
+            the stored object is corrupt or the copy failed
+        """
+        src = self.lookup(digest, algorithm)
+        if src is None:
+            return None
+        dest = str(dest)
+        tmp = dest + ".store.tmp"
+        try:
+            os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+            method = clone_file(src, tmp)
+            actual = digest_file_multi(tmp, (algorithm,))[algorithm]
+            if actual != digest.upper():
+                logger.warning(f"Content store object {algorithm}:{digest} is corrupt "
+                               f"(hashes to {actual}); dropping it")
+                os.remove(tmp)
+                self._forget(algorithm, digest.upper())
+                return None
+            os.replace(tmp, dest)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Copying {algorithm}:{digest} from the content store failed: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return None
+        self._touch(algorithm, digest.upper())
+        return method
+
+    def deposit(self, file_path, digest: str, algorithm: str = "md5") -> bool:
+        """
+        Adds a file already verified against digest, then evicts down to budget.
+
+        With clone_only (the default) the file is stored only if it can be
+        reflinked, so depositing costs neither I/O nor space up front.
+
+        Returns:
+            bool: True if the store now holds the digest
+        """
+        digest = digest.upper()
+        if self.lookup(digest, algorithm) is not None:
+            self._touch(algorithm, digest)
+            return True
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return False
+        if size > self.max_bytes:
+            return False
+
+        path = self.object_path(digest, algorithm)
+        tmp = path.with_name(f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if self.clone_only:
+                if not _reflink(str(file_path), str(tmp)):
+                    logger.debug(f"Not storing {file_path}: the filesystem cannot reflink it")
+                    return False
+            else:
+                clone_file(file_path, tmp)
+            os.replace(tmp, path)
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO objects (algorithm, digest, size, last_access) VALUES (?, ?, ?, ?)",
+                    (algorithm, digest, size, time.time())
+                )
+                self._conn.commit()
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Failed to add {file_path} to the content store: {e}")
+            if tmp.exists():
+                tmp.unlink()
+            return False
+        self.evict()
+        return True
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def evict(self, max_bytes: Optional[int] = None) -> int:
+        """
+        Removes least-recently-used objects until the store fits max_bytes
+        (the configured budget by default).
+
+        Returns:
+            int: Bytes freed
+        """
+        budget = self.max_bytes if max_bytes is None else max_bytes
+        freed = 0
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+            if total <= budget:
+                return 0
+            rows = self._conn.execute(
+                "SELECT algorithm, digest, size FROM objects ORDER BY last_access ASC"
+            ).fetchall()
+        for algorithm, digest, size in rows:
+            if total - freed <= budget:
+                break
+            self._forget(algorithm, digest)
+            freed += size
+        if freed:
+            logger.info(f"Content store evicted {freed // (1024 * 1024)} MiB to stay under budget")
+        return freed
+
+    def _touch(self, algorithm, digest):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE objects SET last_access = ? WHERE algorithm = ? AND digest = ?",
+                (time.time(), algorithm, digest)
+            )
+            self._conn.commit()
+
+    def _forget(self, algorithm, digest):
+        with self._lock:
+            self._conn.execute("DELETE FROM objects WHERE algorithm = ? AND digest = ?", (algorithm, digest))
+            self._conn.commit()
+        try:
+            os.remove(self.object_path(digest, algorithm))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove content store object {algorithm}:{digest}: {e}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,6 +1,7 @@
 import asyncio
 import httpx
 from typing import List, Dict, Any, Optional
+from http_client import get_async_client, close_async_client
 
 # Global state for selected mirrors
 _selected_mirror: Optional[str] = None
@@ -16,8 +17,13 @@ class MirrorDiscovery:
     """
     Handles parallel probing and discovery of game content mirrors.
     """
-    def __init__(self, mirrors: List[Dict[str, Any]]):
+    def __init__(self, mirrors: List[Dict[str, Any]], probe_bytes: int = 0,
+                 client: Optional[httpx.AsyncClient] = None):
         self.mirrors = mirrors
+        # Defaults to the running event loop's pooled client
+        self.client = client
+        # When set, also time a ranged GET of this many bytes to estimate throughput
+        self.probe_bytes = probe_bytes
 
     def get_weighted_mirrors(self) -> List[Dict[str, Any]]:
         """Returns mirrors sorted by their weight (descending)."""
@@ -30,11 +36,17 @@ class MirrorDiscovery:
             start_time = asyncio.get_event_loop().time()
             response = await client.head(url, timeout=5.0)
             latency = asyncio.get_event_loop().time() - start_time
+            available = response.status_code == 200
+
+            throughput = None
+            if available and self.probe_bytes:
+                throughput = await self.measure_throughput(client, mirror.get("probe_url", url))
             
             return {
                 **mirror,
-                "available": response.status_code == 200,
+                "available": available,
                 "latency": latency,
+                "throughput": throughput,
                 "error": None
             }
         except Exception as e:
@@ -45,12 +57,40 @@ class MirrorDiscovery:
                 "error": str(e)
             }
 
+    async def measure_throughput(self, client: httpx.AsyncClient, url: str) -> Optional[float]:
+        """Returns bytes/s for a ranged GET of probe_bytes, or None if it fails."""
+        try:
+            start_time = asyncio.get_event_loop().time()
+            received = 0
+            headers = {"Range": f"bytes=0-{self.probe_bytes - 1}"}
+            async with client.stream("GET", url, headers=headers, timeout=10.0) as response:
+                if response.status_code not in (200, 206):
+                    return None
+                async for chunk in response.aiter_bytes():
+                    received += len(chunk)
+                    if received >= self.probe_bytes:
+                        break
+            elapsed = asyncio.get_event_loop().time() - start_time
+            return received / elapsed if elapsed > 0 and received else None
+        except Exception:
+            return None
+
     async def discover_best_mirrors(self) -> List[Dict[str, Any]]:
-        """Probes all mirrors in parallel and returns results sorted by health and weight."""
-        async with httpx.AsyncClient() as client:
+        """
+        Probes all mirrors in parallel and returns results sorted by health and weight.
+
+        Without an injected client, the running loop's pooled client is used
+        and closed afterwards: callers such as the sidecar run each discovery
+        in a fresh loop, whose connections cannot outlive it.
+        """
+        client = self.client or get_async_client()
+        try:
             tasks = [self.probe_mirror(client, m) for m in self.mirrors]
             results = await asyncio.gather(*tasks)
-        
+        finally:
+            if self.client is None:
+                await close_async_client()
+
         # Sort by: 1. Availability, 2. Weight (desc), 3. Latency (asc)
         return sorted(
             results,
@@ -8,12 +8,14 @@ from typing import Dict, Any, List, Optional
 from paths import get_tools_path, get_app_data_path
 from download import Aria2Manager
 from patch import Patcher
+from http_client import get_client
 
 class BackendDoctor:
     """Diagnoses and attempts to fix common backend issues."""
 
-    def __init__(self, app_data_path: Optional[Path] = None) -> None:
+    def __init__(self, app_data_path: Optional[Path] = None, client: Optional[httpx.Client] = None) -> None:
         self.app_data_path: Path = app_data_path or get_app_data_path()
+        self.client: httpx.Client = client or get_client()
         self.results: List[Dict[str, Any]] = []
 
     def check_all(self) -> List[Dict[str, Any]]:
@@ -64,8 +66,7 @@ class BackendDoctor:
         """Check internet connectivity to major update hosts."""
         status: Dict[str, Any] = {"name": "Connectivity", "status": "ok", "message": "Internet connection stable."}
         try:
-            with httpx.Client(timeout=5.0) as client:
-                client.get("https://google.com")
+            self.client.get("https://google.com", timeout=5.0)
         except Exception as e:
             status = {"name": "Connectivity", "status": "warning", "message": f"Failed to reach external servers: {e}"}
         self.results.append(status)
@@ -1,10 +1,48 @@
 import re
 import os
+import asyncio
+import time
+import socket
+import hashlib
+import threading
 import subprocess
+from collections import deque
+import httpx
+from bandwidth import DEFAULT_PRIORITY, PRIORITY_CLASSES, get_scheduler, validate_priority
+from hash_backends import SUPPORTED_ALGORITHMS
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+# Error of a queued download skipped because its caller cancelled the batch
+DOWNLOAD_CANCELLED = "Download cancelled"
+
+# hashlib algorithm name -> aria2c --checksum type
+ARIA2_CHECKSUM_TYPES = {
+    "md5": "md5",
+    "sha1": "sha-1",
+    "sha256": "sha-256",
+    "sha512": "sha-512",
+}
+
+def _has_aria2_control_file(output_dir, filename):
+    """
+    True if aria2c left a "<file>.aria2" control file from an interrupted run.
+
+    --continue is only safe then: without a control file aria2c would treat an
+    old copy of the file as a partial download of the new one.
+    """
+    return os.path.exists(os.path.join(str(output_dir), filename) + ".aria2")
 
 class Aria2Manager:
-    def __init__(self, aria2_exe=None):
+    # Algorithms download() verifies itself; others must be checked by the caller
+    checksum_types = frozenset(ARIA2_CHECKSUM_TYPES)
+
+    def __init__(self, aria2_exe=None, bandwidth=None):
         self.aria2_exe = aria2_exe or self._find_aria2()
+        # Only the scheduler's global cap applies; aria2c cannot share it by priority
+        self.bandwidth = bandwidth or get_scheduler()
 
     def _find_aria2(self):
         # Default path from extraction
@@ -18,25 +56,43 @@ class Aria2Manager:
         Parses a line of aria2c output.
         Example: [#123456 1.2MiB/4.5MiB(26%) CN:1 DL:1.2MiB ETA:2s]
         """
-        # Regex to capture percentage, download speed, and ETA
-        # Pattern: (PERCENT%) ... DL:SPEED ... ETA:TIME
-        pattern = r"\((?P<percent>\d+)%\).*?DL:(?P<speed>[^\]\s]+).*?ETA:(?P<eta>[^\]\s]+)"
+        # Regex to capture sizes, percentage, download speed, and ETA
+        # Pattern: DONE/TOTAL(PERCENT%) ... DL:SPEED ... ETA:TIME
+        pattern = (r"(?:(?P<done>[\d.]+[KMG]?i?B)/(?P<total>[\d.]+[KMG]?i?B))?"
+                   r"\((?P<percent>\d+)%\).*?DL:(?P<speed>[^\]\s]+).*?ETA:(?P<eta>[^\]\s]+)")
         match = re.search(pattern, line)
         if match:
             return {
                 'percentage': int(match.group('percent')),
                 'speed': match.group('speed'),
-                'eta': match.group('eta')
+                'eta': match.group('eta'),
+                'completed_bytes': _parse_size(match.group('done')),
+                'total_bytes': _parse_size(match.group('total'))
             }
         return None
 
-    def download(self, url, output_dir, filename=None, callback=None):
+    def download(self, url, output_dir, filename=None, callback=None, checksum=None, checksum_type="md5",
+                 priority=DEFAULT_PRIORITY):
         """
         Spawns aria2c to download a file.
+
+        If checksum (a hex digest in checksum_type) is given, aria2c verifies the
+        finished file against it and reports failure on mismatch. Algorithms
+        aria2c does not know (e.g. blake2b) are left to the caller to verify.
+        The bandwidth cap in force at spawn time is passed to aria2c; priority
+        is accepted for interface compatibility only.
         """
         args = [self.aria2_exe, url, "--dir", output_dir]
         if filename:
             args.extend(["--out", filename])
+            if _has_aria2_control_file(output_dir, filename):
+                args.append("--continue=true")
+        if checksum:
+            aria2_type = ARIA2_CHECKSUM_TYPES.get(checksum_type)
+            if aria2_type:
+                args.append(f"--checksum={aria2_type}={checksum.lower()}")
+        if self.bandwidth.rate:
+            args.append(f"--max-overall-download-limit={self.bandwidth.rate}")
         
         # Additional recommended flags
         args.extend(["--console-log-level=info", "--summary-interval=1", "--check-certificate=false"])
@@ -57,30 +113,1042 @@ class Aria2Manager:
         process.wait()
         return process.returncode == 0
 
+class Aria2RpcManager:
+    """
+    Drives one long-lived "aria2c --enable-rpc" daemon over JSON-RPC.
+
+    Downloads are submitted in batches with system.multicall and tracked by
+    polling aria2.tellStatus, so there is no per-file process spawn and the
+    daemon keeps its connections warm across files. Pass rpc_url to attach
+    to a daemon that is already running instead of spawning one.
+    """
+    checksum_types = frozenset(ARIA2_CHECKSUM_TYPES)
+
+    STATUS_KEYS = ["gid", "status", "totalLength", "completedLength", "downloadSpeed", "errorCode", "errorMessage"]
+
+    def __init__(self, aria2_exe=None, rpc_url=None, secret=None, port=None, max_concurrent=16,
+                 poll_interval=0.5, client=None, bandwidth=None):
+        self.aria2_exe = aria2_exe or Aria2Manager()._find_aria2()
+        self.spawn = rpc_url is None
+        self.port = port or self._free_port()
+        self.rpc_url = rpc_url or f"http://127.0.0.1:{self.port}/jsonrpc"
+        self.secret = secret if secret is not None else os.urandom(16).hex()
+        self.max_concurrent = max_concurrent
+        self.poll_interval = poll_interval
+        self.client = client or httpx.Client(timeout=10.0)
+        self.process = None
+        self._request_id = 0
+        self._lock = threading.Lock()
+        # The daemon enforces the scheduler's global cap itself; kept in sync while polling
+        self.bandwidth = bandwidth or get_scheduler()
+        # aria2 starts unlimited
+        self._applied_rate = 0
+
+    @staticmethod
+    def _free_port():
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    def _token(self):
+        return [f"token:{self.secret}"] if self.secret else []
+
+    def _call(self, method, *params):
+        """
+        Performs one JSON-RPC call.
+
+        Raises:
+            RuntimeError: If aria2 returns an error
+            httpx.HTTPError: If the daemon cannot be reached
+        """
+        with self._lock:
+            self._request_id += 1
+            request_id = self._request_id
+        response = self.client.post(self.rpc_url, json={
+            "jsonrpc": "2.0", "id": str(request_id), "method": method, "params": list(params)
+        })
+        body = response.json()
+        if "error" in body:
+            raise RuntimeError(f"aria2 {method} failed: {body['error'].get('message')}")
+        return body["result"]
+
+    def _multicall(self, calls):
+        """Runs [(method, params), ...] in one round trip; returns results or fault dicts in order."""
+        if not calls:
+            return []
+        results = self._call("system.multicall", [
+            {"methodName": method, "params": self._token() + list(params)} for method, params in calls
+        ])
+        # Successful entries are wrapped in a one-element list, faults are structs
+        return [r[0] if isinstance(r, list) else r for r in results]
+
+    def start(self, timeout=10.0):
+        """
+        Spawns the daemon (unless attaching to rpc_url) and waits until it answers.
+
+        Raises:
+            OSError: If aria2c cannot be started or never becomes reachable
+        """
+        if self.spawn and self.process is None:
+            args = [
+                self.aria2_exe, "--enable-rpc", f"--rpc-listen-port={self.port}", "--rpc-listen-all=false",
+                f"--rpc-secret={self.secret}", f"--max-concurrent-downloads={self.max_concurrent}",
+                "--allow-overwrite=true", "--auto-file-renaming=false",
+                "--console-log-level=warn", "--check-certificate=false",
+                f"--max-overall-download-limit={self.bandwidth.rate}"
+            ]
+            self._applied_rate = self.bandwidth.rate
+            self.process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._call("aria2.getVersion", *self._token())
+                return self
+            except (httpx.HTTPError, RuntimeError, ValueError) as e:
+                if self.process is not None and self.process.poll() is not None:
+                    raise OSError(f"aria2c exited with code {self.process.returncode}")
+                if time.monotonic() >= deadline:
+                    self.stop()
+                    raise OSError(f"aria2 RPC not reachable at {self.rpc_url}: {e}")
+                time.sleep(0.1)
+
+    def stop(self):
+        """Shuts the daemon down if this manager spawned it."""
+        if self.process is None:
+            return
+        try:
+            self._call("aria2.shutdown", *self._token())
+            self.process.wait(timeout=5)
+        except (httpx.HTTPError, RuntimeError, ValueError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def _sync_rate(self):
+        """Pushes a changed bandwidth cap to the daemon (0 lifts it)."""
+        rate = self.bandwidth.rate
+        if rate != self._applied_rate:
+            self._call("aria2.changeGlobalOption", *self._token(), {"max-overall-download-limit": str(rate)})
+            self._applied_rate = rate
+
+    @staticmethod
+    def _options(task):
+        options = {"dir": str(task['output_dir'])}
+        if task.get('filename'):
+            options["out"] = task['filename']
+            if _has_aria2_control_file(task['output_dir'], task['filename']):
+                options["continue"] = "true"
+        aria2_type = ARIA2_CHECKSUM_TYPES.get(task.get('checksum_type', 'md5'))
+        if task.get('checksum') and aria2_type:
+            options["checksum"] = f"{aria2_type}={task['checksum'].lower()}"
+        return options
+
+    @staticmethod
+    def _progress(status):
+        total = int(status.get("totalLength", 0))
+        done = int(status.get("completedLength", 0))
+        speed = int(status.get("downloadSpeed", 0))
+        eta = f"{(total - done) // speed}s" if speed and total else "n/a"
+        return {
+            'percentage': int(done * 100 / total) if total else 0,
+            'speed': _format_rate(speed),
+            'eta': eta,
+            'completed_bytes': done,
+            'total_bytes': total or None
+        }
+
+    def download_batch(self, tasks, callback=None, on_complete=None, cancel=None):
+        """
+        Submits every task in one multicall and polls until all have finished.
+
+        Tasks are queued in the order given, so callers pass them highest
+        priority first; the bandwidth cap is re-applied on every poll.
+
+        Args:
+            tasks: DownloadQueue task dicts
+            callback: Receives progress dicts tagged with 'file'
+            on_complete: Called with (task index, outcome) as each task finishes
+            cancel: Optional threading.Event; once set, downloads still waiting
+                in the daemon are removed and reported with 'cancelled': True
+
+        Returns:
+            list: {'success': bool, 'error': str or None} per task, in order
+        """
+        self._sync_rate()
+        added = self._multicall([
+            ("aria2.addUri", [[task['url']], self._options(task)]) for task in tasks
+        ])
+        outcomes = [None] * len(tasks)
+        gids = {}
+        for i, gid in enumerate(added):
+            if isinstance(gid, str):
+                gids[gid] = i
+            else:
+                outcomes[i] = {'success': False, 'error': gid.get('faultString', 'addUri failed')}
+                if on_complete:
+                    on_complete(i, outcomes[i])
+
+        # Waiting downloads removed because cancel was set
+        withdrawn = set()
+        while gids:
+            self._sync_rate()
+            statuses = self._multicall([("aria2.tellStatus", [gid, self.STATUS_KEYS]) for gid in gids])
+            finished, withdraw = [], []
+            for gid, status in zip(list(gids), statuses):
+                task = tasks[gids[gid]]
+                state = status.get("status") if isinstance(status, dict) else "error"
+                if callback and state in ("active", "complete"):
+                    callback({**self._progress(status), 'file': task.get('filename') or task['url']})
+                if state == "complete":
+                    outcomes[gids[gid]] = {'success': True, 'error': None}
+                    finished.append(gid)
+                elif state == "removed" and gid in withdrawn:
+                    outcomes[gids[gid]] = {'success': False, 'error': DOWNLOAD_CANCELLED, 'cancelled': True}
+                    finished.append(gid)
+                elif state in ("error", "removed"):
+                    message = status.get("errorMessage") or status.get("faultString") or state
+                    outcomes[gids[gid]] = {'success': False, 'error': message}
+                    finished.append(gid)
+                elif state in ("waiting", "paused") and cancel is not None and cancel.is_set() \
+                        and gid not in withdrawn:
+                    # Downloads already running finish; queued ones never start
+                    withdraw.append(gid)
+            if withdraw:
+                self._multicall([("aria2.remove", [gid]) for gid in withdraw])
+                withdrawn.update(withdraw)
+            if finished:
+                self._multicall([("aria2.removeDownloadResult", [gid]) for gid in finished])
+                for gid in finished:
+                    index = gids.pop(gid)
+                    if on_complete:
+                        on_complete(index, outcomes[index])
+            if gids:
+                time.sleep(self.poll_interval)
+        return outcomes
+
+    def download(self, url, output_dir, filename=None, callback=None, checksum=None, checksum_type="md5",
+                 priority=DEFAULT_PRIORITY):
+        """Single-file interface matching Aria2Manager.download."""
+        task = {'url': url, 'output_dir': output_dir, 'filename': filename,
+                'checksum': checksum, 'checksum_type': checksum_type}
+        untagged = (lambda p: callback({k: v for k, v in p.items() if k != 'file'})) if callback else None
+        return self.download_batch([task], untagged)[0]['success']
+
+def create_aria2_manager(prefer_rpc=True, aria2_exe=None):
+    """
+    Returns a started Aria2RpcManager, or the per-file subprocess Aria2Manager
+    if the daemon cannot be started.
+    """
+    if prefer_rpc:
+        try:
+            return Aria2RpcManager(aria2_exe=aria2_exe).start()
+        except (OSError, httpx.HTTPError) as e:
+            logger.warning(f"aria2 RPC daemon unavailable ({e}); using one aria2c process per file")
+    return Aria2Manager(aria2_exe)
+
+_SIZE_UNITS = {"B": 1, "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3}
+
+def _parse_size(text):
+    """Parses an aria2c size such as "1.2MiB" into bytes; None if absent or unknown."""
+    match = re.fullmatch(r"([\d.]+)([KMG]?i?B)", text or "")
+    if not match or match.group(2) not in _SIZE_UNITS:
+        return None
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+def _format_rate(bytes_per_sec):
+    """Formats a byte rate the way aria2c prints DL: (e.g. "1.2MiB")."""
+    for unit in ("B", "KiB", "MiB"):
+        if bytes_per_sec < 1024:
+            return f"{bytes_per_sec:.1f}{unit}"
+        bytes_per_sec /= 1024
+    return f"{bytes_per_sec:.1f}GiB"
+
+def _load_resume_state(store, key, identity):
+    """Returns saved resume state for key if it belongs to the same url/checksum."""
+    if store is None:
+        return None
+    state = store.get_resume_state(key)
+    if state and all(state.get(k) == v for k, v in identity.items()):
+        return state
+    if state:
+        store.clear_resume_state(key)
+    return None
+
+def _durable(f):
+    """Flushes f to stable storage so resume state never claims unwritten bytes."""
+    f.flush()
+    os.fsync(f.fileno())
+
+class HttpDownloader:
+    """
+    Streams a file over HTTP and hashes it as it is written.
+
+    Drop-in replacement for Aria2Manager when a checksum is known: the digest
+    is complete the moment the last byte lands, so the finished file never has
+    to be read back. Data is written to "<name>.part" and only moved into place
+    once the digest matches; a mismatch deletes the partial file.
+
+    With a resume_store (OperationLogger), the number of bytes safely on disk is
+    persisted as the download runs. A later attempt continues from there with a
+    Range/If-Range request, re-hashing only the existing prefix.
+
+    Every chunk is metered through a BandwidthScheduler (the process-wide one
+    unless another is given), which is unlimited until a cap is set.
+    """
+    # Algorithms download() verifies while writing the file
+    checksum_types = frozenset(SUPPORTED_ALGORITHMS)
+
+    def __init__(self, timeout=30.0, chunk_size=1024 * 1024, progress_interval=1.0, client=None,
+                 resume_store=None, bandwidth=None):
+        self.client = client or httpx.Client(timeout=timeout, follow_redirects=True)
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self.resume_store = resume_store
+        self.bandwidth = bandwidth or get_scheduler()
+
+    def download(self, url, output_dir, filename=None, callback=None, checksum=None, checksum_type="md5",
+                 priority=DEFAULT_PRIORITY):
+        """
+        Downloads url into output_dir, verifying checksum (a hex digest in
+        checksum_type) incrementally. priority is the bandwidth class
+        ("base", "pack" or "language") the transfer draws from.
+
+        Fails fast if the server errors or sends more bytes than it announced,
+        without waiting for the rest of the body. Connection failures keep the
+        partial file for resuming when a resume_store is attached.
+
+        Returns:
+            bool: True if the file was downloaded and (if given) its digest matched
+        """
+        filename = filename or os.path.basename(httpx.URL(url).path) or "download"
+        target = os.path.join(output_dir, filename)
+        part_file = target + ".part"
+        hasher = hashlib.new(checksum_type) if checksum else None
+        identity = {'url': url, 'checksum': checksum}
+
+        state = _load_resume_state(self.resume_store, target, identity)
+        offset = 0
+        if state and os.path.exists(part_file) and os.path.getsize(part_file) >= state['bytes_written']:
+            offset = state['bytes_written']
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            if state.get('validator'):
+                # Server sends the whole file instead if it changed since
+                headers["If-Range"] = state['validator']
+
+        transfer = self.bandwidth.open(filename, priority)
+        try:
+            os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+            with self.client.stream("GET", url, headers=headers) as response:
+                response.raise_for_status()
+                if offset and (response.status_code != 206 or
+                               not response.headers.get("Content-Range", "").startswith(f"bytes {offset}-")):
+                    logger.info(f"Server did not resume {url} at byte {offset}; starting over")
+                    offset = 0
+                length = int(response.headers.get("Content-Length", 0)) or None
+                total = offset + length if length is not None else None
+                validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+                received = offset
+                start = last_emit = time.monotonic()
+                with open(part_file, "r+b" if offset else "wb") as f:
+                    if offset:
+                        logger.info(f"Resuming {filename} at byte {offset}")
+                        # Bytes past the last durable checkpoint are not trusted
+                        f.truncate(offset)
+                        if hasher is not None:
+                            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                                hasher.update(chunk)
+                        f.seek(offset)
+                    for chunk in response.iter_bytes(self.chunk_size):
+                        f.write(chunk)
+                        if hasher is not None:
+                            hasher.update(chunk)
+                        received += len(chunk)
+                        transfer.consume(len(chunk))
+                        if total is not None and received > total:
+                            raise ValueError(f"Server sent more than the announced {total} bytes")
+
+                        now = time.monotonic()
+                        if now - last_emit >= self.progress_interval:
+                            last_emit = now
+                            if self.resume_store is not None:
+                                _durable(f)
+                                self.resume_store.save_resume_state(target, {
+                                    **identity, 'bytes_written': received, 'validator': validator
+                                })
+                            if callback:
+                                callback(self._progress(received, total, now - start, base=offset))
+
+            if total is not None and received != total:
+                raise ValueError(f"Download truncated: got {received} of {total} bytes")
+            if hasher is not None and hasher.hexdigest().upper() != checksum.upper():
+                raise ValueError(f"{checksum_type.upper()} mismatch for {filename}")
+
+            os.replace(part_file, target)
+            if self.resume_store is not None:
+                self.resume_store.clear_resume_state(target)
+            if callback:
+                callback(self._progress(received, received, time.monotonic() - start, base=offset))
+            return True
+        except (httpx.HTTPError, ValueError, OSError) as e:
+            logger.error(f"Download of {url} failed: {e}")
+            if self.resume_store is not None and isinstance(e, httpx.TransportError):
+                logger.info(f"Keeping partial {part_file} for resume")
+                return False
+            if os.path.exists(part_file):
+                os.remove(part_file)
+            if self.resume_store is not None:
+                self.resume_store.clear_resume_state(target)
+            return False
+        finally:
+            transfer.close()
+
+    @staticmethod
+    def _progress(received, total, elapsed, base=0):
+        # base: bytes already on disk before this session, excluded from the rate
+        rate = (received - base) / elapsed if elapsed > 0 else 0
+        if total:
+            eta = f"{int((total - received) / rate)}s" if rate else "n/a"
+            percentage = int(received * 100 / total)
+        else:
+            eta, percentage = "n/a", 0
+        return {'percentage': percentage, 'speed': _format_rate(rate), 'eta': eta,
+                'completed_bytes': received, 'total_bytes': total}
+
+class SegmentedDownloader:
+    """
+    Pure-Python replacement for aria2c's split downloads, built on asyncio.
+
+    Files of at least min_segmented_size are fetched as segment_size Range
+    requests over up to max_connections pooled connections and written at
+    their offsets into a preallocated "<name>.part" file. Segments are hashed
+    in file order as the contiguous prefix completes; at most `window`
+    finished segments wait in memory for an earlier one, which bounds memory
+    and still means the file is never read back. Smaller files, and servers
+    without range support, are streamed over a single connection.
+
+    With a resume_store (OperationLogger), completed segments and their MD5s
+    are persisted as they land. A later attempt reads those segments back
+    from the .part file instead of fetching them, re-fetching any whose MD5 no
+    longer matches.
+
+    All connections of one download share a single bandwidth transfer, so a
+    file counts once against the cap however many segments are in flight.
+    """
+    # Algorithms download() verifies while writing the file
+    checksum_types = frozenset(SUPPORTED_ALGORITHMS)
+
+    def __init__(self, segment_size=8 * 1024 * 1024, max_connections=8, min_segmented_size=16 * 1024 * 1024,
+                 timeout=30.0, retries=3, progress_interval=1.0, window=None, resume_store=None, bandwidth=None):
+        self.segment_size = segment_size
+        self.max_connections = max_connections
+        self.min_segmented_size = min_segmented_size
+        self.timeout = timeout
+        self.retries = retries
+        self.progress_interval = progress_interval
+        self.window = window or max_connections * 2
+        self.resume_store = resume_store
+        self.bandwidth = bandwidth or get_scheduler()
+
+    def download(self, url, output_dir, filename=None, callback=None, checksum=None, checksum_type="md5",
+                 priority=DEFAULT_PRIORITY):
+        """
+        Downloads url into output_dir; same interface as HttpDownloader.download.
+
+        Runs its own event loop, so it can be called from DownloadQueue's
+        worker threads.
+
+        Returns:
+            bool: True if the file was downloaded and (if given) its digest matched
+        """
+        filename = filename or os.path.basename(httpx.URL(url).path) or "download"
+        target = os.path.join(output_dir, filename)
+        part_file = target + ".part"
+        transfer = self.bandwidth.open(filename, priority)
+        try:
+            os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+            digest = asyncio.run(self._download(url, part_file, callback, checksum_type if checksum else None,
+                                                target, {'url': url, 'checksum': checksum}, transfer))
+            if checksum and digest != checksum.upper():
+                raise ValueError(f"{checksum_type.upper()} mismatch for {filename}")
+            os.replace(part_file, target)
+            if self.resume_store is not None:
+                self.resume_store.clear_resume_state(target)
+            return True
+        except (httpx.HTTPError, ValueError, OSError) as e:
+            logger.error(f"Download of {url} failed: {e}")
+            if self.resume_store is not None and isinstance(e, httpx.TransportError):
+                logger.info(f"Keeping partial {part_file} for resume")
+                return False
+            if os.path.exists(part_file):
+                os.remove(part_file)
+            if self.resume_store is not None:
+                self.resume_store.clear_resume_state(target)
+            return False
+        finally:
+            transfer.close()
+
+    async def _download(self, url, part_file, callback, algorithm, target=None, identity=None, transfer=None):
+        pool_size = self._pool_size()
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        async with httpx.AsyncClient(timeout=self.timeout, follow_redirects=True, limits=limits) as client:
+            size = await self._probe(client, url)
+            progress = _ProgressTracker(size, callback, self.progress_interval, transfer)
+            if size is None or size < self.min_segmented_size:
+                digest = await self._download_single(client, url, part_file, progress, algorithm)
+            else:
+                digest = await self._download_segmented(client, url, part_file, size, progress, algorithm,
+                                                        target, identity or {})
+            progress.finish()
+            return digest
+
+    def _pool_size(self):
+        """Connections the HTTP client may keep open per download."""
+        return self.max_connections
+
+    def _make_fetcher(self, client, url):
+        """Returns (fetch(start, end, progress) coroutine function, concurrent segment limit)."""
+        async def fetch(start, end, progress):
+            return await self._fetch_segment(client, url, start, end, progress)
+        return fetch, self.max_connections
+
+    @staticmethod
+    async def _probe(client, url):
+        """Returns the file size if the server honours ranges, else None."""
+        # Streamed so a server that ignores Range does not send us the whole body here
+        async with client.stream("GET", url, headers={"Range": "bytes=0-0"}) as response:
+            response.raise_for_status()
+            content_range = response.headers.get("Content-Range", "")
+        if response.status_code != 206 or "/" not in content_range:
+            return None
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+
+    async def _download_single(self, client, url, part_file, progress, algorithm):
+        hasher = hashlib.new(algorithm) if algorithm else None
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            progress.total = int(response.headers.get("Content-Length", 0)) or None
+            with open(part_file, "wb") as f:
+                async for chunk in response.aiter_bytes():
+                    f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    progress.add(len(chunk))
+                    await progress.throttle(len(chunk))
+        if progress.total is not None and progress.received != progress.total:
+            raise ValueError(f"Download truncated: got {progress.received} of {progress.total} bytes")
+        return hasher.hexdigest().upper() if hasher else None
+
+    async def _download_segmented(self, client, url, part_file, size, progress, algorithm, target=None, identity=None):
+        segments = [(offset, min(offset + self.segment_size, size)) for offset in range(0, size, self.segment_size)]
+        hasher = hashlib.new(algorithm) if algorithm else None
+
+        # Segments already on disk from an interrupted attempt: index -> MD5
+        identity = {**(identity or {}), 'size': size, 'segment_size': self.segment_size}
+        state = _load_resume_state(self.resume_store, target, identity)
+        resuming = bool(state) and os.path.exists(part_file) and os.path.getsize(part_file) == size
+        on_disk = {int(i): d for i, d in state['segments'].items()} if resuming else {}
+        if on_disk:
+            logger.info(f"Resuming {target}: {len(on_disk)} of {len(segments)} segments already downloaded")
+        last_save = time.monotonic()
+        # Finished segments waiting for an earlier one before they can be hashed
+        unhashed = {}
+        next_to_hash = 0
+        window_open = asyncio.Condition()
+        fetch_segment, concurrency = self._make_fetcher(client, url)
+        connections = asyncio.Semaphore(concurrency)
+
+        def save_state(force=False):
+            nonlocal last_save
+            if self.resume_store is None or (not force and time.monotonic() - last_save < self.progress_interval):
+                return
+            last_save = time.monotonic()
+            _durable(f)
+            self.resume_store.save_resume_state(target, {
+                **identity, 'segments': {str(i): d for i, d in on_disk.items()},
+                'bytes_written': sum(segments[i][1] - segments[i][0] for i in on_disk)
+            })
+
+        with open(part_file, "r+b" if resuming else "wb") as f:
+            f.truncate(size)
+
+            async def fetch(index):
+                nonlocal next_to_hash
+                async with window_open:
+                    await window_open.wait_for(lambda: index < next_to_hash + self.window)
+                start, end = segments[index]
+                data = None
+                if index in on_disk:
+                    f.seek(start)
+                    data = f.read(end - start)
+                    if hashlib.md5(data).hexdigest() == on_disk[index]:
+                        progress.add(len(data))
+                    else:
+                        logger.warning(f"Resumed segment {start}-{end} of {target} is corrupt, fetching again")
+                        del on_disk[index]
+                        data = None
+                if data is None:
+                    async with connections:
+                        data = await fetch_segment(start, end, progress)
+                    # No await between seek and write, so segments cannot interleave
+                    f.seek(start)
+                    f.write(data)
+                    on_disk[index] = hashlib.md5(data).hexdigest()
+                    save_state()
+                async with window_open:
+                    unhashed[index] = data
+                    while next_to_hash in unhashed:
+                        chunk = unhashed.pop(next_to_hash)
+                        if hasher is not None:
+                            hasher.update(chunk)
+                        next_to_hash += 1
+                    window_open.notify_all()
+
+            tasks = [asyncio.ensure_future(fetch(i)) for i in range(len(segments))]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                save_state(force=True)
+                raise
+        return hasher.hexdigest().upper() if hasher else None
+
+    async def _fetch_segment(self, client, url, start, end, progress, retries=None):
+        """Fetches bytes [start, end), retrying transient failures."""
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            received = 0
+            try:
+                buf = bytearray()
+                async with client.stream("GET", url, headers={"Range": f"bytes={start}-{end - 1}"}) as response:
+                    if response.status_code != 206:
+                        raise ValueError(f"Server did not honour range request (HTTP {response.status_code})")
+                    async for chunk in response.aiter_bytes():
+                        buf += chunk
+                        received += len(chunk)
+                        progress.add(len(chunk))
+                        await progress.throttle(len(chunk))
+                if len(buf) != end - start:
+                    raise ValueError(f"Short segment: got {len(buf)} of {end - start} bytes")
+                return bytes(buf)
+            except asyncio.CancelledError:
+                progress.add(-received)
+                raise
+            except (httpx.TransportError, ValueError) as e:
+                progress.add(-received)
+                if attempt == retries:
+                    raise
+                logger.warning(f"Segment {start}-{end} of {url} failed ({e}), retrying")
+                await asyncio.sleep(0.2 * (attempt + 1))
+
+class StripedDownloader(SegmentedDownloader):
+    """
+    Segmented downloader that spreads the segments of one file across several
+    mirrors at once.
+
+    mirrors are MirrorDiscovery results (or plain {'url': ...} dicts) whose
+    'url' is a prefix serving the same tree; a download URL under one prefix is
+    fetched from the same path under every other. Connections are divided
+    between mirrors by measured throughput, and idle connections pull the
+    next segment, so faster mirrors naturally serve more of the file. A
+    segment running slow_factor times longer than the best mirror would need
+    is hedged on another mirror and the loser cancelled. Mirrors that keep
+    failing are dropped for the rest of the download.
+    """
+    def __init__(self, mirrors, max_connections=8, slow_factor=3.0, max_errors=3, **kwargs):
+        super().__init__(max_connections=max_connections, **kwargs)
+        self.mirrors = [m for m in mirrors if m.get("available", True)]
+        self.slow_factor = slow_factor
+        self.max_errors = max_errors
+
+    def mirror_urls(self, url):
+        """Returns [(mirror, url on that mirror)], starting with url's own mirror."""
+        prefixes = [m["url"].rstrip("/") + "/" for m in self.mirrors]
+        for prefix in prefixes:
+            if url.startswith(prefix):
+                suffix = url[len(prefix):]
+                own = [(m, url) for m, p in zip(self.mirrors, prefixes) if p == prefix][:1]
+                return own + [(m, p + suffix) for m, p in zip(self.mirrors, prefixes) if p != prefix]
+        return [({"url": url}, url)]
+
+    def _pool_size(self):
+        # Room for hedged requests on top of the regular connections
+        return self.max_connections + len(self.mirrors)
+
+    def _make_fetcher(self, client, url):
+        pool = _MirrorPool(self, client, self.mirror_urls(url))
+        return pool.fetch, pool.total_slots
+
+class _MirrorPool:
+    """Per-download mirror state for StripedDownloader."""
+    # Weight of the newest sample in each mirror's per-connection throughput average
+    EWMA_ALPHA = 0.3
+
+    def __init__(self, downloader, client, mirror_urls):
+        self.downloader = downloader
+        self.client = client
+        self.mirrors = []
+        for mirror, url in mirror_urls:
+            self.mirrors.append({
+                'url': url,
+                # Bytes/s per connection; seeded from discovery, refined by every segment
+                'rate': mirror.get("throughput"),
+                'weight': mirror.get("throughput") or mirror.get("weight") or 1,
+                'active': 0, 'errors': 0, 'bytes': 0
+            })
+        self._allocate(downloader.max_connections)
+        self.total_slots = sum(m['slots'] for m in self.mirrors)
+        self.changed = asyncio.Condition()
+
+    def _allocate(self, connections):
+        total_weight = sum(m['weight'] for m in self.mirrors)
+        for m in self.mirrors:
+            m['slots'] = max(1, round(connections * m['weight'] / total_weight))
+
+    def _healthy(self):
+        return [m for m in self.mirrors if m['errors'] < self.downloader.max_errors]
+
+    def _pick(self, exclude=()):
+        free = [m for m in self._healthy() if m['active'] < m['slots'] and m not in exclude]
+        if not free:
+            return None
+        # Unmeasured mirrors first so every mirror gets a throughput sample
+        return max(free, key=lambda m: float("inf") if m['rate'] is None else m['rate'])
+
+    async def _acquire(self, exclude=(), wait=True):
+        async with self.changed:
+            while True:
+                if not self._healthy():
+                    raise ValueError("All mirrors failed")
+                mirror = self._pick(exclude)
+                if mirror is not None or not wait:
+                    if mirror is not None:
+                        mirror['active'] += 1
+                    return mirror
+                await self.changed.wait()
+
+    async def _release(self, mirror):
+        async with self.changed:
+            mirror['active'] -= 1
+            self.changed.notify_all()
+
+    def _expected_seconds(self, length, exclude):
+        rates = [m['rate'] for m in self._healthy() if m['rate'] and m not in exclude]
+        return length / max(rates) if rates else None
+
+    async def _attempt(self, mirror, start, end, progress):
+        started = time.monotonic()
+        try:
+            data = await self.downloader._fetch_segment(self.client, mirror['url'], start, end, progress, retries=0)
+        except (httpx.TransportError, ValueError) as e:
+            mirror['errors'] += 1
+            logger.warning(f"Mirror {mirror['url']} failed segment {start}-{end}: {e}")
+            raise
+        finally:
+            await self._release(mirror)
+        elapsed = max(time.monotonic() - started, 1e-6)
+        sample = (end - start) / elapsed
+        mirror['rate'] = sample if mirror['rate'] is None else (
+            self.EWMA_ALPHA * sample + (1 - self.EWMA_ALPHA) * mirror['rate'])
+        mirror['bytes'] += end - start
+        mirror['errors'] = 0
+        return data
+
+    async def fetch(self, start, end, progress):
+        """Fetches [start, end) from the best free mirror, hedging stragglers and failing over."""
+        attempts = 0
+        while True:
+            mirror = await self._acquire()
+            running = {asyncio.ensure_future(self._attempt(mirror, start, end, progress)): mirror}
+            hedged = False
+            try:
+                while running:
+                    timeout = None
+                    if not hedged:
+                        expected = self._expected_seconds(end - start, exclude=(mirror,))
+                        timeout = expected * self.downloader.slow_factor if expected else None
+                    done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        # Straggler: race the same segment on another mirror if one is free
+                        hedged = True
+                        other = await self._acquire(exclude=tuple(running.values()), wait=False)
+                        if other is not None:
+                            logger.info(f"Segment {start}-{end} slow on {mirror['url']}, also trying {other['url']}")
+                            running[asyncio.ensure_future(self._attempt(other, start, end, progress))] = other
+                        continue
+                    for task in done:
+                        del running[task]
+                        if task.exception() is None:
+                            return task.result()
+            finally:
+                for task in running:
+                    task.cancel()
+                if running:
+                    await asyncio.gather(*running, return_exceptions=True)
+            attempts += 1
+            if attempts > self.downloader.retries:
+                raise ValueError(f"Segment {start}-{end} failed on every mirror")
+
+class _ProgressTracker:
+    """Throttles byte counts into aria2-style progress events, and bytes into the bandwidth cap."""
+    def __init__(self, total, callback, interval, transfer=None):
+        self.total = total
+        self.callback = callback
+        self.interval = interval
+        self.transfer = transfer
+        self.received = 0
+        self.start = self.last_emit = time.monotonic()
+
+    async def throttle(self, n):
+        """Waits until n received bytes fit under the download's bandwidth share."""
+        if self.transfer is not None:
+            await self.transfer.consume_async(n)
+
+    def add(self, n):
+        self.received += n
+        now = time.monotonic()
+        if self.callback and now - self.last_emit >= self.interval:
+            self.last_emit = now
+            self.callback(HttpDownloader._progress(self.received, self.total, now - self.start))
+
+    def finish(self):
+        if self.callback:
+            self.callback(HttpDownloader._progress(self.received, self.received, time.monotonic() - self.start))
+
+class QueueReport:
+    """
+    Outcome of DownloadQueue.process_all: one result per task, in queue order.
+
+    Each result is {'url', 'filename', 'success', 'error'}; tasks skipped
+    because the batch was cancelled also carry 'cancelled': True. Truthy only
+    when every task succeeded, so it can stand in for the old boolean.
+    """
+    def __init__(self, results):
+        self.results = results
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r['success']]
+
+    @property
+    def succeeded(self):
+        return [r for r in self.results if r['success']]
+
+    def __bool__(self):
+        return not self.failed
+
+    def __repr__(self):
+        return f"QueueReport({len(self.succeeded)} succeeded, {len(self.failed)} failed)"
+
 class DownloadQueue:
-    def __init__(self, manager):
+    def __init__(self, manager, max_concurrent=4, per_host=2):
         self.manager = manager
         self.tasks = []
+        # Downloads in flight at once, overall and against any single host
+        self.max_concurrent = max_concurrent
+        self.per_host = per_host
+
+    def add_task(self, url, output_dir, filename=None, checksum=None, checksum_type="md5",
+                 priority=DEFAULT_PRIORITY):
+        """
+        Queues a download. priority ("base", "pack" or "language") decides
+        which tasks start first and their share of a bandwidth cap.
 
-    def add_task(self, url, output_dir, filename=None):
+        Raises:
+            ValueError: If priority is not a known class
+        """
         self.tasks.append({
             'url': url,
             'output_dir': output_dir,
-            'filename': filename
+            'filename': filename,
+            'checksum': checksum,
+            'checksum_type': checksum_type,
+            'priority': validate_priority(priority)
         })
 
     def clear(self):
         self.tasks = []
 
-    def process_all(self, callback=None):
-        """Processes all tasks in the queue."""
-        results = []
-        for task in self.tasks:
+    def verifies_checksum(self, checksum_type):
+        """
+        True if downloads with this checksum type are verified by the manager itself.
+
+        Only the manager's own checksum_types count; managers without one
+        leave every checksum to the caller.
+        """
+        return checksum_type in getattr(self.manager, 'checksum_types', ())
+
+    def _priority_order(self):
+        """Task indices, highest priority first and queue order within a class."""
+        return sorted(range(len(self.tasks)), key=lambda i: self._rank(self.tasks[i]))
+
+    @staticmethod
+    def _rank(task):
+        return PRIORITY_CLASSES.index(task.get('priority', DEFAULT_PRIORITY))
+
+    @staticmethod
+    def _host(url):
+        try:
+            return httpx.URL(url).host or url
+        except (httpx.InvalidURL, TypeError):
+            return url
+
+    def _run_task(self, task, callback):
+        kwargs = {}
+        if task.get('checksum'):
+            kwargs = {'checksum': task['checksum'], 'checksum_type': task.get('checksum_type', 'md5')}
+        # Managers without a bandwidth scheduler predate the priority argument
+        if getattr(self.manager, 'bandwidth', None) is not None:
+            kwargs['priority'] = task.get('priority', DEFAULT_PRIORITY)
+        file_callback = None
+        if callback:
+            # Tag progress with its file so concurrent downloads can be told apart
+            file_callback = lambda p: callback({**p, 'file': task['filename'] or task['url']})
+        try:
             success = self.manager.download(
                 task['url'],
                 task['output_dir'],
                 filename=task['filename'],
-                callback=callback
+                callback=file_callback,
+                **kwargs
             )
-            results.append(success)
-        return all(results)
+            error = None if success else "Download failed"
+        except Exception as e:
+            logger.error(f"Download of {task['url']} raised: {e}")
+            success, error = False, str(e)
+        return {'url': task['url'], 'filename': task['filename'], 'success': bool(success), 'error': error}
+
+    def _result(self, index, outcome):
+        task = self.tasks[index]
+        return {'url': task['url'], 'filename': task['filename'], **outcome}
+
+    def _process_batch(self, callback, on_complete=None, cancel=None):
+        # Batch-capable managers (the aria2 RPC daemon) schedule downloads themselves,
+        # in submission order, so submit the highest priority first
+        order = self._priority_order()
+        reported = set()
+        kwargs = {'cancel': cancel} if cancel is not None else {}
+        if on_complete:
+            def batch_complete(position, outcome):
+                reported.add(order[position])
+                on_complete(order[position], self._result(order[position], outcome))
+            kwargs['on_complete'] = batch_complete
+        try:
+            submitted = self.manager.download_batch([self.tasks[i] for i in order], callback, **kwargs)
+        except Exception as e:
+            logger.error(f"Batch download failed: {e}")
+            submitted = [{'success': False, 'error': str(e)}] * len(self.tasks)
+        outcomes = [None] * len(self.tasks)
+        for i, outcome in zip(order, submitted):
+            outcomes[i] = outcome
+            if on_complete and i not in reported:
+                on_complete(i, self._result(i, outcome))
+        report = QueueReport([self._result(i, outcome) for i, outcome in enumerate(outcomes)])
+        self._log_failures(report)
+        return report
+
+    @staticmethod
+    def _log_failures(report):
+        cancelled = 0
+        for failure in report.failed:
+            if failure.get('cancelled'):
+                cancelled += 1
+            else:
+                logger.error(f"Download failed: {failure['url']} ({failure['error']})")
+        if cancelled:
+            logger.info(f"Skipped {cancelled} queued download(s) after cancellation")
+
+    def process_all(self, callback=None, on_complete=None, cancel=None):
+        """
+        Processes all tasks in the queue concurrently.
+
+        At most max_concurrent downloads run at once and at most per_host
+        against one host. Higher priority tasks start first; hosts offering
+        tasks of the same priority take turns (round-robin), so a long list of
+        files from one mirror cannot starve the others. Managers that accept
+        whole batches (Aria2RpcManager) get every task in one submission.
+
+        on_complete, if given, is called with (task index, result) as each
+        task finishes, from the thread that ran it; blocking in it holds
+        that download slot, which lets callers apply backpressure.
+
+        Once cancel (a threading.Event) is set, tasks that have not started
+        are skipped and reported with 'cancelled': True; downloads already
+        running finish.
+
+        Returns:
+            QueueReport: per-task results; truthy if every task succeeded
+        """
+        if callable(getattr(self.manager, 'download_batch', None)):
+            return self._process_batch(callback, on_complete, cancel)
+
+        results = [None] * len(self.tasks)
+        if callback:
+            # Progress arrives from several threads; deliver it one event at a time
+            callback_lock = threading.Lock()
+            user_callback = callback
+
+            def callback(progress):
+                with callback_lock:
+                    user_callback(progress)
+
+        # Per-host queue of task indices in priority order, visited round-robin
+        pending = {}
+        for i in self._priority_order():
+            pending.setdefault(self._host(self.tasks[i]['url']), deque()).append(i)
+        hosts = deque(pending)
+        active = {host: 0 for host in pending}
+        cond = threading.Condition()
+
+        def next_task():
+            # Called with cond held; returns (host, index) or None if nothing is eligible
+            eligible = [h for h in hosts if pending[h] and active[h] < self.per_host]
+            if not eligible:
+                return None
+            best = min(self._rank(self.tasks[pending[h][0]]) for h in eligible)
+            for _ in range(len(hosts)):
+                host = hosts[0]
+                hosts.rotate(-1)
+                if host in eligible and self._rank(self.tasks[pending[host][0]]) == best:
+                    active[host] += 1
+                    return host, pending[host].popleft()
+            return None
+
+        def worker():
+            while True:
+                with cond:
+                    picked = next_task()
+                    while picked is None:
+                        if not any(pending.values()):
+                            return
+                        cond.wait()
+                        picked = next_task()
+                host, index = picked
+                try:
+                    if cancel is not None and cancel.is_set():
+                        results[index] = self._result(index, {'success': False, 'error': DOWNLOAD_CANCELLED,
+                                                              'cancelled': True})
+                    else:
+                        results[index] = self._run_task(self.tasks[index], callback)
+                    if on_complete:
+                        on_complete(index, results[index])
+                finally:
+                    with cond:
+                        active[host] -= 1
+                        cond.notify_all()
+
+        workers = max(1, min(self.max_concurrent, len(self.tasks)))
+        threads = [threading.Thread(target=worker, name=f"download-{n}", daemon=True) for n in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        report = QueueReport(results)
+        self._log_failures(report)
+        return report
@@ -8,27 +8,63 @@ Provides:
 - Version: Semantic version parsing and comparison
 """
 
-import hashlib
 import os
 import json
+import time
+import random
+import hashlib
 import logging
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from hash_backends import ThreadPoolBackend, digest_file_multi, validate_algorithm
 from logging_system import get_logger
 
 # Setup logging
 logger = get_logger()
 
 class VerificationEngine:
-    def __init__(self, max_workers=None):
+    def __init__(self, max_workers=None, cache=None, progress_interval=0.5, backend=None,
+                 algorithm="md5", extra_algorithms=()):
         self.max_workers = max_workers or os.cpu_count()
+        # Optional HashCache; unchanged files are answered from it without reading
+        self.cache = cache
+        # Minimum seconds between byte-level progress events in verify_files
+        self.progress_interval = progress_interval
+        # Executes the actual hashing of cache misses (see hash_backends)
+        self.backend = backend or ThreadPoolBackend(max_workers=self.max_workers)
+        self.set_algorithms(algorithm, extra_algorithms)
+
+    def set_algorithms(self, algorithm="md5", extra_algorithms=()):
+        """
+        Selects the hash algorithm used for verification.
+
+        Extra algorithms are computed in the same read pass and stored in the hash
+        cache, so a manifest migrating between algorithms costs one read per file.
+
+        Raises:
+            ValueError: If an algorithm is not supported
+        """
+        self.algorithm = validate_algorithm(algorithm)
+        extras = [validate_algorithm(a) for a in extra_algorithms]
+        self.algorithms = (self.algorithm,) + tuple(a for a in dict.fromkeys(extras) if a != self.algorithm)
 
     @staticmethod
-    def hash_file(file_path):
+    def _digest_file(file_path, algorithms=("md5",), on_bytes=None):
+        return digest_file_multi(file_path, algorithms, on_bytes=on_bytes)
+
+    def hash_file(self, file_path, on_bytes=None, algorithm=None):
         """
-        Calculates MD5 hash of a file using optimized file_digest.
+        Calculates the hash of a file using optimized file_digest.
+
+        Uses the engine's algorithm (MD5 unless configured otherwise) and computes
+        any extra algorithms in the same pass. If a hash cache is attached and the
+        file's stat tuple is unchanged since it was last hashed, the cached digest
+        is returned without reading the file.
 
         Args:
             file_path: Path to the file to hash
+            on_bytes: Optional callable receiving the byte count of each chunk read
+            algorithm: Override the algorithm for this call
 
         Returns:
             str: Uppercase hexadecimal hash string, or None if file cannot be hashed
@@ -38,30 +74,328 @@ class VerificationEngine:
             PermissionError: If the file cannot be read due to permissions
             IOError: If there's an error reading the file
         """
+        algorithm = validate_algorithm(algorithm) if algorithm else self.algorithm
+        algorithms = self.algorithms if algorithm == self.algorithm else (algorithm,)
         try:
-            with open(file_path, 'rb') as f:
-                return hashlib.file_digest(f, "md5").hexdigest().upper()
-        except FileNotFoundError as e:
-            logger.error(f"File not found when hashing: {file_path}")
+            if self.cache is None:
+                return self._digest_file(file_path, algorithms, on_bytes)[algorithm]
+
+            cached = self.cache.lookup(file_path, algorithm)
+            if cached is not None:
+                return cached
+
+            stat_key = self.cache.stat_key(file_path)
+            digests = self._digest_file(file_path, algorithms, on_bytes)
+            self._record_digests(file_path, digests, stat_key)
+            return digests[algorithm]
+        except Exception as e:
+            self._log_hash_error(file_path, e)
             raise
-        except PermissionError as e:
+
+    @staticmethod
+    def _log_hash_error(file_path, e):
+        if isinstance(e, FileNotFoundError):
+            logger.error(f"File not found when hashing: {file_path}")
+        elif isinstance(e, PermissionError):
             logger.error(f"Permission denied reading file for hash: {file_path}")
-            raise
-        except IOError as e:
+        elif isinstance(e, IOError):
             logger.error(f"IO error while hashing file {file_path}: {e}")
-            raise
-        except Exception as e:
+        else:
             logger.exception(f"Unexpected error hashing file {file_path}: {e}")
+
+    def record_hash(self, file_path, digest, algorithm=None):
+        """Inserts an already-verified digest (e.g. after patching) into the cache."""
+        if self.cache is not None:
+            self.cache.record(file_path, digest, algorithm or self.algorithm)
+
+    def _record_digests(self, file_path, digests, stat_key):
+        if self.cache is not None:
+            for algorithm, digest in digests.items():
+                self.cache.record(file_path, digest, algorithm, stat_key=stat_key)
+
+    def verify_files(self, file_paths, progress_callback=None):
+        """
+        Verifies multiple files in parallel on the configured hashing backend.
+
+        Cache lookups happen on the calling thread; only misses are handed to the
+        backend. With a progress_callback, events are emitted from the calling
+        thread: one per file in completion order, plus periodic byte-level
+        updates while large files are being read.
+
+        Returns:
+            dict: path -> uppercase hash, in input order
+        """
+        results = {}
+        stat_keys = {}
+        misses = []
+        for p in file_paths:
+            cached = self.cache.lookup(p, self.algorithm) if self.cache is not None else None
+            if cached is not None:
+                results[p] = cached
+            else:
+                if self.cache is not None:
+                    stat_keys[p] = self.cache.stat_key(p)
+                misses.append(p)
+
+        if progress_callback is None:
+            if misses:
+                with self.backend.executor() as executor:
+                    futures = [self.backend.submit(executor, p, algorithms=self.algorithms) for p in misses]
+                    for p, future in zip(misses, futures):
+                        results[p] = self._collect(p, future, stat_keys.get(p))
+        else:
+            self._hash_with_progress(file_paths, misses, stat_keys, results, progress_callback)
+
+        # Return a dictionary of path -> hash
+        return {p: results[p] for p in file_paths}
+
+    def _collect(self, file_path, future, stat_key):
+        try:
+            digests = future.result()
+        except Exception as e:
+            self._log_hash_error(file_path, e)
             raise
+        self._record_digests(file_path, digests, stat_key)
+        return digests[self.algorithm]
+
+    def _hash_with_progress(self, file_paths, misses, stat_keys, results, progress_callback):
+        sizes = {}
+        for p in file_paths:
+            try:
+                sizes[p] = os.path.getsize(p)
+            except OSError:
+                sizes[p] = 0
+        bytes_total = sum(sizes.values())
+
+        # Bytes read so far per file; workers only ever touch their own key
+        bytes_read = {p: (sizes[p] if p in results else 0) for p in file_paths}
+        lock = threading.Lock()
+        completed = 0
+
+        def make_counter(path):
+            def on_bytes(n):
+                with lock:
+                    bytes_read[path] += n
+            return on_bytes
+
+        def snapshot(file_path=None):
+            with lock:
+                bytes_done = sum(bytes_read.values())
+            elapsed = time.monotonic() - start
+            event = {
+                'status': 'hashing',
+                'current': completed,
+                'total': len(file_paths),
+                'bytes_done': bytes_done,
+                'bytes_total': bytes_total,
+                'speed': bytes_done / elapsed if elapsed > 0 else 0.0
+            }
+            if file_path is not None:
+                event['file'] = os.path.basename(file_path)
+            return event
+
+        start = time.monotonic()
+        for p in file_paths:
+            if p in results:
+                completed += 1
+                progress_callback(snapshot(p))
+
+        if not misses:
+            return
+
+        last_emit = time.monotonic()
+        with self.backend.executor() as executor:
+            futures = {self.backend.submit(executor, p, make_counter(p), self.algorithms): p for p in misses}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=self.progress_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = futures[future]
+                    results[path] = self._collect(path, future, stat_keys.get(path))
+                    # Backends without byte callbacks report nothing until a file is done
+                    with lock:
+                        bytes_read[path] = sizes[path]
+                    completed += 1
+                    progress_callback(snapshot(path))
+                    last_emit = time.monotonic()
+
+                if pending and time.monotonic() - last_emit >= self.progress_interval:
+                    progress_callback(snapshot())
+                    last_emit = time.monotonic()
+
+    @staticmethod
+    def _hash_block(file_path, offset, length, algorithm="md5"):
+        # A fresh handle per block keeps concurrent reads of one file independent
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        return hashlib.new(algorithm, data).hexdigest().upper()
+
+    def compute_block_hashes(self, file_path, block_size):
+        """Returns the hash of each consecutive block_size slice of a file."""
+        hashes = []
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                hashes.append(hashlib.new(self.algorithm, block).hexdigest().upper())
+        return hashes
+
+    def verify_blocks(self, file_path, block_size, block_hashes, stop_at_first=False, expected_size=None):
+        """
+        Verifies a file against a list of fixed-size block hashes.
+
+        Blocks are hashed in parallel across the engine's worker count, so a
+        single huge file still uses every worker. Blocks missing from a short
+        file and any bytes beyond the expected size count as corrupt.
+
+        Args:
+            file_path: Path to the file to check
+            block_size: Size in bytes of each block (the last may be shorter)
+            block_hashes: Expected hash per block, in the engine's algorithm
+            stop_at_first: Stop scheduling blocks once a mismatch is found
+            expected_size: Final file size from the manifest, if known
+
+        Returns:
+            dict: {'valid', 'bad_ranges' ([start, end) byte offsets, merged),
+                   'blocks_total', 'blocks_checked', 'expected_size'}
+
+        Raises:
+            FileNotFoundError: If the file does not exist
+        """
+        file_size = os.path.getsize(file_path)
+        block_count = len(block_hashes)
+        if expected_size is None:
+            # Without a manifest size, trust the file length if it fits the block count
+            fits = (block_count - 1) * block_size < file_size <= block_count * block_size
+            expected_size = file_size if fits else block_count * block_size
+        stop = threading.Event()
+
+        def block_end(index):
+            return min((index + 1) * block_size, expected_size)
+
+        def check(index):
+            if stop.is_set():
+                return None
+            offset = index * block_size
+            if file_size < block_end(index):
+                return False
+            digest = self._hash_block(file_path, offset, block_end(index) - offset, self.algorithm)
+            return digest == block_hashes[index].upper()
 
-    def verify_files(self, file_paths):
-        """Verifies multiple files using multi-threading."""
+        bad_blocks = []
+        checked = 0
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Map returns results in the same order as input
-            results = list(executor.map(self.hash_file, file_paths))
-        
-        # Return a dictionary of path -> hash
-        return dict(zip(file_paths, results))
+            futures = [executor.submit(check, i) for i in range(block_count)]
+            for index, future in enumerate(futures):
+                ok = None if future.cancelled() else future.result()
+                if ok is None:
+                    continue
+                checked += 1
+                if not ok:
+                    bad_blocks.append(index)
+                    if stop_at_first and not stop.is_set():
+                        stop.set()
+                        for f in futures[index + 1:]:
+                            f.cancel()
+
+        bad_ranges = []
+        for index in bad_blocks:
+            start, end = index * block_size, block_end(index)
+            if bad_ranges and bad_ranges[-1][1] == start:
+                bad_ranges[-1][1] = end
+            else:
+                bad_ranges.append([start, end])
+        if file_size > expected_size and not (stop_at_first and bad_ranges):
+            if bad_ranges and bad_ranges[-1][1] == expected_size:
+                bad_ranges[-1][1] = file_size
+            else:
+                bad_ranges.append([expected_size, file_size])
+
+        return {
+            'valid': not bad_ranges,
+            'bad_ranges': bad_ranges,
+            'blocks_total': block_count,
+            'blocks_checked': checked,
+            'expected_size': expected_size
+        }
+
+    def quick_verify(self, file_path, expected_size=None, block_map=None, sample_count=4, seed=None,
+                     expected_hash=None):
+        """
+        Cheap plausibility check of one file, escalating nothing by itself.
+
+        Tiers, cheapest first:
+        1. Hash cache hit for the unchanged file -> 'verified'
+        2. Size against the manifest size (or the size implied by the block map)
+        3. A deterministic sample of blocks (always first and last) -> 'sampled'
+
+        Args:
+            file_path: Path to the file to check
+            expected_size: Size from the manifest, if known
+            block_map: {'block_size', 'hashes'} from the manifest, if known
+            sample_count: Number of blocks to hash in addition to first and last
+            seed: Seed for the block sample; the same seed picks the same blocks.
+                Defaults to one derived from file_path and expected_hash, so
+                repeated checks of a file against one version sample the same blocks
+            expected_hash: Target digest of the file, if known
+
+        Returns:
+            dict: {'confidence': 'verified' | 'sampled' | 'size' | 'none',
+                   'suspicious': bool, 'hash': cached hash or None}
+        """
+        if self.cache is not None:
+            cached = self.cache.lookup(file_path, self.algorithm)
+            if cached is not None:
+                return {'confidence': 'verified', 'suspicious': False, 'hash': cached}
+
+        file_size = os.path.getsize(file_path)
+        if expected_size is not None and file_size != expected_size:
+            return {'confidence': 'size', 'suspicious': True, 'hash': None}
+
+        if not block_map:
+            confidence = 'size' if expected_size is not None else 'none'
+            return {'confidence': confidence, 'suspicious': expected_size is None, 'hash': None}
+
+        block_size = block_map['block_size']
+        hashes = block_map['hashes']
+        if not hashes:
+            # An empty file has no blocks to sample
+            return {'confidence': 'size', 'suspicious': file_size != 0, 'hash': None}
+        if not (len(hashes) - 1) * block_size < file_size <= len(hashes) * block_size:
+            return {'confidence': 'size', 'suspicious': True, 'hash': None}
+
+        if seed is None:
+            seed = f"{os.fspath(file_path)}:{(expected_hash or '').upper()}"
+        last = len(hashes) - 1
+        middle = list(range(1, last))
+        sample = {0, last} | set(random.Random(seed).sample(middle, min(sample_count, len(middle))))
+        for index in sorted(sample):
+            offset = index * block_size
+            if self._hash_block(file_path, offset, min(block_size, file_size - offset), self.algorithm) != hashes[index].upper():
+                return {'confidence': 'sampled', 'suspicious': True, 'hash': None}
+        return {'confidence': 'sampled', 'suspicious': False, 'hash': None}
+
+    def quick_verify_files(self, entries, sample_count=4):
+        """
+        Runs quick_verify over many files in parallel.
+
+        Args:
+            entries: Iterable of dicts with 'path' and optional 'size', 'block_map',
+                'hash' (the expected digest) and 'seed'
+
+        Returns:
+            dict: path -> quick_verify result
+        """
+        entries = list(entries)
+
+        def check(entry):
+            return self.quick_verify(
+                entry['path'], entry.get('size'), entry.get('block_map'), sample_count, entry.get('seed'),
+                entry.get('hash')
+            )
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(check, entries))
+        return {entry['path']: result for entry, result in zip(entries, results)}
 
 class DLCGraph:
     """
@@ -150,6 +484,116 @@ class ManifestParser:
         patch_section = self.data.get("patch", {})
         return patch_section.get("files", [])
 
+    def get_hash_type(self) -> str:
+        """
+        Returns the hash algorithm declared by the manifest, defaulting to MD5.
+
+        Looked up as a top-level "hash_type", then under "patch", then under
+        "patch_details".
+
+        Raises:
+            ValueError: If the declared algorithm is not supported
+        """
+        for section in (self.data, self.data.get("patch", {}), self.data.get("patch_details", {})):
+            if isinstance(section, dict) and section.get("hash_type"):
+                return validate_algorithm(section["hash_type"])
+        return "md5"
+
+    def get_target_hash(self, patch_info: dict):
+        """
+        Returns (algorithm, digest) a file must match after updating.
+
+        Entries carry "hash_to" in the manifest's hash_type; legacy entries only
+        have "MD5_to". Both may be present while a manifest migrates.
+        """
+        if patch_info.get("hash_to"):
+            return self.get_hash_type(), patch_info["hash_to"].upper()
+        return "md5", patch_info["MD5_to"].upper()
+
+    def get_source_hash(self, patch_info: dict):
+        """Returns (algorithm, digest) a delta's source must match, or (None, None)."""
+        if patch_info.get("hash_from"):
+            return self.get_hash_type(), patch_info["hash_from"].upper()
+        if patch_info.get("MD5_from"):
+            return "md5", patch_info["MD5_from"].upper()
+        return None, None
+
+    def get_patch_bundle(self):
+        """
+        Returns the URL of the manifest's patch bundle (see bundle.py), or None.
+
+        Looked up as a top-level "patch_bundle", then under "patch"; the value
+        is a URL or {"url": ...}.
+        """
+        for section in (self.data, self.data.get("patch", {})):
+            bundle = section.get("patch_bundle") if isinstance(section, dict) else None
+            if isinstance(bundle, dict):
+                bundle = bundle.get("url")
+            if bundle:
+                return bundle
+        return None
+
+    def get_delta_edges(self, patch_info: dict) -> list:
+        """
+        Returns every delta published for a file, as graph edges for UpdatePlanner.
+
+        A "delta" entry's own MD5_from/hash_from and patch_url form one edge to
+        its target. Further deltas, e.g. from older versions to intermediate
+        ones, may be listed as:
+
+            "deltas": [{"hash_from": ..., "hash_to": ..., "patch_url": ...,
+                        "patch_size": <bytes>, "version_from": "1.98",
+                        "version_to": "1.99"}, ...]
+
+        with MD5_from/MD5_to accepted as in the entry itself.
+
+        Returns:
+            list: {'from': (algorithm, digest), 'to': (algorithm, digest),
+            'patch_url', 'size', 'from_label', 'to_label'} per usable delta
+        """
+        candidates = []
+        if patch_info.get("type") == "delta":
+            candidates.append(patch_info)
+        candidates += [d for d in patch_info.get("deltas") or [] if isinstance(d, dict)]
+
+        edges = []
+        for delta in candidates:
+            source = self.get_source_hash(delta)
+            if not source[1] or not delta.get("patch_url") or not (delta.get("hash_to") or delta.get("MD5_to")):
+                if delta is not patch_info:
+                    logger.warning(f"Ignoring incomplete delta for {patch_info.get('name')}")
+                continue
+            edges.append({
+                'from': source,
+                'to': self.get_target_hash(delta),
+                'patch_url': delta["patch_url"],
+                'size': delta.get("patch_size"),
+                'from_label': delta.get("version_from"),
+                'to_label': delta.get("version_to")
+            })
+        return edges
+
+    @staticmethod
+    def get_block_map(patch_info: dict):
+        """
+        Returns the optional per-file block hashes of a patch entry.
+
+        Expected entry shape: "blocks": {"size": <bytes>, "hashes": ["<digest>", ...]},
+        with digests in the manifest's hash_type.
+
+        Returns:
+            dict: {'block_size': int, 'hashes': list} or None if absent or malformed
+        """
+        blocks = patch_info.get("blocks")
+        if not blocks:
+            return None
+        block_size = blocks.get("size") if isinstance(blocks, dict) else None
+        hashes = blocks.get("hashes") if isinstance(blocks, dict) else None
+        if not isinstance(block_size, int) or block_size <= 0 or not isinstance(hashes, list) or not hashes:
+            logger.warning(f"Ignoring malformed block map for {patch_info.get('name')}")
+            return None
+        return {'block_size': block_size, 'hashes': hashes}
+
 class Version:
     def __init__(self, version_str):
         self.parts = [int(x) for x in version_str.split('.')]
@@ -0,0 +1,316 @@
+"""
+Hashing backends for VerificationEngine.
+
+Provides:
+- ThreadPoolBackend: Hashes files on a thread pool (hashlib releases the GIL)
+- ProcessPoolBackend: Hashes files in worker processes
+- AdaptiveBackend: Tunes worker count and read-buffer size for the storage device
+- TuningStore: Persists per-device settings chosen by AdaptiveBackend
+- make_backend: Builds a backend from its configuration name
+
+Every backend exposes executor() and submit(executor, file_path, on_bytes,
+algorithms), whose future yields {algorithm: digest}; cache lookups and
+progress reporting stay in VerificationEngine.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from paths import get_app_data_path
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Algorithms a manifest may declare; all are in hashlib on every platform
+SUPPORTED_ALGORITHMS = ("md5", "sha1", "sha256", "sha512", "blake2b", "blake2s")
+
+def validate_algorithm(algorithm: str) -> str:
+    """
+    Normalizes an algorithm name ("SHA-256" -> "sha256").
+
+    Raises:
+        ValueError: If the algorithm is not supported
+    """
+    name = str(algorithm).lower().replace("-", "").replace("_", "")
+    if name not in SUPPORTED_ALGORITHMS:
+        raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+    return name
+
+def digest_file_multi(file_path, algorithms=("md5",), chunk_size=None, on_bytes=None):
+    """
+    Calculates several uppercase digests of a file in a single read pass.
+
+    Module-level so it can be shipped to worker processes. For a single
+    algorithm without chunk size or byte callback this defers to
+    hashlib.file_digest.
+
+    Returns:
+        dict: algorithm -> uppercase hex digest
+    """
+    with open(file_path, 'rb') as f:
+        if len(algorithms) == 1 and chunk_size is None and on_bytes is None:
+            return {algorithms[0]: hashlib.file_digest(f, algorithms[0]).hexdigest().upper()}
+
+        hashers = [(a, hashlib.new(a)) for a in algorithms]
+        buf = bytearray(chunk_size or DEFAULT_CHUNK_SIZE)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            for _, hasher in hashers:
+                hasher.update(view[:n])
+            if on_bytes is not None:
+                on_bytes(n)
+        return {a: hasher.hexdigest().upper() for a, hasher in hashers}
+
+def digest_file(file_path, chunk_size=None, on_bytes=None, algorithm="md5"):
+    """Calculates the uppercase digest of a file with one algorithm."""
+    return digest_file_multi(file_path, (algorithm,), chunk_size, on_bytes)[algorithm]
+
+class ThreadPoolBackend:
+    name = "thread"
+
+    def __init__(self, max_workers: Optional[int] = None, chunk_size: Optional[int] = None):
+        self.max_workers = max_workers or os.cpu_count()
+        self.chunk_size = chunk_size
+
+    def executor(self):
+        return ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def submit(self, executor, file_path, on_bytes=None, algorithms=("md5",)):
+        return executor.submit(digest_file_multi, file_path, algorithms, self.chunk_size, on_bytes)
+
+class ProcessPoolBackend:
+    """
+    Hashes in separate processes. Byte-level progress cannot cross the process
+    boundary, so on_bytes is ignored and files are credited on completion.
+    """
+    name = "process"
+
+    def __init__(self, max_workers: Optional[int] = None, chunk_size: Optional[int] = None):
+        self.max_workers = max_workers or os.cpu_count()
+        self.chunk_size = chunk_size
+
+    def executor(self):
+        return ProcessPoolExecutor(max_workers=self.max_workers)
+
+    def submit(self, executor, file_path, on_bytes=None, algorithms=("md5",)):
+        return executor.submit(digest_file_multi, file_path, algorithms, self.chunk_size)
+
+class TuningStore:
+    """
+    JSON file of tuned hashing settings, keyed by device id (st_dev).
+
+    Without a store_path the settings are kept in memory only;
+    TuningStore.default() is the file under app data.
+    """
+    def __init__(self, store_path: Optional[Path] = None):
+        self.store_path = Path(store_path) if store_path else None
+        self._memory: Dict[str, Any] = {}
+
+    @classmethod
+    def default(cls) -> "TuningStore":
+        return cls(get_app_data_path() / "hash_tuning.json")
+
+    @staticmethod
+    def device_id(path) -> Optional[str]:
+        try:
+            return str(os.stat(path).st_dev)
+        except OSError:
+            return None
+
+    def _read(self) -> Dict[str, Any]:
+        if self.store_path is None:
+            return dict(self._memory)
+        try:
+            with open(self.store_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def load(self, device: str) -> Optional[Dict[str, Any]]:
+        return self._read().get(device)
+
+    def save(self, device: str, settings: Dict[str, Any]):
+        data = self._read()
+        data[device] = {**settings, "updated": datetime.now().isoformat()}
+        if self.store_path is None:
+            self._memory = data
+            return
+        # Write-then-rename so a concurrent reader never sees a partial file
+        tmp_path = self.store_path.with_suffix(f".{os.getpid()}.tmp")
+        self.store_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.store_path)
+
+class _ConcurrencyGate:
+    """Semaphore whose limit can be changed while workers are waiting on it."""
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._active = 0
+        self._cond = threading.Condition()
+
+    def set_limit(self, limit: int):
+        with self._cond:
+            self._limit = limit
+            self._cond.notify_all()
+
+    def __enter__(self):
+        with self._cond:
+            while self._active >= self._limit:
+                self._cond.wait()
+            self._active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+        return False
+
+class AdaptiveBackend:
+    """
+    Thread-pool backend that measures throughput during the first seconds of a
+    run and tunes worker count and read-buffer size for the device holding
+    target_dir.
+
+    Candidate worker counts are tried in increasing order while throughput keeps
+    improving, then buffer sizes at the best worker count. The winning settings
+    are saved per device in the store and, if it is persistent, reused on
+    later runs without probing.
+    """
+    name = "adaptive"
+
+    WORKER_CANDIDATES = (1, 2, 4, 8, 16, 32)
+    CHUNK_CANDIDATES = (256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 8 * 1024 * 1024)
+    # A candidate must beat the current best by this factor to be adopted
+    IMPROVEMENT = 1.10
+
+    def __init__(self, target_dir, max_workers: Optional[int] = None, store: Optional[TuningStore] = None,
+                 probe_window: float = 0.5):
+        self.target_dir = target_dir
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+        self.store = store or TuningStore()
+        self.probe_window = probe_window
+        self.device = TuningStore.device_id(target_dir)
+
+        self._lock = threading.Lock()
+        self._candidates: List[Tuple[int, int]] = []
+        self._best: Optional[Tuple[float, int, int]] = None
+        self._phase = "done"
+
+        saved = self.store.load(self.device) if self.device else None
+        if saved:
+            self.workers = min(int(saved["workers"]), self.max_workers)
+            self.chunk_size = int(saved["chunk_size"])
+            self.tuned = True
+        else:
+            self.tuned = False
+            self._phase = "workers"
+            self._candidates = [(w, DEFAULT_CHUNK_SIZE) for w in self.WORKER_CANDIDATES if w <= self.max_workers]
+            self.workers, self.chunk_size = self._candidates.pop(0)
+
+        self._gate = _ConcurrencyGate(self.workers)
+        self._window_start = None
+        self._window_bytes = 0
+
+    def executor(self):
+        # Threads are cheap; the gate decides how many actually read at once
+        return ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def submit(self, executor, file_path, on_bytes=None, algorithms=("md5",)):
+        return executor.submit(self._run, file_path, on_bytes, algorithms)
+
+    def _run(self, file_path, on_bytes, algorithms):
+        with self._gate:
+            def counted(n):
+                if not self.tuned:
+                    self._observe(n)
+                if on_bytes is not None:
+                    on_bytes(n)
+            return digest_file_multi(file_path, algorithms, self.chunk_size, counted)
+
+    def _observe(self, n: int):
+        with self._lock:
+            if self.tuned:
+                return
+            now = time.monotonic()
+            if self._window_start is None:
+                self._window_start = now
+            self._window_bytes += n
+            elapsed = now - self._window_start
+            if elapsed <= 0 or elapsed < self.probe_window:
+                return
+
+            self._advance((self._window_bytes / elapsed, self.workers, self.chunk_size))
+            self._window_start = now
+            self._window_bytes = 0
+
+    def _advance(self, measurement: Tuple[float, int, int]):
+        improved = self._best is None or measurement[0] > self._best[0] * self.IMPROVEMENT
+        if improved:
+            self._best = measurement
+
+        # More workers only help until the device saturates; stop at the first non-improvement
+        if self._phase == "workers" and (not improved or not self._candidates):
+            self._phase = "chunks"
+            best_workers, best_chunk = self._best[1], self._best[2]
+            self._candidates = [(best_workers, c) for c in self.CHUNK_CANDIDATES if c != best_chunk]
+
+        if self._candidates:
+            self.workers, self.chunk_size = self._candidates.pop(0)
+            self._gate.set_limit(self.workers)
+            return
+
+        throughput, self.workers, self.chunk_size = self._best
+        self._gate.set_limit(self.workers)
+        self.tuned = True
+        self._phase = "done"
+        logger.info(f"Adaptive hashing tuned for device {self.device}: {self.workers} workers, "
+                    f"{self.chunk_size // 1024} KiB buffer, {throughput / (1024 * 1024):.1f} MB/s")
+        if self.device:
+            try:
+                self.store.save(self.device, {
+                    "workers": self.workers,
+                    "chunk_size": self.chunk_size,
+                    "throughput": throughput
+                })
+            except OSError as e:
+                logger.warning(f"Failed to persist hashing tuning: {e}")
+
+BACKENDS = {
+    "thread": ThreadPoolBackend,
+    "process": ProcessPoolBackend,
+    "adaptive": AdaptiveBackend,
+}
+
+def make_backend(name: str, target_dir=None, max_workers: Optional[int] = None,
+                 store: Optional[TuningStore] = None):
+    """
+    Creates a hashing backend by name ("thread", "process" or "adaptive").
+
+    Args:
+        store: Where the adaptive backend keeps its tuned settings
+            (default: in memory; TuningStore.default() persists them)
+
+    Raises:
+        ValueError: If the name is unknown, or adaptive is requested without a target_dir
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown hashing backend: {name}")
+    if name == "adaptive":
+        if target_dir is None:
+            raise ValueError("Adaptive hashing backend requires a target directory")
+        return AdaptiveBackend(target_dir, max_workers=max_workers, store=store)
+    return BACKENDS[name](max_workers=max_workers)
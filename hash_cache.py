@@ -0,0 +1,134 @@
+"""
+Persistent hash index for game files.
+
+Provides:
+- HashCache: SQLite-backed store of file digests keyed by (path, size, mtime_ns, inode)
+
+A cached digest is only returned while the file's stat tuple is unchanged, so
+an untouched file never has to be re-read. The database runs in WAL mode with a
+busy timeout so the sidecar and the API server can share one index safely.
+Without a db_path the index lives in memory; HashCache.default() is the one
+persisted under app data.
+"""
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+from paths import get_app_data_path
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+StatKey = Tuple[int, int, int]
+
+class HashCache:
+    """
+    Maps file paths to previously computed digests.
+
+    Entries are invalidated implicitly: a lookup only hits when size, mtime_ns
+    and inode all match the values recorded alongside the digest.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS hashes (
+            path TEXT NOT NULL,
+            algorithm TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            digest TEXT NOT NULL,
+            PRIMARY KEY (path, algorithm)
+        )
+    """
+
+    def __init__(self, db_path: Optional[Path] = None, timeout: float = 30.0):
+        # None keeps the index in memory only
+        self.db_path = Path(db_path) if db_path else None
+        if self.db_path:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path or ":memory:"), timeout=timeout, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(self.SCHEMA)
+            self._conn.commit()
+
+    @classmethod
+    def default(cls) -> "HashCache":
+        """The index persisted in the app data directory."""
+        return cls(get_app_data_path() / "hash_cache.db")
+
+    @staticmethod
+    def _normalize(file_path) -> str:
+        return os.path.normcase(os.path.abspath(str(file_path)))
+
+    @staticmethod
+    def stat_key(file_path) -> Optional[StatKey]:
+        """Returns (size, mtime_ns, inode) for a file, or None if it cannot be stat'ed."""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def lookup(self, file_path, algorithm: str = "md5") -> Optional[str]:
+        """Returns the cached digest if the file is unchanged since it was recorded."""
+        key = self.stat_key(file_path)
+        if key is None:
+            return None
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, inode, digest FROM hashes WHERE path = ? AND algorithm = ?",
+                (self._normalize(file_path), algorithm)
+            ).fetchone()
+
+        if row and tuple(row[:3]) == key:
+            return row[3]
+        return None
+
+    def record(self, file_path, digest: str, algorithm: str = "md5", stat_key: Optional[StatKey] = None) -> bool:
+        """
+        Stores a digest for the file's current stat tuple.
+
+        Pass stat_key when the digest was computed from an earlier stat of the
+        file; a file modified in between is then not cached under a stale digest.
+
+        Returns:
+            bool: True if the entry was written
+        """
+        current = self.stat_key(file_path)
+        if current is None or (stat_key is not None and stat_key != current):
+            return False
+
+        size, mtime_ns, inode = current
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO hashes (path, algorithm, size, mtime_ns, inode, digest) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (self._normalize(file_path), algorithm, size, mtime_ns, inode, digest.upper())
+                )
+                self._conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to record hash for {file_path}: {e}")
+            return False
+
+    def invalidate(self, file_path):
+        """Drops all cached digests for a path."""
+        with self._lock:
+            self._conn.execute("DELETE FROM hashes WHERE path = ?", (self._normalize(file_path),))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM hashes")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
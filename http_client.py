@@ -0,0 +1,487 @@
+"""
+Shared, pooled HTTP clients.
+
+Provides:
+- get_client: The process-wide httpx.Client used for manifests, index pages,
+  URL resolution, mirror tests, version detection and connectivity checks
+- get_async_client: The httpx.AsyncClient for the running event loop
+- create_client / create_async_client: Build a client with the same pooling
+  (for tests and for callers that need an isolated pool)
+- pool_metrics: Request, connection, DNS cache and pool counters
+- client_status: The same counters for one client from create_client
+- DnsCache: Resolved addresses reused for a time-to-live
+
+Every client here keeps connections alive between requests, caps connections
+per host, speaks HTTP/2 when h2 is installed (requirements.txt pulls it in
+through httpx[http2]; without it clients fall back to HTTP/1.1) and reuses
+DNS answers. A sidecar update that fetches the manifest, resolves URLs and
+ranks mirrors therefore pays for each TLS handshake and lookup only once.
+
+Timeouts and redirect handling are per request: callers pass timeout= and
+follow_redirects= to get()/head() rather than configuring their own client.
+"""
+
+import asyncio
+import contextlib
+import socket
+import threading
+import time
+import weakref
+import importlib.util
+from typing import Any, Dict, List, Optional
+import httpx
+import httpcore
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_PER_HOST = 6
+DEFAULT_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60.0)
+# TCP keep-alive stops NAT gateways and proxies dropping pooled idle connections
+SOCKET_OPTIONS = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+def http2_available() -> bool:
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2])."""
+    return importlib.util.find_spec("h2") is not None
+
+class DnsCache:
+    """
+    Resolved addresses per (host, port), reused for ttl seconds.
+
+    A failed connection to a cached address invalidates the entry so the next
+    attempt resolves again.
+    """
+    def __init__(self, ttl: float = 300.0, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: Dict[tuple, tuple] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, host: str, port: int) -> Optional[List[str]]:
+        with self._lock:
+            entry = self._entries.get((host, port))
+            if entry and entry[0] > self._clock():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, host: str, port: int, addresses: List[str]):
+        with self._lock:
+            self._entries[(host, port)] = (self._clock() + self.ttl, addresses)
+
+    def invalidate(self, host: str, port: int):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+    def resolve(self, host: str, port: int) -> List[str]:
+        addresses = self.get(host, port)
+        if addresses is None:
+            addresses = _addresses(socket.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+            self.put(host, port, addresses)
+        return addresses
+
+    async def resolve_async(self, host: str, port: int) -> List[str]:
+        addresses = self.get(host, port)
+        if addresses is None:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            addresses = _addresses(infos)
+            self.put(host, port, addresses)
+        return addresses
+
+    def status(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+def _addresses(infos) -> List[str]:
+    """Unique addresses from getaddrinfo results, in resolver order."""
+    seen = []
+    for info in infos:
+        address = info[4][0]
+        if address not in seen:
+            seen.append(address)
+    return seen
+
+def _is_ip(host: str) -> bool:
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return True
+        except (OSError, ValueError):
+            pass
+    return False
+
+class PoolMetrics:
+    """Counters shared by the clients built in this module."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.connect_errors = 0
+        self.waits_for_host_slot = 0
+
+    def add(self, name: str, n: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def status(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'connections_opened': self.connections_opened,
+                'connect_errors': self.connect_errors,
+                'waits_for_host_slot': self.waits_for_host_slot,
+            }
+
+class _CachingBackend(httpcore.NetworkBackend):
+    """Connects through the DNS cache, trying each cached address in turn."""
+    def __init__(self, inner, dns: DnsCache, metrics: PoolMetrics):
+        self.inner = inner
+        self.dns = dns
+        self.metrics = metrics
+
+    def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            addresses = [host] if _is_ip(host) else self.dns.resolve(host, port)
+        except OSError as e:
+            # Lookup failures surface as httpx.ConnectError, as with httpcore's own backends
+            raise httpcore.ConnectError(str(e)) from e
+        error = None
+        for address in addresses:
+            try:
+                stream = self.inner.connect_tcp(address, port, timeout=timeout, local_address=local_address,
+                                                socket_options=socket_options)
+                self.metrics.add('connections_opened')
+                return stream
+            except httpcore.ConnectError as e:
+                error = e
+        self.metrics.add('connect_errors')
+        self.dns.invalidate(host, port)
+        raise error or httpcore.ConnectError(f"No addresses for {host}")
+
+    def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return self.inner.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    def sleep(self, seconds):
+        self.inner.sleep(seconds)
+
+class _AsyncCachingBackend(httpcore.AsyncNetworkBackend):
+    def __init__(self, inner, dns: DnsCache, metrics: PoolMetrics):
+        self.inner = inner
+        self.dns = dns
+        self.metrics = metrics
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            addresses = [host] if _is_ip(host) else await self.dns.resolve_async(host, port)
+        except OSError as e:
+            # Lookup failures surface as httpx.ConnectError, as with httpcore's own backends
+            raise httpcore.ConnectError(str(e)) from e
+        error = None
+        for address in addresses:
+            try:
+                stream = await self.inner.connect_tcp(address, port, timeout=timeout, local_address=local_address,
+                                                      socket_options=socket_options)
+                self.metrics.add('connections_opened')
+                return stream
+            except httpcore.ConnectError as e:
+                error = e
+        self.metrics.add('connect_errors')
+        self.dns.invalidate(host, port)
+        raise error or httpcore.ConnectError(f"No addresses for {host}")
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.inner.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds):
+        await self.inner.sleep(seconds)
+
+# httpcore exceptions and the httpx exceptions callers catch; both libraries use the same names
+_EXCEPTIONS = {
+    getattr(httpcore, name): getattr(httpx, name) for name in (
+        "TimeoutException", "ConnectTimeout", "ReadTimeout", "WriteTimeout", "PoolTimeout",
+        "NetworkError", "ConnectError", "ReadError", "WriteError",
+        "ProxyError", "UnsupportedProtocol", "ProtocolError", "LocalProtocolError", "RemoteProtocolError",
+    )
+}
+
+@contextlib.contextmanager
+def _mapped_exceptions(request: httpx.Request):
+    """Re-raises httpcore errors as the matching httpx errors."""
+    try:
+        yield
+    except Exception as e:
+        mapped = next((_EXCEPTIONS[cls] for cls in type(e).__mro__ if cls in _EXCEPTIONS), None)
+        if mapped is None:
+            raise
+        raise mapped(str(e), request=request) from e
+
+def _core_request(request: httpx.Request) -> httpcore.Request:
+    return httpcore.Request(
+        method=request.method,
+        url=httpcore.URL(scheme=request.url.raw_scheme, host=request.url.raw_host, port=request.url.port,
+                         target=request.url.raw_path),
+        headers=request.headers.raw,
+        content=request.stream,
+        extensions=request.extensions,
+    )
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response body that frees its host slot when closed."""
+    def __init__(self, stream, release, request):
+        self._stream = stream
+        self._release = release
+        self._request = request
+
+    def __iter__(self):
+        with _mapped_exceptions(self._request):
+            yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release, request):
+        self._stream = stream
+        self._release = release
+        self._request = request
+
+    async def __aiter__(self):
+        with _mapped_exceptions(self._request):
+            async for chunk in self._stream:
+                yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+def _once(fn):
+    done = []
+    def wrapper():
+        if not done:
+            done.append(True)
+            fn()
+    return wrapper
+
+def _pool_status(pool) -> Dict[str, int]:
+    connections = getattr(pool, 'connections', [])
+    return {
+        'connections': len(connections),
+        'idle': sum(1 for c in connections if c.is_idle()),
+        'http2': sum(1 for c in connections if "HTTP/2" in c.info()),
+    }
+
+def _pool_timeout(request: httpx.Request) -> Optional[float]:
+    """Seconds a request may wait for a connection (the client's pool timeout)."""
+    return request.extensions.get("timeout", {}).get("pool")
+
+def _pool_options(limits: httpx.Limits, http1: bool, http2: bool, retries: int, socket_options) -> Dict[str, Any]:
+    return {
+        'max_connections': limits.max_connections,
+        'max_keepalive_connections': limits.max_keepalive_connections,
+        'keepalive_expiry': limits.keepalive_expiry,
+        'http1': http1, 'http2': http2, 'retries': retries, 'socket_options': socket_options,
+    }
+
+class PooledTransport(httpx.BaseTransport):
+    """
+    httpx transport over an httpcore connection pool, with a per-host
+    request cap, cached DNS and metrics.
+
+    A request holds its host slot until the response body is closed, so a
+    slow host cannot take every connection in the pool; waiting for a slot
+    counts against the pool timeout and raises httpx.PoolTimeout like
+    waiting for a connection does. The pool is built with httpcore's
+    network_backend argument so every connection goes through the DNS cache.
+    """
+    def __init__(self, per_host: int = DEFAULT_PER_HOST, dns: Optional[DnsCache] = None,
+                 metrics: Optional[PoolMetrics] = None, verify=True, http1: bool = True, http2: bool = False,
+                 limits: httpx.Limits = DEFAULT_LIMITS, retries: int = 0, socket_options=None):
+        ssl_context = httpx.create_ssl_context(verify=verify)
+        self.per_host = per_host
+        self.dns = dns or DnsCache()
+        self.metrics = metrics or PoolMetrics()
+        self._hosts: Dict[str, threading.BoundedSemaphore] = {}
+        self._hosts_lock = threading.Lock()
+        self._pool = httpcore.ConnectionPool(
+            ssl_context=ssl_context,
+            network_backend=_CachingBackend(httpcore.SyncBackend(), self.dns, self.metrics),
+            **_pool_options(limits, http1, http2, retries, socket_options)
+        )
+
+    def _slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._hosts_lock:
+            return self._hosts.setdefault(host, threading.BoundedSemaphore(self.per_host))
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        slot = self._slot(request.url.host)
+        if not slot.acquire(blocking=False):
+            self.metrics.add('waits_for_host_slot')
+            timeout = _pool_timeout(request)
+            if not slot.acquire(timeout=timeout if timeout is not None else -1):
+                raise httpx.PoolTimeout(f"No free slot for {request.url.host} within {timeout}s", request=request)
+        self.metrics.add('requests')
+        try:
+            with _mapped_exceptions(request):
+                response = self._pool.handle_request(_core_request(request))
+        except BaseException:
+            slot.release()
+            raise
+        return httpx.Response(
+            status_code=response.status,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, _once(slot.release), request),
+            extensions=response.extensions,
+        )
+
+    def close(self):
+        self._pool.close()
+
+    def status(self) -> Dict[str, Any]:
+        return {**self.metrics.status(), 'dns': self.dns.status(), 'pool': _pool_status(self._pool)}
+
+class AsyncPooledTransport(httpx.AsyncBaseTransport):
+    """Async counterpart of PooledTransport; use it from one event loop."""
+    def __init__(self, per_host: int = DEFAULT_PER_HOST, dns: Optional[DnsCache] = None,
+                 metrics: Optional[PoolMetrics] = None, verify=True, http1: bool = True, http2: bool = False,
+                 limits: httpx.Limits = DEFAULT_LIMITS, retries: int = 0, socket_options=None):
+        ssl_context = httpx.create_ssl_context(verify=verify)
+        self.per_host = per_host
+        self.dns = dns or DnsCache()
+        self.metrics = metrics or PoolMetrics()
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=ssl_context,
+            network_backend=_AsyncCachingBackend(httpcore.AnyIOBackend(), self.dns, self.metrics),
+            **_pool_options(limits, http1, http2, retries, socket_options)
+        )
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        slot = self._hosts.setdefault(request.url.host, asyncio.Semaphore(self.per_host))
+        if slot.locked():
+            self.metrics.add('waits_for_host_slot')
+        timeout = _pool_timeout(request)
+        try:
+            await asyncio.wait_for(slot.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise httpx.PoolTimeout(f"No free slot for {request.url.host} within {timeout}s", request=request)
+        self.metrics.add('requests')
+        try:
+            with _mapped_exceptions(request):
+                response = await self._pool.handle_async_request(_core_request(request))
+        except BaseException:
+            slot.release()
+            raise
+        return httpx.Response(
+            status_code=response.status,
+            headers=response.headers,
+            stream=_AsyncReleasingStream(response.stream, _once(slot.release), request),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self._pool.aclose()
+
+    def status(self) -> Dict[str, Any]:
+        return {**self.metrics.status(), 'dns': self.dns.status(), 'pool': _pool_status(self._pool)}
+
+def create_client(timeout: float = DEFAULT_TIMEOUT, limits: httpx.Limits = DEFAULT_LIMITS,
+                  per_host: int = DEFAULT_PER_HOST, dns: Optional[DnsCache] = None,
+                  http2: Optional[bool] = None) -> httpx.Client:
+    """
+    Builds a pooled client. HTTP/2 is used when h2 is installed unless
+    http2=False; without it the client speaks HTTP/1.1 with keep-alive.
+    """
+    http2 = http2_available() if http2 is None else http2
+    transport = PooledTransport(per_host=per_host, dns=dns or _dns_cache, http2=http2, limits=limits,
+                                socket_options=SOCKET_OPTIONS)
+    client = httpx.Client(transport=transport, timeout=timeout)
+    _transports[client] = transport
+    return client
+
+def create_async_client(timeout: float = DEFAULT_TIMEOUT, limits: httpx.Limits = DEFAULT_LIMITS,
+                        per_host: int = DEFAULT_PER_HOST, dns: Optional[DnsCache] = None,
+                        http2: Optional[bool] = None) -> httpx.AsyncClient:
+    http2 = http2_available() if http2 is None else http2
+    transport = AsyncPooledTransport(per_host=per_host, dns=dns or _dns_cache, http2=http2, limits=limits,
+                                     socket_options=SOCKET_OPTIONS)
+    client = httpx.AsyncClient(transport=transport, timeout=timeout)
+    _transports[client] = transport
+    return client
+
+# One DNS cache for every client in the process
+_dns_cache = DnsCache()
+# Pooled transport of each client built here, for its metrics
+_transports: "weakref.WeakKeyDictionary[Any, Any]" = weakref.WeakKeyDictionary()
+_client: Optional[httpx.Client] = None
+_async_clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+_clients_lock = threading.Lock()
+
+def get_client() -> httpx.Client:
+    """Returns the process-wide pooled client, creating it on first use."""
+    global _client
+    with _clients_lock:
+        if _client is None or _client.is_closed:
+            _client = create_client()
+        return _client
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Returns the pooled async client for the running event loop.
+
+    Async connections belong to the loop that opened them, so each loop gets
+    its own client; close it with close_async_client() before the loop ends.
+    """
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        # Clients of loops that ended without close_async_client() cannot be closed any more; drop them
+        for stale in [l for l in _async_clients if l.is_closed()]:
+            del _async_clients[stale]
+        client = _async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = _async_clients[loop] = create_async_client()
+        return client
+
+async def close_async_client():
+    """Closes the running loop's async client, if one was created."""
+    with _clients_lock:
+        client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+def close_clients():
+    """Closes the process-wide sync client; the next get_client() builds a new one."""
+    global _client
+    with _clients_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+
+def pool_metrics() -> Dict[str, Any]:
+    """
+    Counters for the shared clients: requests sent, connections opened,
+    connect errors, waits for a per-host slot, DNS cache hits and misses and
+    the current pool (open, idle and HTTP/2 connections).
+    """
+    with _clients_lock:
+        sync_client = _client
+        async_clients = list(_async_clients.values())
+    metrics: Dict[str, Any] = {'http2': http2_available(), 'dns': _dns_cache.status(), 'sync': None, 'async': []}
+    if sync_client is not None:
+        metrics['sync'] = client_status(sync_client)
+    metrics['async'] = [client_status(client) for client in async_clients]
+    return metrics
+
+def client_status(client) -> Optional[Dict[str, Any]]:
+    """Counters of a client from create_client or create_async_client, else None."""
+    transport = _transports.get(client)
+    return transport.status() if transport is not None else None
@@ -1,7 +1,8 @@
 import json
 import os
+import threading
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from logging_system import get_logger
 from rollback_manager import rollback_to_restore_point
 from doctor import BackendDoctor
@@ -10,9 +11,17 @@ class OperationLogger:
     """
     Handles persistence of background operations to allow stateful resumption.
     Optimized with in-memory cache to reduce disk I/O.
+
+    Partial-download state (bytes and segments safely on disk, keyed by target
+    path) lives under RESUME_KEY and survives clear_log(keep_resume=True), so a
+    new session can pick up interrupted transfers.
     """
+    RESUME_KEY = "__resume__"
+
     def __init__(self, log_path: Path):
         self.log_path = log_path
+        # Downloads report progress from worker threads
+        self._lock = threading.RLock()
         self._cache = {}
         self._ensure_log_exists()
         self._cache = self._read_log()
@@ -32,32 +41,66 @@ class OperationLogger:
             return {}
 
     def _write_to_disk(self, data: Dict[str, Any]):
-        with open(self.log_path, 'w', encoding='utf-8') as f:
+        # Write-then-rename: a crash mid-write must not lose the resume state
+        tmp_path = self.log_path.with_suffix(self.log_path.suffix + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.log_path)
 
     def log_operation(self, op_id: str, op_data: Dict[str, Any]):
-        self._cache[op_id] = {
-            "status": op_data.get("status", "pending"),
-            "data": op_data
-        }
-        self._write_to_disk(self._cache)
+        with self._lock:
+            self._cache[op_id] = {
+                "status": op_data.get("status", "pending"),
+                "data": op_data
+            }
+            self._write_to_disk(self._cache)
 
-    def update_status(self, op_id: str, status: str):
-        if op_id in self._cache:
-            self._cache[op_id]["status"] = status
+    def log_operations(self, ops: Dict[str, Dict[str, Any]]):
+        """Logs several operations with a single write, in the given order."""
+        with self._lock:
+            for op_id, op_data in ops.items():
+                self._cache[op_id] = {
+                    "status": op_data.get("status", "pending"),
+                    "data": op_data
+                }
             self._write_to_disk(self._cache)
 
+    def update_status(self, op_id: str, status: str):
+        with self._lock:
+            if op_id in self._cache:
+                self._cache[op_id]["status"] = status
+                self._write_to_disk(self._cache)
+
     def get_pending_operations(self) -> List[Dict[str, Any]]:
         pending = []
         for op_id, info in self._cache.items():
-            if info["status"] == "pending":
+            if op_id != self.RESUME_KEY and info["status"] == "pending":
                 pending.append({"id": op_id, "data": info["data"]})
         return pending
 
-    def clear_log(self):
-        self._cache = {}
-        if self.log_path.exists():
-            self.log_path.unlink()
+    def get_resume_state(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._cache.get(self.RESUME_KEY, {}).get(str(key))
+
+    def save_resume_state(self, key: str, state: Dict[str, Any]):
+        with self._lock:
+            self._cache.setdefault(self.RESUME_KEY, {})[str(key)] = state
+            self._write_to_disk(self._cache)
+
+    def clear_resume_state(self, key: str):
+        with self._lock:
+            if self._cache.get(self.RESUME_KEY, {}).pop(str(key), None) is not None:
+                self._write_to_disk(self._cache)
+
+    def clear_log(self, keep_resume: bool = False):
+        with self._lock:
+            resume = self._cache.get(self.RESUME_KEY) if keep_resume else None
+            self._cache = {}
+            if resume:
+                self._cache[self.RESUME_KEY] = resume
+                self._write_to_disk(self._cache)
+            elif self.log_path.exists():
+                self.log_path.unlink()
 
 class RecoveryOrchestrator:
     """
@@ -14,15 +14,16 @@ import sys
 import re
 from typing import Optional, List
 from bs4 import BeautifulSoup
+from http_client import get_client
 from logging_system import get_logger
 
 # Setup logging
 logger = get_logger()
 
 class ManifestFetcher:
-    def __init__(self, manifest_url):
+    def __init__(self, manifest_url, client: Optional[httpx.Client] = None):
         self.manifest_url = manifest_url
-        self.client = httpx.Client(timeout=10.0)
+        self.client = client or get_client()
 
     def fetch_manifest_text(self, version: Optional[str] = None):
         """Fetches the manifest as raw text, optionally for a specific version."""
@@ -60,8 +61,8 @@ class VersionScanner:
     """
     Scrapes index pages to find available game versions.
     """
-    def __init__(self):
-        self.client = httpx.Client(timeout=10.0)
+    def __init__(self, client: Optional[httpx.Client] = None):
+        self.client = client or get_client()
 
     def scan_versions(self, index_url: str) -> List[str]:
         """
@@ -113,8 +114,9 @@ class VersionScanner:
             raise
 
 class URLResolver:
-    def __init__(self):
-        self.client = httpx.Client(timeout=10.0, follow_redirects=False)
+    def __init__(self, client: Optional[httpx.Client] = None):
+        # Redirects are followed manually in resolve_url; the shared client does not follow them
+        self.client = client or get_client()
 
     def resolve_url(self, url: str, depth: int = 0) -> str:
         """
@@ -416,17 +418,18 @@ class MirrorOptimizer:
     Automatically tests and ranks mirrors for speed and reliability.
     Selects the best performing mirror and can update manifests to use it.
     """
-    def __init__(self, timeout: float = 5.0, max_workers: int = 5):
+    def __init__(self, timeout: float = 5.0, max_workers: int = 5, client: Optional[httpx.Client] = None):
         """
         Initialize mirror optimizer.
 
         Args:
             timeout: Timeout for each mirror test in seconds
             max_workers: Max concurrent mirror tests
+            client: HTTP client (default: the shared pooled client)
         """
         self.timeout = timeout
         self.max_workers = max_workers
-        self.client = httpx.Client(timeout=timeout, follow_redirects=False)
+        self.client = client or get_client()
 
     def test_mirror(self, url: str) -> dict:
         """
@@ -454,7 +457,7 @@ class MirrorOptimizer:
 
         try:
             start = time.time()
-            response = self.client.head(url, follow_redirects=True)
+            response = self.client.head(url, follow_redirects=True, timeout=self.timeout)
             elapsed_ms = (time.time() - start) * 1000
 
             result['response_time'] = elapsed_ms
@@ -1,35 +1,134 @@
 import os
+import sys
+import shutil
 import hashlib
+import tempfile
 import subprocess
+import threading
+from paths import get_tools_path
+from vcdiff import decode_file, decode_stream, VcdiffError
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+# Seconds between checks of a cancel event while a decoder runs
+CANCEL_POLL_INTERVAL = 0.1
+CANCELLED = "Cancelled"
+# "vcdiff" decodes in-process, "xdelta3" runs the executable, "auto" decodes
+# small targets in-process (where process start-up dominates) and falls back to
+# the executable for anything the in-process decoder does not support
+DECODERS = ("auto", "vcdiff", "xdelta3")
+# Largest target "auto" decodes in-process. The Python decoder writes about
+# 21 MB/s, so this is a fraction of a second: past that xdelta3 is faster even
+# counting its start-up
+INPROCESS_MAX_BYTES = 8 * 1024 * 1024
+# Bytes of a streamed delta kept so xdelta3 can be handed the whole stream if
+# the in-process decoder rejects it; unsupported features show up in the header
+# or first window, well within this
+STREAM_REPLAY_LIMIT = 16 * 1024 * 1024
+
+def _watch_cancel(process, cancel):
+    """Waits for process to exit, killing it if cancel is set first."""
+    while process.poll() is None:
+        if cancel.wait(CANCEL_POLL_INTERVAL):
+            process.kill()
+            process.wait()
+            return
+
+class _ReplayStream:
+    """Passes reads through, keeping the first limit bytes so they can be replayed."""
+    def __init__(self, stream, limit: int):
+        self.stream = stream
+        self.limit = limit
+        self.recorded = bytearray()
+
+    def read(self, n: int = -1) -> bytes:
+        chunk = self.stream.read(n)
+        if self.recorded is not None:
+            if len(self.recorded) + len(chunk) > self.limit:
+                self.recorded = None
+            else:
+                self.recorded += chunk
+        return chunk
+
+    def replay(self, chunk_size: int):
+        """Iterates the whole stream from the start, or returns None if too much was read."""
+        if self.recorded is None:
+            return None
+        recorded = bytes(self.recorded)
+
+        def chunks():
+            yield recorded
+            yield from iter(lambda: self.stream.read(chunk_size), b"")
+        return chunks()
 
 class Patcher:
-    def __init__(self, xdelta_exe=None):
+    def __init__(self, xdelta_exe=None, hash_cache=None, stream_output=True, buffer_size=DEFAULT_BUFFER_SIZE,
+                 decoder="auto", inprocess_max_bytes=INPROCESS_MAX_BYTES):
+        if decoder not in DECODERS:
+            raise ValueError(f"Unknown patch decoder: {decoder}")
         self.xdelta_exe = xdelta_exe or self._find_xdelta()
+        # Optional HashCache that receives the verified hash of every patched file
+        self.hash_cache = hash_cache
+        # Pipe decoder output through the hasher instead of re-reading the result
+        self.stream_output = stream_output
+        self.buffer_size = buffer_size
+        self.decoder = decoder
+        # In "auto" mode, larger targets go to xdelta3 (if it is installed)
+        self.inprocess_max_bytes = inprocess_max_bytes
 
     def _find_xdelta(self):
-        extracted_tools = os.path.join(os.getcwd(), "sims-4-updater-v1.4.7.exe_extracted", "tools", "xdelta3.exe")
-        if os.path.exists(extracted_tools):
-            return extracted_tools
-        return "xdelta3"
+        name = "xdelta3.exe" if sys.platform == "win32" else "xdelta3"
+        bundled = get_tools_path() / name
+        if bundled.exists():
+            return str(bundled)
+        return shutil.which("xdelta3") or "xdelta3"
+
+    def xdelta_available(self) -> bool:
+        return os.path.exists(self.xdelta_exe) or shutil.which(self.xdelta_exe) is not None
+
+    def _use_inprocess(self, source_file, delta_size, target_size=None) -> bool:
+        """
+        Chooses the in-process decoder in "auto" mode when the target is
+        small. Without an expected target_size, source plus delta size stands
+        in for it; an unknown delta_size counts as large.
+        """
+        if self.decoder != "auto":
+            return self.decoder == "vcdiff"
+        if target_size is None:
+            try:
+                target_size = os.path.getsize(source_file) + delta_size if delta_size is not None else None
+            except OSError:
+                target_size = None
+        small = target_size is not None and target_size <= self.inprocess_max_bytes
+        return small or not self.xdelta_available()
 
     @staticmethod
-    def verify_md5(file_path, expected_md5):
+    def verify_hash(file_path, expected_hash, algorithm="md5"):
         if not os.path.exists(file_path):
             return False
         
-        hasher = hashlib.md5()
         try:
+            hasher = hashlib.new(algorithm)
             with open(file_path, 'rb') as f:
-                for chunk in iter(lambda: f.read(8192), b""):
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
                     hasher.update(chunk)
-            return hasher.hexdigest().upper() == expected_md5.upper()
+            return hasher.hexdigest().upper() == expected_hash.upper()
         except Exception:
             return False
 
-    def apply_xdelta(self, source_file, patch_file, target_file):
+    @staticmethod
+    def verify_md5(file_path, expected_md5):
+        return Patcher.verify_hash(file_path, expected_md5, "md5")
+
+    def apply_xdelta(self, source_file, patch_file, target_file, cancel=None):
         """
         Applies an xdelta3 patch.
         Command: xdelta3.exe -d -s <source_file> <patch_file> <target_file>
+
+        Setting the optional cancel event kills the decoder.
         """
         if not os.path.exists(source_file):
             return False, f"Source file missing: {source_file}"
@@ -39,38 +138,279 @@ class Patcher:
         args = [self.xdelta_exe, "-d", "-s", source_file, patch_file, target_file]
         
         try:
-            result = subprocess.run(
-                args,
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            if cancel is None:
+                result = subprocess.run(
+                    args,
+                    capture_output=True,
+                    text=True,
+                    check=True
+                )
+                return True, "Success"
+            with tempfile.TemporaryFile() as err:
+                with subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=err) as process:
+                    _watch_cancel(process, cancel)
+                if process.returncode != 0:
+                    if cancel.is_set():
+                        return False, CANCELLED
+                    err.seek(0)
+                    return False, err.read().decode(errors="replace")
             return True, "Success"
         except subprocess.CalledProcessError as e:
             return False, e.stderr
         except Exception as e:
             return False, str(e)
 
-    def apply_patch_safe(self, source_file, patch_file, target_md5):
+    def apply_xdelta_streaming(self, source_file, patch_file, target_file, hash_type="md5", cancel=None):
+        """
+        Applies an xdelta3 patch with the decoded output piped back to us.
+        Command: xdelta3.exe -d -c -s <source_file> <patch_file>
+
+        Every buffer read from the pipe is written to target_file and fed to the
+        hasher, so the result is verified without a second pass over it.
+        Setting the optional cancel event kills the decoder.
+
+        Returns:
+            (success, digest or error message)
+        """
+        if not os.path.exists(source_file):
+            return False, f"Source file missing: {source_file}"
+        if not os.path.exists(patch_file):
+            return False, f"Patch file missing: {patch_file}"
+
+        args = [self.xdelta_exe, "-d", "-c", "-s", source_file, patch_file]
+
+        try:
+            hasher = hashlib.new(hash_type)
+            buf = bytearray(self.buffer_size)
+            view = memoryview(buf)
+            # stderr goes to a file so a chatty decoder cannot block on a full pipe
+            with tempfile.TemporaryFile() as err:
+                with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=err,
+                                      bufsize=self.buffer_size) as process:
+                    if cancel is not None:
+                        # Killing the decoder closes the pipe and ends the read loop
+                        threading.Thread(target=_watch_cancel, args=(process, cancel), daemon=True).start()
+                    with open(target_file, 'wb', buffering=0) as out:
+                        while True:
+                            n = process.stdout.readinto(buf)
+                            if not n:
+                                break
+                            out.write(view[:n])
+                            hasher.update(view[:n])
+                if process.returncode != 0:
+                    if cancel is not None and cancel.is_set():
+                        return False, CANCELLED
+                    err.seek(0)
+                    return False, err.read().decode(errors="replace")
+            return True, hasher.hexdigest().upper()
+        except Exception as e:
+            return False, str(e)
+
+    def apply_xdelta_pipe(self, source_file, chunks, target_file, hash_type="md5", cancel=None):
+        """
+        Applies a patch fed to xdelta3's stdin from an iterable of byte chunks.
+        Command: xdelta3.exe -d -c -s <source_file>
+
+        Output is written and hashed as in apply_xdelta_streaming.
+
+        Returns:
+            (success, digest or error message)
+        """
+        if not os.path.exists(source_file):
+            return False, f"Source file missing: {source_file}"
+
+        args = [self.xdelta_exe, "-d", "-c", "-s", source_file]
+        feed_error = []
+
+        def feed(stdin):
+            try:
+                for chunk in chunks:
+                    stdin.write(chunk)
+            except (BrokenPipeError, ValueError):
+                pass  # The decoder exited (failed or was killed); its status says why
+            except Exception as e:
+                feed_error.append(e)
+            finally:
+                try:
+                    stdin.close()
+                except OSError:
+                    pass
+
+        try:
+            hasher = hashlib.new(hash_type)
+            buf = bytearray(self.buffer_size)
+            view = memoryview(buf)
+            with tempfile.TemporaryFile() as err:
+                with subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=err,
+                                      bufsize=self.buffer_size) as process:
+                    if cancel is not None:
+                        threading.Thread(target=_watch_cancel, args=(process, cancel), daemon=True).start()
+                    feeder = threading.Thread(target=feed, args=(process.stdin,), daemon=True)
+                    feeder.start()
+                    with open(target_file, 'wb', buffering=0) as out:
+                        while True:
+                            n = process.stdout.readinto(buf)
+                            if not n:
+                                break
+                            out.write(view[:n])
+                            hasher.update(view[:n])
+                    feeder.join()
+                if process.returncode != 0:
+                    if cancel is not None and cancel.is_set():
+                        return False, CANCELLED
+                    err.seek(0)
+                    return False, err.read().decode(errors="replace")
+            if feed_error:
+                return False, f"Reading patch stream failed: {feed_error[0]}"
+            return True, hasher.hexdigest().upper()
+        except Exception as e:
+            return False, str(e)
+
+    def apply_vcdiff(self, source_file, patch_file, target_file, hash_type="md5", cancel=None, progress=None):
+        """
+        Applies a patch with the in-process VCDIFF decoder, hashing each
+        target window as it is written.
+
+        Returns:
+            (success, digest or error message)
+
+        Raises:
+            VcdiffError: If the delta is unsupported or cannot be decoded
+        """
+        if not os.path.exists(source_file):
+            return False, f"Source file missing: {source_file}"
+        if not os.path.exists(patch_file):
+            return False, f"Patch file missing: {patch_file}"
+        hasher = hashlib.new(hash_type)
+        try:
+            decode_file(source_file, patch_file, target_file, on_window=hasher.update, progress=progress,
+                        cancel=cancel)
+        except InterruptedError:
+            return False, CANCELLED
+        except OSError as e:
+            return False, str(e)
+        return True, hasher.hexdigest().upper()
+
+    def _decode(self, source_file, patch_file, temp_file, hash_type, cancel, progress, target_size=None):
+        """Runs the configured decoder; returns (success, message, digest_or_None)."""
+        try:
+            delta_size = os.path.getsize(patch_file)
+        except OSError:
+            delta_size = None
+        if self._use_inprocess(source_file, delta_size, target_size):
+            try:
+                success, message = self.apply_vcdiff(source_file, patch_file, temp_file, hash_type, cancel, progress)
+                return success, message, message if success else None
+            except VcdiffError as e:
+                if self.decoder == "vcdiff":
+                    return False, str(e), None
+                logger.debug(f"In-process decoder cannot apply {patch_file} ({e}); using xdelta3")
+        # Apply patch; in streaming mode the digest comes back with the output
+        if self.stream_output:
+            success, message = self.apply_xdelta_streaming(source_file, patch_file, temp_file, hash_type, cancel)
+            return success, message, message if success else None
+        success, message = self.apply_xdelta(source_file, patch_file, temp_file, cancel)
+        return success, message, None
+
+    def apply_patch_safe(self, source_file, patch_file, target_md5, hash_type="md5", cancel=None, progress=None,
+                         target_size=None):
         """
         Applies a patch safely:
-        1. Patch to a temporary file.
-        2. Verify temporary file MD5.
+        1. Patch to a temporary file (hashing the decoder output as it is written
+           with the in-process decoder or when stream_output is set).
+        2. Verify the temporary file against target_md5, a digest in hash_type.
         3. Replace original file with temporary file.
+        4. Record the verified hash in the hash cache, if one is attached.
+
+        If the optional cancel event is set while decoding, the decoder is
+        stopped, the original file is left untouched and the message is CANCELLED.
+        The in-process decoder calls progress(delta_bytes_done, delta_bytes_total)
+        after each window. In "auto" mode it is used for targets up to
+        inprocess_max_bytes, judged by target_size (the expected size of the
+        patched file) if given.
         """
         temp_file = source_file + ".tmp"
-        
-        # Apply patch
-        success, message = self.apply_xdelta(source_file, patch_file, temp_file)
+        success, message, digest = self._decode(source_file, patch_file, temp_file, hash_type, cancel, progress,
+                                                target_size)
+        return self._finish(source_file, temp_file, target_md5, hash_type, success, message, digest)
+
+    def _decode_stream(self, source_file, patch_stream, temp_file, hash_type, cancel, progress, size,
+                       target_size=None):
+        """Like _decode for a patch read from a stream; returns (success, message, digest_or_None)."""
+        if not os.path.exists(source_file):
+            return False, f"Source file missing: {source_file}", None
+        if not self._use_inprocess(source_file, size, target_size):
+            chunks = iter(lambda: patch_stream.read(self.buffer_size), b"")
+        else:
+            replay = _ReplayStream(patch_stream, STREAM_REPLAY_LIMIT)
+            hasher = hashlib.new(hash_type)
+            try:
+                decode_stream(source_file, replay, temp_file, on_window=hasher.update, progress=progress,
+                              cancel=cancel, total=size)
+                digest = hasher.hexdigest().upper()
+                return True, digest, digest
+            except InterruptedError:
+                return False, CANCELLED, None
+            except VcdiffError as e:
+                if self.decoder == "vcdiff" or not self.xdelta_available():
+                    return False, str(e), None
+                chunks = replay.replay(self.buffer_size)
+                if chunks is None:
+                    return False, f"{e} (too far into the stream to hand over to xdelta3)", None
+                logger.debug(f"In-process decoder cannot apply the streamed patch for {source_file} ({e}); "
+                             f"using xdelta3")
+            except OSError as e:
+                return False, str(e), None
+        success, message = self.apply_xdelta_pipe(source_file, chunks, temp_file, hash_type, cancel)
+        return success, message, message if success else None
+
+    def apply_patch_stream(self, source_file, patch_stream, target_md5, hash_type="md5", cancel=None, progress=None,
+                           size=None, target_size=None):
+        """
+        Applies a patch read from a stream, such as a member of a patch bundle,
+        without writing the patch to disk. Otherwise behaves as apply_patch_safe.
+
+        In "auto" mode the stream is piped to xdelta3's stdin for the same
+        targets apply_patch_safe would hand it (a patch of unknown size counts
+        as large); smaller ones are decoded in-process, and deltas the
+        in-process decoder does not support are handed over to xdelta3.
+
+        Args:
+            patch_stream: Object with read(n); read once, front to back
+            size: Patch size, for progress reports and decoder choice, if known
+            target_size: Expected size of the patched file, if known
+
+        Raises:
+            Exception: Whatever patch_stream.read raises; the source is untouched
+        """
+        temp_file = source_file + ".tmp"
+        try:
+            success, message, digest = self._decode_stream(source_file, patch_stream, temp_file, hash_type, cancel,
+                                                           progress, size, target_size)
+        except Exception:
+            # The stream itself failed (e.g. the connection dropped); the caller decides what next
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        return self._finish(source_file, temp_file, target_md5, hash_type, success, message, digest)
+
+    def _finish(self, source_file, temp_file, target_md5, hash_type, success, message, digest):
+        """Verifies a decoded temp_file and swaps it into place; returns (success, message)."""
         if not success:
             if os.path.exists(temp_file):
                 os.remove(temp_file)
+            if message == CANCELLED:
+                return False, CANCELLED
             return False, f"Patch failed: {message}"
         
-        # Verify MD5
-        if not self.verify_md5(temp_file, target_md5):
+        # Verify hash
+        if digest is not None:
+            verified = digest == target_md5.upper()
+        else:
+            verified = self.verify_hash(temp_file, target_md5, hash_type)
+        if not verified:
             os.remove(temp_file)
-            return False, "MD5 verification failed after patching"
+            return False, f"{hash_type.upper()} verification failed after patching"
         
         # Swap
         try:
@@ -78,6 +418,8 @@ class Patcher:
             if os.path.exists(source_file):
                 os.remove(source_file)
             os.rename(temp_file, source_file)
+            if self.hash_cache is not None:
+                self.hash_cache.record(source_file, target_md5, hash_type)
             return True, "Success"
         except Exception as e:
             if os.path.exists(temp_file):
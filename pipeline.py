@@ -0,0 +1,290 @@
+"""
+Pipelined, parallel patch execution for UpdateManager.
+
+Provides:
+- PatchPipeline: Downloads delta patch files and applies them as they land,
+  several at a time, so network transfer and xdelta work overlap
+- PatchBudget: Admission control for concurrent patch jobs (job count, bytes
+  being read and temporary output bytes)
+
+The download stage and the patch stage are joined by a bounded queue. When
+patching falls behind, finished downloads wait for room in the queue, which
+caps how many patch files sit on disk waiting to be applied.
+
+A task whose operation carries a 'chain' of deltas (see UpdatePlanner) is
+staged once all of its patch files have landed, and its job applies them
+one after another.
+
+Each xdelta job is single-threaded, so the patch stage runs jobs on a thread
+pool: one job per CPU by default, further limited by how many bytes the
+running jobs read (disk bandwidth) and how much temporary output they write
+(free space). Results are committed in task order, and the first failure
+cancels the jobs still running and skips the rest.
+"""
+
+import os
+import queue
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from bandwidth import DEFAULT_PRIORITY
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+_DONE = object()
+
+# Bytes the running jobs may read at once (sources plus patch files)
+DEFAULT_MAX_READ_BYTES = 2 * 1024 ** 3
+# Free space left untouched when the temp budget is derived from the disk
+TEMP_RESERVE = 1024 ** 3
+
+SKIPPED = "Skipped after earlier failure"
+CANCELLED = "Cancelled after earlier failure"
+
+class PatchBudget:
+    """
+    Admits a job while the running jobs stay within max_jobs, max_read_bytes
+    and max_temp_bytes. A job is always admitted when nothing else runs, so
+    one file larger than a budget still makes progress.
+    """
+    def __init__(self, max_jobs: int, max_read_bytes: int, max_temp_bytes: int):
+        self.max_jobs = max(1, max_jobs)
+        self.max_read_bytes = max_read_bytes
+        self.max_temp_bytes = max_temp_bytes
+        self.jobs = 0
+        self.read_bytes = 0
+        self.temp_bytes = 0
+        self.peak_jobs = 0
+        self._cond = threading.Condition()
+
+    def _fits(self, read_bytes, temp_bytes):
+        if self.jobs == 0:
+            return True
+        return (self.jobs < self.max_jobs
+                and self.read_bytes + read_bytes <= self.max_read_bytes
+                and self.temp_bytes + temp_bytes <= self.max_temp_bytes)
+
+    def acquire(self, read_bytes: int, temp_bytes: int, cancel: Optional[threading.Event] = None) -> bool:
+        """Blocks until the job fits; returns False if cancel is set first."""
+        with self._cond:
+            while not self._fits(read_bytes, temp_bytes):
+                if cancel is not None and cancel.is_set():
+                    return False
+                self._cond.wait(0.1)
+            if cancel is not None and cancel.is_set():
+                return False
+            self.jobs += 1
+            self.read_bytes += read_bytes
+            self.temp_bytes += temp_bytes
+            self.peak_jobs = max(self.peak_jobs, self.jobs)
+            return True
+
+    def release(self, read_bytes: int, temp_bytes: int):
+        with self._cond:
+            self.jobs -= 1
+            self.read_bytes -= read_bytes
+            self.temp_bytes -= temp_bytes
+            self._cond.notify_all()
+
+class PatchPipeline:
+    def __init__(self, download_queue, max_staged: int = 4, max_workers: Optional[int] = None,
+                 max_read_bytes: int = DEFAULT_MAX_READ_BYTES, temp_budget: Optional[int] = None):
+        # DownloadQueue used for patch files only; its manager does the transfers
+        self.download_queue = download_queue
+        # Patch files downloaded but not yet admitted to the patch stage
+        self.max_staged = max_staged
+        # Concurrent xdelta jobs (default: one per CPU)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_read_bytes = max_read_bytes
+        # Temporary output bytes allowed at once; None derives it from free space
+        self.temp_budget = temp_budget
+
+    def _temp_budget(self, patch_dir) -> int:
+        if self.temp_budget is not None:
+            return self.temp_budget
+        try:
+            return max(0, shutil.disk_usage(str(patch_dir)).free - TEMP_RESERVE)
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _cost(patch_dir, task, patch_files) -> Tuple[int, int]:
+        """Bytes a job reads (source and patches) and the temp bytes it writes (the target)."""
+        def size(path):
+            try:
+                return os.path.getsize(path)
+            except OSError:
+                return 0
+        source = size(os.path.join(str(patch_dir), task['file']))
+        return source + sum(size(f) for f in patch_files), task.get('size') or source
+
+    @staticmethod
+    def _steps(task) -> List[dict]:
+        """The single-hop tasks a task is applied as: its chain, or the task itself."""
+        chain = task.get('chain')
+        if not chain:
+            return [task]
+        base = {k: v for k, v in task.items() if k != 'chain'}
+        return [{**base, **hop} for hop in chain]
+
+    def run(self, tasks: List[dict], patch_dir, apply: Callable[[int, dict, str], Tuple[bool, str]],
+            callback: Optional[Callable] = None, commit: Optional[Callable[[int, dict, Dict], None]] = None,
+            cancel: Optional[threading.Event] = None) -> List[Dict]:
+        """
+        Downloads every task's patch_url to "<file>.delta" under patch_dir and
+        calls apply(index, task, patch_file) for each once it lands, running up
+        to max_workers patches at a time within the read and temp budgets.
+        For a task with a 'chain', each hop is downloaded to "<file>.<n>.delta"
+        and apply is called per hop, in order, with the hop merged into the
+        task; the first failing hop fails the task.
+
+        After the first failure, cancel is set (pass an event that apply hands
+        to Patcher.apply_patch_safe so running decoders stop): patches not yet
+        started are skipped and so are queued patch downloads; only downloads
+        already in flight finish. A patch file is deleted once it has been
+        applied or skipped.
+
+        Args:
+            tasks: patch_delta operations
+            patch_dir: Directory the patch files are downloaded into
+            apply: Applies one patch; returns (success, message)
+            callback: Receives download progress dicts
+            commit: Called as commit(index, task, result) for every task in
+                task order, e.g. to update the operation journal
+            cancel: Event set on the first failure (created if not given)
+
+        Returns:
+            list: {'file', 'success', 'error', 'cancelled'} per task, in task
+            order; 'cancelled' marks tasks stopped by another task's failure
+        """
+        results: List[Optional[Dict]] = [None] * len(tasks)
+        if not tasks:
+            return []
+        cancel = cancel or threading.Event()
+
+        self.download_queue.clear()
+        steps = [self._steps(task) for task in tasks]
+        patch_files: List[List[str]] = []
+        # Task index of each queued download
+        owners = []
+        for index, task in enumerate(tasks):
+            files = []
+            for n, step in enumerate(steps[index]):
+                filename = task['file'] + (f".{n}.delta" if len(steps[index]) > 1 else ".delta")
+                files.append(os.path.join(str(patch_dir), filename))
+                owners.append(index)
+                self.download_queue.add_task(step['patch_url'], str(patch_dir), filename=filename,
+                                             priority=task.get('priority', DEFAULT_PRIORITY))
+            patch_files.append(files)
+        outstanding = [len(s) for s in steps]
+        download_failure: List[Optional[Dict]] = [None] * len(tasks)
+        landed_lock = threading.Lock()
+
+        staged = queue.Queue(maxsize=self.max_staged)
+        budget = PatchBudget(self.max_workers, self.max_read_bytes, self._temp_budget(patch_dir))
+        commit_lock = threading.Lock()
+        committed = [0]
+
+        def finish(index, success, error=None, cancelled=False):
+            if not success and not cancelled:
+                cancel.set()
+            results[index] = {'file': tasks[index]['file'], 'success': success, 'error': error,
+                              'cancelled': cancelled}
+            # Commit every finished result whose predecessors are all committed
+            with commit_lock:
+                while committed[0] < len(tasks) and results[committed[0]] is not None:
+                    if commit:
+                        try:
+                            commit(committed[0], tasks[committed[0]], results[committed[0]])
+                        except Exception as e:
+                            logger.error(f"Committing patch result for {tasks[committed[0]]['file']} failed: {e}")
+                    committed[0] += 1
+
+        def landed(position, result):
+            # Runs on a download thread; blocks while the patch stage is behind
+            index = owners[position]
+            with landed_lock:
+                if not result['success'] and download_failure[index] is None:
+                    download_failure[index] = result
+                outstanding[index] -= 1
+                if outstanding[index]:
+                    return
+            staged.put((index, download_failure[index] or result))
+
+        def download_stage():
+            try:
+                self.download_queue.process_all(callback=callback, on_complete=landed, cancel=cancel)
+            except Exception as e:
+                logger.error(f"Patch file downloads failed: {e}")
+            finally:
+                staged.put(_DONE)
+
+        def job(index, read_bytes, temp_bytes):
+            try:
+                if cancel.is_set():
+                    finish(index, False, SKIPPED, cancelled=True)
+                    return
+                for n, (step, patch_file) in enumerate(zip(steps[index], patch_files[index])):
+                    if n and cancel.is_set():
+                        # Later hops of a chain stop between files once cancelled
+                        success, message = False, CANCELLED
+                        break
+                    success, message = apply(index, step, patch_file)
+                    if not success:
+                        break
+                if not success and cancel.is_set():
+                    # Stopped (or collateral damage) because another patch failed first
+                    finish(index, False, CANCELLED, cancelled=True)
+                else:
+                    finish(index, success, None if success else message)
+            except Exception as e:
+                logger.exception(f"Applying patch for {tasks[index]['file']} raised: {e}")
+                finish(index, False, str(e))
+            finally:
+                budget.release(read_bytes, temp_bytes)
+                self._discard(*patch_files[index])
+
+        downloader = threading.Thread(target=download_stage, name="patch-downloads", daemon=True)
+        downloader.start()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="patch") as pool:
+            while True:
+                item = staged.get()
+                if item is _DONE:
+                    break
+                index, result = item
+                if result.get('cancelled'):
+                    self._discard(*patch_files[index])
+                    finish(index, False, SKIPPED, cancelled=True)
+                    continue
+                if not result['success']:
+                    self._discard(*patch_files[index])
+                    finish(index, False, f"Patch download failed: {result.get('error')}")
+                    continue
+                read_bytes, temp_bytes = self._cost(patch_dir, tasks[index], patch_files[index])
+                if cancel.is_set() or not budget.acquire(read_bytes, temp_bytes, cancel):
+                    self._discard(*patch_files[index])
+                    finish(index, False, SKIPPED, cancelled=True)
+                    continue
+                pool.submit(job, index, read_bytes, temp_bytes)
+        downloader.join()
+
+        for index, task in enumerate(tasks):
+            if results[index] is None:
+                finish(index, False, "Patch file was not downloaded", cancelled=cancel.is_set())
+        if budget.peak_jobs > 1:
+            logger.info(f"Applied patches with up to {budget.peak_jobs} concurrent jobs")
+        return results
+
+    @staticmethod
+    def _discard(*patch_files):
+        for patch_file in patch_files:
+            try:
+                os.remove(patch_file)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove patch file {patch_file}: {e}")
@@ -0,0 +1,210 @@
+"""
+Cost-based update planning for UpdateManager.
+
+Provides:
+- CostModel: Estimates transfer and patching time from measured throughput
+- UpdatePlanner: Picks the cheapest way to bring one file to its target
+  version, either a chain of deltas or a full download
+
+Available deltas form a graph whose nodes are file versions, identified by
+(algorithm, digest), and whose edges are patch files. The planner runs a
+shortest-path search from every hash the local file is known to have
+and compares the cheapest delta chain that reaches the target with a full
+download. An edge costs its download time plus the time to apply it.
+
+Sizes the manifest does not state are estimated: a delta is taken to be
+UNKNOWN_DELTA_FRACTION of the full file. Without a full size, a full download
+cannot be priced, so any delta chain that reaches the target wins, as
+before the planner existed.
+"""
+
+import os
+import json
+import heapq
+import itertools
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from paths import get_app_data_path
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+# Defaults until the first session has been measured
+DEFAULT_THROUGHPUT = 5 * 1024 ** 2   # Download bytes per second
+DEFAULT_PATCH_RATE = 50 * 1024 ** 2  # Source bytes patched per second
+# Fixed cost per file fetched (connection, request, queueing)
+REQUEST_OVERHEAD = 0.5
+# Patch size assumed when the manifest does not state one
+UNKNOWN_DELTA_FRACTION = 0.25
+# Sessions and files smaller than this are too short to time reliably
+MIN_SAMPLE_BYTES = 4 * 1024 ** 2
+# Longest delta chain considered
+MAX_HOPS = 8
+
+Node = Tuple[str, str]
+
+def _mb(n: Optional[int]) -> str:
+    return "unknown size" if n is None else f"{n / 1024 ** 2:.1f} MB"
+
+class CostModel:
+    """
+    Download throughput and patch speed, smoothed over sessions and kept
+    in a JSON file so the next plan starts from measured numbers.
+    """
+    def __init__(self, store_path: Optional[Path] = None, throughput: Optional[float] = None,
+                 patch_rate: Optional[float] = None, request_overhead: float = REQUEST_OVERHEAD,
+                 alpha: float = 0.3):
+        # None keeps the model in memory only
+        self.store_path = Path(store_path) if store_path else None
+        self.request_overhead = request_overhead
+        # Weight of the newest measurement
+        self.alpha = alpha
+        stored = self._read()
+        self.throughput = throughput or stored.get('throughput') or DEFAULT_THROUGHPUT
+        self.patch_rate = patch_rate or stored.get('patch_rate') or DEFAULT_PATCH_RATE
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls) -> "CostModel":
+        """The model persisted in the app data directory."""
+        return cls(get_app_data_path() / "cost_model.json")
+
+    def _read(self) -> Dict[str, Any]:
+        if self.store_path is None:
+            return {}
+        try:
+            with open(self.store_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def save(self):
+        if self.store_path is None:
+            return
+        data = {'throughput': self.throughput, 'patch_rate': self.patch_rate,
+                'updated': datetime.now().isoformat()}
+        # Write-then-rename so a concurrent reader never sees a partial file
+        tmp_path = self.store_path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            self.store_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.store_path)
+        except OSError as e:
+            logger.warning(f"Could not save cost model to {self.store_path}: {e}")
+
+    def _blend(self, old: float, sample: float) -> float:
+        return self.alpha * sample + (1 - self.alpha) * old
+
+    def observe_throughput(self, bytes_per_second: float, sample_bytes: int):
+        """Records the download rate measured over sample_bytes."""
+        if bytes_per_second and bytes_per_second > 0 and sample_bytes >= MIN_SAMPLE_BYTES:
+            with self._lock:
+                self.throughput = self._blend(self.throughput, bytes_per_second)
+
+    def observe_patch(self, source_bytes: int, seconds: float):
+        """Records how long patching a file of source_bytes took."""
+        if source_bytes >= MIN_SAMPLE_BYTES and seconds > 0:
+            with self._lock:
+                self.patch_rate = self._blend(self.patch_rate, source_bytes / seconds)
+
+    def download_seconds(self, nbytes: int) -> float:
+        return self.request_overhead + nbytes / self.throughput
+
+    def patch_seconds(self, source_bytes: int) -> float:
+        return source_bytes / self.patch_rate
+
+class UpdatePlanner:
+    def __init__(self, cost_model: Optional[CostModel] = None, max_hops: int = MAX_HOPS):
+        self.cost_model = cost_model or CostModel()
+        self.max_hops = max_hops
+
+    def _edge_cost(self, edge: Dict, full_size: Optional[int], file_size: Optional[int]) -> Tuple[float, int]:
+        patch_bytes = edge.get('size')
+        if patch_bytes is None:
+            patch_bytes = int((full_size or 0) * UNKNOWN_DELTA_FRACTION)
+        work = file_size or full_size or 0
+        return self.cost_model.download_seconds(patch_bytes) + self.cost_model.patch_seconds(work), patch_bytes
+
+    def cheapest_chain(self, start: Iterable[Node], target: Node, edges: List[Dict],
+                       full_size: Optional[int] = None, file_size: Optional[int] = None):
+        """
+        Dijkstra search over delta edges from any start node to target.
+
+        Returns:
+            (cost, download_bytes, [edge, ...]) or None if no chain within
+            max_hops reaches target
+        """
+        graph: Dict[Node, List[Dict]] = {}
+        for edge in edges:
+            graph.setdefault(edge['from'], []).append(edge)
+
+        tie = itertools.count()
+        heap = [(0.0, next(tie), node, 0, []) for node in set(start)]
+        heapq.heapify(heap)
+        settled = set()
+        while heap:
+            cost, _, node, nbytes, path = heapq.heappop(heap)
+            if node == target:
+                return cost, nbytes, path
+            if node in settled:
+                continue
+            settled.add(node)
+            if len(path) >= self.max_hops:
+                continue
+            for edge in graph.get(node, []):
+                if edge['to'] in settled:
+                    continue
+                edge_cost, edge_bytes = self._edge_cost(edge, full_size, file_size)
+                heapq.heappush(heap, (cost + edge_cost, next(tie), edge['to'], nbytes + edge_bytes, path + [edge]))
+        return None
+
+    def plan(self, start: Iterable[Node], target: Node, edges: List[Dict], full_size: Optional[int] = None,
+             file_size: Optional[int] = None, full_available: bool = True) -> Dict[str, Any]:
+        """
+        Chooses between the cheapest delta chain and a full download.
+
+        Args:
+            start: (algorithm, digest) pairs the local file currently has
+            target: (algorithm, digest) the file must end up with
+            edges: Delta edges from ManifestParser.get_delta_edges
+            full_size: Size of the full file, if the manifest states it
+            file_size: Size of the local file (the work each patch does)
+            full_available: Whether a full download URL exists
+
+        Returns:
+            dict: {'strategy': 'delta' or 'full', 'hops': [edge, ...],
+            'cost': estimated seconds, 'download_bytes', 'alternatives':
+            {'delta': seconds or None, 'full': seconds or None}, 'reason'}
+        """
+        chain = self.cheapest_chain(start, target, edges, full_size, file_size)
+        full_cost = self.cost_model.download_seconds(full_size) if full_available and full_size is not None else None
+        alternatives = {'delta': chain[0] if chain else None, 'full': full_cost}
+
+        if chain and (full_cost is None or chain[0] <= full_cost):
+            cost, nbytes, hops = chain
+            if len(hops) == 1:
+                reason = f"Delta ({_mb(hops[0].get('size'))})"
+            else:
+                versions = [hops[0].get('from_label')] + [hop.get('to_label') for hop in hops]
+                route = " -> ".join(v for v in versions if v) if all(versions) else f"{len(hops)} hops"
+                reason = f"Delta chain {route} ({_mb(nbytes)})"
+            reason += f", ~{cost:.1f}s"
+            if full_cost is not None:
+                reason += f" vs full download ({_mb(full_size)}), ~{full_cost:.1f}s"
+            return {'strategy': 'delta', 'hops': hops, 'cost': cost, 'download_bytes': nbytes,
+                    'alternatives': alternatives, 'reason': reason}
+
+        if chain:
+            reason = (f"Full download ({_mb(full_size)}), ~{full_cost:.1f}s, is cheaper than "
+                      f"delta chain ({_mb(chain[1])}), ~{chain[0]:.1f}s")
+        elif edges:
+            reason = "Source hash mismatch for delta"
+        else:
+            reason = "No delta available"
+        return {'strategy': 'full', 'hops': [], 'cost': full_cost, 'download_bytes': full_size,
+                'alternatives': alternatives, 'reason': reason}
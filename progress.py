@@ -0,0 +1,123 @@
+"""
+Aggregated download progress.
+
+Provides:
+- ProgressAggregator: Collects per-file progress events from every active
+  transfer and publishes one combined, numeric progress report at a fixed rate
+
+Downloaders report each file separately (aria2c once per second per
+process), so a large queue produces a steady flood of events. Feeding them
+to an aggregator only updates counters; the caller's publish function runs
+at most once per interval, with totals in bytes, an exponentially weighted
+throughput in bytes/sec and an ETA in seconds.
+"""
+
+import time
+import threading
+from typing import Any, Callable, Dict, Optional
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+class ProgressAggregator:
+    def __init__(self, publish: Callable[[Dict[str, Any]], None], interval: float = 0.5, alpha: float = 0.3,
+                 expected_files: Optional[int] = None, clock=time.monotonic):
+        self.publish = publish
+        self.interval = interval
+        # Weight of the newest throughput sample in the moving average
+        self.alpha = alpha
+        self.expected_files = expected_files
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._rate: Optional[float] = None
+        self._last_sample: Optional[tuple] = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def ingest(self, progress: Dict[str, Any]):
+        """
+        Records a downloader progress event; usable directly as a download callback.
+
+        Events carry 'completed_bytes'/'total_bytes' where the downloader knows
+        them, and always 'percentage'; 'file' tells concurrent transfers apart.
+        """
+        key = progress.get('file') or ""
+        with self._lock:
+            entry = self._files.setdefault(key, {'done': 0, 'total': None, 'percentage': 0})
+            if progress.get('completed_bytes') is not None:
+                entry['done'] = progress['completed_bytes']
+            if progress.get('total_bytes'):
+                entry['total'] = progress['total_bytes']
+            if progress.get('percentage') is not None:
+                entry['percentage'] = progress['percentage']
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the combined progress and advances the throughput average."""
+        now = self._clock()
+        with self._lock:
+            files = list(self._files.values())
+            done = sum(f['done'] for f in files)
+            known_totals = all(f['total'] for f in files)
+            total = sum(f['total'] for f in files) if files and known_totals else None
+
+            if self._last_sample is not None and now > self._last_sample[0]:
+                # Retries can move a counter backwards; that is not negative throughput
+                sample = max(0.0, (done - self._last_sample[1]) / (now - self._last_sample[0]))
+                self._rate = sample if self._rate is None else self.alpha * sample + (1 - self.alpha) * self._rate
+            self._last_sample = (now, done)
+            rate = self._rate or 0.0
+
+        completed = sum(1 for f in files if f['percentage'] >= 100 or (f['total'] and f['done'] >= f['total']))
+        if total:
+            percentage = min(100.0, done * 100.0 / total)
+        elif files:
+            percentage = sum(f['percentage'] for f in files) / len(files)
+        else:
+            percentage = 0.0
+        eta = (total - done) / rate if total is not None and rate > 0 else None
+        return {
+            'current': done,
+            'total': total,
+            'percentage': round(percentage, 1),
+            'speed': rate,
+            'eta': eta,
+            'active': len(files) - completed,
+            'files_completed': completed,
+            'files_total': self.expected_files if self.expected_files is not None else len(files),
+        }
+
+    def publish_now(self):
+        try:
+            self.publish(self.snapshot())
+        except Exception as e:
+            logger.warning(f"Progress publish failed: {e}")
+
+    def start(self):
+        """Publishes every interval seconds on a background thread until stop()."""
+        self._last_sample = (self._clock(), 0)
+        self._thread = threading.Thread(target=self._run, name="progress-aggregator", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self._files:
+                self.publish_now()
+
+    def stop(self):
+        """Stops publishing and sends one final report if anything was recorded."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._files:
+            self.publish_now()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
@@ -0,0 +1,127 @@
+"""
+Repair module for fixing corrupted game files in place.
+
+Provides:
+- RangeRepairer: Fetches only the corrupt byte ranges of a file via HTTP Range
+  requests, splices them into the local copy and re-verifies the result
+
+Block maps come from the manifest ("blocks" entry) or from a sidecar
+"<payload url>.blockmap" JSON document of the same shape. Requests go through
+the shared pooled client (http_client.get_client).
+"""
+
+import os
+import json
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, List, Tuple
+from engine import VerificationEngine, ManifestParser
+from http_client import get_client
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+# Block maps fetched at once while planning
+BLOCK_MAP_FETCH_WORKERS = 8
+
+class RangeRepairer:
+    def __init__(self, engine: Optional[VerificationEngine] = None, timeout: float = 30.0,
+                 client: Optional[httpx.Client] = None):
+        self.engine = engine or VerificationEngine()
+        self.client = client or get_client()
+        self.timeout = timeout
+
+    def fetch_block_map(self, url: str) -> Optional[dict]:
+        """
+        Fetches the sidecar block map published next to a payload.
+
+        Returns:
+            dict: {'block_size': int, 'hashes': list} or None if unavailable
+        """
+        blockmap_url = url + ".blockmap"
+        try:
+            response = self.client.get(blockmap_url, timeout=self.timeout, follow_redirects=True)
+            if response.status_code != 200:
+                return None
+            data = response.json()
+        except (httpx.RequestError, json.JSONDecodeError, ValueError) as e:
+            logger.debug(f"No usable block map at {blockmap_url}: {e}")
+            return None
+
+        return ManifestParser.get_block_map({'name': url, 'blocks': data})
+
+    def fetch_block_maps(self, urls: List[str]) -> Dict[str, Optional[dict]]:
+        """
+        Fetches the sidecar block maps of several payloads concurrently.
+
+        Returns:
+            dict: url -> block map, or None where unavailable
+        """
+        urls = list(dict.fromkeys(urls))
+        if len(urls) <= 1:
+            return {url: self.fetch_block_map(url) for url in urls}
+        with ThreadPoolExecutor(max_workers=min(BLOCK_MAP_FETCH_WORKERS, len(urls)),
+                                thread_name_prefix="blockmap") as pool:
+            return dict(zip(urls, pool.map(self.fetch_block_map, urls)))
+
+    def _fetch_range(self, url: str, start: int, end: int, out_file):
+        """Streams bytes [start, end) from url into out_file at offset start."""
+        headers = {"Range": f"bytes={start}-{end - 1}"}
+        with self.client.stream("GET", url, headers=headers, timeout=self.timeout,
+                                follow_redirects=True) as response:
+            if response.status_code != 206:
+                raise ValueError(f"Server did not honour range request (HTTP {response.status_code})")
+            out_file.seek(start)
+            written = 0
+            for chunk in response.iter_bytes():
+                out_file.write(chunk)
+                written += len(chunk)
+        if written != end - start:
+            raise ValueError(f"Short range response: got {written} of {end - start} bytes")
+        return written
+
+    def repair(self, file_path: str, url: str, bad_ranges: List[List[int]], block_map: dict,
+               target_md5: str, expected_size: int, progress_callback=None,
+               hash_type: str = "md5") -> Tuple[bool, str]:
+        """
+        Repairs a file by re-downloading only its corrupt byte ranges.
+
+        Ranges past expected_size are truncated instead of fetched. After
+        splicing, the file is checked block by block (in the engine's algorithm)
+        and then as a whole against target_md5, a digest in hash_type.
+
+        Returns:
+            (success, message)
+        """
+        block_size = block_map['block_size']
+        hashes = block_map['hashes']
+
+        fetched = 0
+        try:
+            with open(file_path, 'r+b') as f:
+                for i, (start, end) in enumerate(bad_ranges):
+                    end = min(end, expected_size)
+                    if start < end:
+                        fetched += self._fetch_range(url, start, end, f)
+                    if progress_callback:
+                        progress_callback({
+                            'status': 'repairing',
+                            'current': i + 1,
+                            'total': len(bad_ranges),
+                            'file': os.path.basename(file_path),
+                            'bytes_fetched': fetched
+                        })
+                f.truncate(expected_size)
+        except (httpx.HTTPError, ValueError, OSError) as e:
+            logger.error(f"Range repair of {file_path} failed: {e}")
+            return False, f"Range repair failed: {e}"
+
+        report = self.engine.verify_blocks(file_path, block_size, hashes, stop_at_first=True, expected_size=expected_size)
+        if not report['valid']:
+            return False, "Block verification failed after repair"
+        if self.engine.hash_file(file_path, algorithm=hash_type) != target_md5.upper():
+            return False, f"{hash_type.upper()} verification failed after repair"
+
+        logger.info(f"Repaired {file_path}: fetched {fetched} bytes in {len(bad_ranges)} ranges")
+        return True, "Success"
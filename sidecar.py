@@ -10,17 +10,73 @@ Message Format:
 - Progress: {"id": "request_id", "type": "progress", "data": {...}}
 
 All errors are logged and returned with error code, message, and timestamp.
+
+Control commands (see CONTROL_COMMANDS) are answered as soon as they are read,
+even while a long command such as start_update is still running.
 """
 
 import sys
 import json
 import os
+import queue
 import logging
+import threading
 from logging_system import get_logger
+from paths import get_app_data_path
 
 # Setup logging
 logger = get_logger()
 
+# Commands handled on the stdin reader thread instead of waiting their turn
+CONTROL_COMMANDS = ("set_bandwidth", "get_bandwidth", "get_http_metrics")
+
+_stdout_lock = threading.Lock()
+
+def emit(message):
+    """Writes one JSON message line; safe to call from any thread."""
+    with _stdout_lock:
+        print(json.dumps(message), flush=True)
+
+def handle_control(request):
+    """
+    Handles a control command and returns its response.
+
+    set_bandwidth takes "limit" in bytes/sec (0 removes the cap); both
+    bandwidth commands return the scheduler status. get_http_metrics returns
+    the shared HTTP client pool counters.
+    """
+    from bandwidth import get_scheduler
+    req_id = request.get("id")
+    if request.get("command") == "get_http_metrics":
+        from http_client import pool_metrics
+        return {"id": req_id, "result": pool_metrics()}
+    scheduler = get_scheduler()
+    try:
+        if request.get("command") == "set_bandwidth":
+            scheduler.set_rate(request["limit"])
+        return {"id": req_id, "result": scheduler.status()}
+    except KeyError as e:
+        return {"id": req_id, "error": {
+            "code": "MISSING_FIELD",
+            "message": f"Request missing required field: {e}",
+            "field": str(e)
+        }}
+    except ValueError as e:
+        return {"id": req_id, "error": {"code": "INVALID_ARGUMENT", "message": str(e)}}
+
+def _read_requests(lines):
+    """Feeds stdin lines to the main loop, answering control commands directly."""
+    for line in sys.stdin:
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError:
+            request = None
+        if isinstance(request, dict) and request.get("command") in CONTROL_COMMANDS:
+            emit(handle_control(request))
+            continue
+        lines.put(line)
+    lines.put(None)
+
 def main():
     """
     Main event loop for processing JSON-RPC requests from stdin.
@@ -30,13 +86,34 @@ def main():
     """
     try:
         logger.info("Sidecar process started - signaling readiness")
-        print(json.dumps({"type": "ready"}), flush=True)
+        emit({"type": "ready"})
     except Exception as e:
         logger.error(f"Failed to send ready signal: {e}")
     
     aria2 = None
+    # Long-lived aria2c RPC daemon, started on first use and shared across updates
+    aria2_rpc = None
+    # game_dir -> (ChangeJournal, watcher) for incremental verification
+    watchers = {}
+    # Downloaded payloads shared by every game directory, opened on first use
+    content_store = None
+
+    def get_content_store(request):
+        nonlocal content_store
+        # Opt-in: the store lives in app data and keeps files after updates
+        if not request.get("content_store", False):
+            return None
+        if content_store is None:
+            from content_store import ContentStore
+            content_store = ContentStore()
+        if request.get("content_store_budget") is not None:
+            content_store.max_bytes = int(request["content_store_budget"])
+        return content_store
+
+    lines = queue.Queue()
+    threading.Thread(target=_read_requests, args=(lines,), name="sidecar-stdin", daemon=True).start()
     
-    for line in sys.stdin:
+    for line in iter(lines.get, None):
         try:
             request = json.loads(line)
             command = request.get("command")
@@ -48,8 +125,9 @@ def main():
                 
             elif command == "hash_file":
                 from engine import VerificationEngine
+                from hash_cache import HashCache
                 path = request.get("path")
-                engine = VerificationEngine()
+                engine = VerificationEngine(cache=HashCache.default())
                 file_hash = engine.hash_file(path)
                 response = {"id": req_id, "result": file_hash}
                 
@@ -63,23 +141,30 @@ def main():
                 version = request.get("version")
                 selected_packs = request.get("selected_packs")
                 language = request.get("language", "en_US")
+                hash_backend = request.get("hash_backend", "adaptive")
+                journal = watchers[game_dir][0] if game_dir in watchers else None
                 
-                manager = UpdateManager(game_dir, manifest_url, aria2)
+                manager = UpdateManager(game_dir, manifest_url, aria2, hash_backend=hash_backend, journal=journal,
+                                        content_store=get_content_store(request),
+                                        state_dir=get_app_data_path())
                 
                 def on_progress(p):
-                    print(json.dumps({"id": req_id, "type": "progress", "data": p}), flush=True)
+                    emit({"id": req_id, "type": "progress", "data": p})
 
                 ops = manager.get_operations(
                     progress_callback=on_progress, 
                     target_version=version,
                     selected_packs=selected_packs,
-                    target_language=language
+                    target_language=language,
+                    verify_level=request.get("level", "full")
                 )
                 response = {"id": req_id, "result": ops}
                 
             elif command == "start_update": # New command for orchestrated update
                 from update_logic import UpdateManager
-                from download import Aria2Manager
+                from download import (
+                    Aria2Manager, HttpDownloader, SegmentedDownloader, StripedDownloader, create_aria2_manager
+                )
                 if aria2 is None: aria2 = Aria2Manager()
 
                 game_dir = request.get("game_dir")
@@ -87,11 +172,37 @@ def main():
                 version = request.get("version")
                 selected_packs = request.get("selected_packs")
                 language = request.get("language", "en_US")
+                hash_backend = request.get("hash_backend", "adaptive")
+                # "aria2" (the default) uses the RPC daemon, falling back to one process per
+                # file; the aria2 modes re-read each file to check it. "http", "segmented"
+                # and "striped" are opt-in and hash while downloading.
+                downloader_name = request.get("downloader", "aria2")
+                if downloader_name == "aria2":
+                    if aria2_rpc is None: aria2_rpc = create_aria2_manager()
+                    downloader = aria2_rpc
+                elif downloader_name == "aria2_subprocess":
+                    downloader = aria2
+                elif downloader_name == "segmented":
+                    downloader = SegmentedDownloader(max_connections=request.get("connections", 8))
+                elif downloader_name == "striped":
+                    # mirrors: discover_mirrors results whose urls are prefixes of the same tree
+                    downloader = StripedDownloader(request.get("mirrors", []),
+                                                   max_connections=request.get("connections", 8))
+                elif downloader_name == "http":
+                    downloader = HttpDownloader()
+                else:
+                    raise ValueError(f"Unknown downloader: {downloader_name}")
+                
+                journal = watchers[game_dir][0] if game_dir in watchers else None
                 
-                manager = UpdateManager(game_dir, manifest_url, aria2)
+                manager = UpdateManager(game_dir, manifest_url, downloader, hash_backend=hash_backend, journal=journal,
+                                        content_store=get_content_store(request),
+                                        state_dir=get_app_data_path())
+                # Download progress is aggregated and published at this fixed rate (seconds)
+                manager.progress_interval = request.get("progress_interval", manager.progress_interval)
                 
                 def on_progress(p):
-                    print(json.dumps({"id": req_id, "type": "progress", "data": p}), flush=True)
+                    emit({"id": req_id, "type": "progress", "data": p})
 
                 # First, get operations
                 on_progress({'status': 'fetching_manifest', 'message': 'Fetching manifest...'})
@@ -104,7 +215,7 @@ def main():
                 
                 if not operations:
                     response = {"id": req_id, "result": {"success": False, "message": "No operations found or manifest error."}}
-                    print(json.dumps(response), flush=True)
+                    emit(response)
                     continue
 
                 # Then, apply operations
@@ -113,6 +224,21 @@ def main():
                 
                 response = {"id": req_id, "result": {"success": success, "message": message}}
                 
+            elif command == "start_watch":
+                from change_journal import ChangeJournal, start_watcher
+                game_dir = request.get("game_dir")
+                if game_dir not in watchers:
+                    journal = ChangeJournal(game_dir, audit_count=request.get("audit_count", 16))
+                    watcher = start_watcher(journal, prefer=request.get("watcher", "auto"))
+                    watchers[game_dir] = (journal, watcher)
+                response = {"id": req_id, "result": {"watcher": watchers[game_dir][1].name}}
+
+            elif command == "stop_watch":
+                entry = watchers.pop(request.get("game_dir"), None)
+                if entry:
+                    entry[1].stop()
+                response = {"id": req_id, "result": {"stopped": entry is not None}}
+
             elif command == "check_interrupted":
                 from update_logic import UpdateManager
                 from download import Aria2Manager
@@ -262,7 +388,7 @@ def main():
             else:
                 response = {"id": req_id, "error": f"Unknown command: {command}"}
                 
-            print(json.dumps(response), flush=True)
+            emit(response)
                 
         except json.JSONDecodeError as e:
             # Invalid JSON from renderer
@@ -275,7 +401,7 @@ def main():
                     "details": str(e)
                 }
             }
-            print(json.dumps(error_response), flush=True)
+            emit(error_response)
         except KeyError as e:
             # Missing required field in request
             logger.error(f"Missing required field in request: {e}")
@@ -287,7 +413,7 @@ def main():
                     "field": str(e)
                 }
             }
-            print(json.dumps(error_response), flush=True)
+            emit(error_response)
         except FileNotFoundError as e:
             # File or directory not found
             logger.error(f"File not found: {e}")
@@ -299,7 +425,7 @@ def main():
                     "path": str(e)
                 }
             }
-            print(json.dumps(error_response), flush=True)
+            emit(error_response)
         except PermissionError as e:
             # Permission denied
             logger.error(f"Permission denied: {e}")
@@ -311,7 +437,7 @@ def main():
                     "details": str(e)
                 }
             }
-            print(json.dumps(error_response), flush=True)
+            emit(error_response)
         except Exception as e:
             # Unexpected error - log with traceback
             logger.exception(f"Unexpected error processing command '{request.get('command', 'unknown')}': {e}")
@@ -324,7 +450,20 @@ def main():
                     "details": str(e)
                 }
             }
-            print(json.dumps(error_response), flush=True)
+            emit(error_response)
+
+    # stdin closed: the Electron side is gone, so release background resources
+    for journal, watcher in watchers.values():
+        watcher.stop()
+    if hasattr(aria2_rpc, "stop"):
+        aria2_rpc.stop()
+    if content_store is not None:
+        content_store.close()
+    from http_client import close_clients
+    close_clients()
 
 if __name__ == "__main__":
+    # Required for the process-pool hashing backend in the frozen (PyInstaller) build
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
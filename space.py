@@ -0,0 +1,174 @@
+"""
+Disk-space-aware scheduling of update operations.
+
+Provides:
+- footprint: Extra bytes an operation needs while it runs, and keeps afterwards,
+  on each filesystem role
+- SpaceScheduler: Orders operations into batches whose peak extra usage stays
+  within a per-filesystem budget
+- volumes_for: Maps filesystem roles to devices and their free space
+
+Every operation briefly holds two copies of a file: a download lands in a
+".part" file next to the old version, a patch writes "<file>.tmp" next to its
+source, and a content store copy goes through "<file>.store.tmp". So the free
+space an update needs is well above its final size. Roles are "game" (the
+install directory), "patches" (where patch files are downloaded) and "store"
+(the content store). Roles that live on the same device share its budget.
+
+Sizes come from the operation: 'size' is the target file size from the
+manifest and 'patch_size' the delta download. Operations without sizes count
+as free, as before this scheduler existed.
+"""
+
+import os
+import shutil
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from logging_system import get_logger
+
+# Setup logging
+logger = get_logger()
+
+# Free space left untouched when budgets are derived from the disk
+SPACE_RESERVE = 512 * 1024 ** 2
+
+Footprint = Dict[str, Tuple[int, int]]
+
+def footprint(op: Dict[str, Any], local_size: int = 0, deposits: bool = False) -> Footprint:
+    """
+    Returns {role: (peak, final)} for one operation.
+
+    peak is the most extra bytes the operation holds at once while it runs;
+    final is the net change once it has finished (negative if it frees space).
+
+    Args:
+        op: An operation from UpdateManager.get_operations
+        local_size: Current size of the file the operation replaces
+        deposits: Whether verified downloads are also added to the content store
+    """
+    kind = op.get('type')
+    size = op.get('size') or 0
+    final = size - local_size if size else 0
+    if kind == 'download_full':
+        result = {'game': (size, final)}
+        if deposits and size:
+            result['store'] = (size, size)
+        return result
+    if kind == 'copy_from_store':
+        return {'game': (size, final)}
+    if kind == 'patch_delta':
+        # Patch files are all downloaded before the chain is applied; each hop
+        # writes a full temporary copy of the file before replacing it
+        hop_size = max(size, local_size)
+        # Deltas streamed from a patch bundle never land on disk
+        patch_bytes = 0 if op.get('bundle_url') else op.get('patch_size') or 0
+        return {'game': (hop_size, final), 'patches': (patch_bytes, 0)}
+    if kind == 'repair_blocks':
+        # Bad ranges are rewritten in place
+        grow = max(0, (op.get('expected_size') or 0) - local_size)
+        return {'game': (grow, grow)}
+    return {}
+
+def volumes_for(paths: Dict[str, Any], reserve: int = SPACE_RESERVE,
+                max_extra: Optional[int] = None) -> Tuple[Dict[str, str], Dict[str, int]]:
+    """
+    Resolves roles to devices and derives each device's budget.
+
+    Args:
+        paths: role -> directory (the nearest existing parent is inspected)
+        reserve: Free bytes left untouched on every device
+        max_extra: Optional cap on extra bytes per device
+
+    Returns:
+        (role -> device id, device id -> budget in bytes)
+    """
+    volumes, budgets = {}, {}
+    for role, path in paths.items():
+        path = os.path.abspath(str(path))
+        while not os.path.exists(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+        try:
+            device = str(os.stat(path).st_dev)
+            free = shutil.disk_usage(path).free
+        except OSError as e:
+            logger.warning(f"Cannot inspect free space for {role} at {path}: {e}")
+            continue
+        volumes[role] = device
+        if device not in budgets:
+            budget = max(0, free - reserve)
+            budgets[device] = budget if max_extra is None else min(budget, max_extra)
+    return volumes, budgets
+
+class SpaceScheduler:
+    def __init__(self, budgets: Dict[str, int], volumes: Optional[Dict[str, str]] = None):
+        # Extra bytes allowed per device (or per role when volumes is None)
+        self.budgets = dict(budgets)
+        # role -> device; roles without an entry are not limited
+        self.volumes = volumes if volumes is not None else {role: role for role in budgets}
+
+    def _per_device(self, fp: Footprint) -> Dict[str, Tuple[int, int]]:
+        totals: Dict[str, Tuple[int, int]] = {}
+        for role, (peak, final) in fp.items():
+            device = self.volumes.get(role)
+            if device is None or device not in self.budgets:
+                continue
+            old_peak, old_final = totals.get(device, (0, 0))
+            totals[device] = (old_peak + peak, old_final + final)
+        return totals
+
+    def schedule(self, operations: List[Dict], footprint_of: Callable[[Dict], Footprint]) -> Dict[str, Any]:
+        """
+        Splits operations into batches that can run at the same time.
+
+        Operations that free space go first, then the rest by how much
+        temporary space they need beyond their final size, largest first, so
+        the big transients run while the disk is emptiest. Each batch is
+        packed first-fit: within a batch, the space used by earlier batches
+        plus every member's peak stays within each device's budget.
+
+        Args:
+            operations: Operations from UpdateManager.get_operations
+            footprint_of: Returns footprint() for an operation
+
+        Returns:
+            dict: {'batches': [[op, ...], ...], 'unschedulable': [op, ...],
+            'peak': {device: bytes}, 'budgets': {device: bytes}}.
+            'unschedulable' operations do not fit even on their own.
+        """
+        needs = []
+        for op in operations:
+            per_device = self._per_device(footprint_of(op))
+            final = sum(f for _, f in per_device.values())
+            transient = sum(p - f for p, f in per_device.values())
+            needs.append((op, per_device, final, transient))
+        needs.sort(key=lambda n: (n[2] >= 0, n[2] if n[2] < 0 else -n[3]))
+
+        used = {device: 0 for device in self.budgets}
+        peak = dict(used)
+        batches, unschedulable = [], []
+        pending = needs
+        while pending:
+            batch, load, rest = [], dict(used), []
+            for need in pending:
+                op, per_device = need[0], need[1]
+                if all(load[d] + p <= self.budgets[d] for d, (p, _) in per_device.items()):
+                    batch.append(op)
+                    for d, (p, _) in per_device.items():
+                        load[d] += p
+                else:
+                    rest.append(need)
+            if not batch:
+                # Nothing fits: the first candidate cannot run even on its own
+                unschedulable.append(rest.pop(0)[0])
+                pending = rest
+                continue
+            batches.append(batch)
+            for d in peak:
+                peak[d] = max(peak[d], load[d])
+            by_op = {id(n[0]): n[1] for n in pending}
+            for op in batch:
+                for d, (_, f) in by_op[id(op)].items():
+                    used[d] += f
+            pending = rest
+        if unschedulable:
+            logger.warning(f"{len(unschedulable)} operation(s) need more disk space than is available")
+        return {'batches': batches, 'unschedulable': unschedulable, 'peak': peak, 'budgets': dict(self.budgets)}
@@ -15,6 +15,14 @@ export interface ProgressData {
   total?: number;
   file?: string;
   message?: string;
+  /** Aggregated download progress: bytes/sec (moving average) */
+  speed?: number;
+  /** Aggregated download progress: seconds remaining, null while unknown */
+  eta?: number | null;
+  percentage?: number;
+  active?: number;
+  files_completed?: number;
+  files_total?: number;
 }
 
 export interface PythonRequest {
@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from download import HttpDownloader, SegmentedDownloader, Aria2Manager
+
+# Per-connection cap, like a CDN edge or mirror that throttles each stream
+PER_CONNECTION_RATE = 4 * 1024 * 1024
+FILE_SIZE = 64 * 1024 * 1024
+
+class ThrottledHandler(BaseHTTPRequestHandler):
+    """Serves one payload with Range support, sending at most PER_CONNECTION_RATE bytes/s per request."""
+    protocol_version = "HTTP/1.1"
+    payload = b""
+
+    def do_GET(self):
+        data = self.payload
+        range_header = self.headers.get("Range")
+        if range_header:
+            start, end = (int(x) for x in range_header.split("=")[1].split("-"))
+            body = memoryview(data)[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{start + len(body) - 1}/{len(data)}")
+        else:
+            body = memoryview(data)
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        chunk = 64 * 1024
+        started = time.monotonic()
+        for offset in range(0, len(body), chunk):
+            self.wfile.write(body[offset:offset + chunk])
+            ahead = (offset + chunk) / PER_CONNECTION_RATE - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def log_message(self, *args):
+        pass
+
+def benchmark():
+    ThrottledHandler.payload = os.urandom(FILE_SIZE)
+    digest = hashlib.md5(ThrottledHandler.payload).hexdigest()
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ThrottledHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{httpd.server_address[1]}/payload.package"
+
+    backends = [
+        ("http (1 conn)", HttpDownloader()),
+        ("segmented x4", SegmentedDownloader(max_connections=4, min_segmented_size=0)),
+        ("segmented x8", SegmentedDownloader(max_connections=8, min_segmented_size=0)),
+        ("segmented x16", SegmentedDownloader(segment_size=4 * 1024 * 1024, max_connections=16, min_segmented_size=0)),
+    ]
+    aria2 = Aria2Manager()
+    if shutil.which(aria2.aria2_exe) or os.path.exists(aria2.aria2_exe):
+        backends.append(("aria2c", aria2))
+
+    total_mb = FILE_SIZE / (1024 * 1024)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, backend in backends:
+                start = time.perf_counter()
+                ok = backend.download(url, tmp, f"{name.split()[0]}.package", checksum=digest)
+                elapsed = time.perf_counter() - start
+                status = "ok" if ok else "FAILED"
+                print(f"{name:<15} {total_mb / elapsed:8.1f} MB/s  ({elapsed:.2f}s for {total_mb:.0f} MB, {status})")
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from engine import VerificationEngine
+from hash_backends import ThreadPoolBackend, ProcessPoolBackend, AdaptiveBackend, TuningStore
+
+# (label, file count, file size) - a game-like mix of many small and few huge files
+TREES = [
+    ("many_small", 400, 256 * 1024),
+    ("few_large", 4, 64 * 1024 * 1024),
+]
+
+def build_tree(root, count, size):
+    paths = []
+    block = os.urandom(1024 * 1024)
+    for i in range(count):
+        p = Path(root) / f"file_{i:04d}.package"
+        with open(p, "wb") as f:
+            remaining = size
+            while remaining > 0:
+                f.write(block[:min(remaining, len(block))])
+                remaining -= len(block)
+        paths.append(str(p))
+    return paths
+
+def run(backend, paths):
+    engine = VerificationEngine(backend=backend)
+    start = time.perf_counter()
+    engine.verify_files(paths)
+    return time.perf_counter() - start
+
+def benchmark():
+    # Note: files are freshly written, so reads are mostly served from the page cache.
+    # Run against a real install (cold cache) for device-level numbers.
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TuningStore(Path(tmp) / "tuning.json")
+        for label, count, size in TREES:
+            tree_dir = Path(tmp) / label
+            tree_dir.mkdir()
+            paths = build_tree(tree_dir, count, size)
+            total_mb = count * size / (1024 * 1024)
+
+            backends = [
+                ("thread", ThreadPoolBackend()),
+                ("process", ProcessPoolBackend()),
+                ("adaptive", AdaptiveBackend(tree_dir, store=store, probe_window=0.1)),
+            ]
+            for name, backend in backends:
+                elapsed = run(backend, paths)
+                print(f"{label:<12} {name:<10} {total_mb / elapsed:10.1f} MB/s  ({elapsed:.2f}s for {total_mb:.0f} MB)")
+
+if __name__ == "__main__":
+    benchmark()
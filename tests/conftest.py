@@ -0,0 +1,48 @@
+import httpx
+from unittest.mock import MagicMock
+import pytest
+from logging_system import setup_logging
+
+@pytest.hookimpl(trylast=True)
+def pytest_configure(config):
+    # Modules set up logging when imported, so point it at the session's
+    # temporary directory before any test module is collected
+    setup_logging(str(config._tmp_path_factory.mktemp("logs")))
+
+@pytest.fixture(autouse=True)
+def _pooled_transports_use_httpx_mock(request, monkeypatch):
+    # pytest-httpx intercepts httpx's own transports; send the pooled clients'
+    # requests through them in tests that mock HTTP
+    if "httpx_mock" not in request.fixturenames:
+        return
+    from http_client import PooledTransport, AsyncPooledTransport
+    request.getfixturevalue("httpx_mock")
+    plain, plain_async = httpx.HTTPTransport(), httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(transport, req):
+        return await plain_async.handle_async_request(req)
+
+    monkeypatch.setattr(PooledTransport, "handle_request", lambda transport, req: plain.handle_request(req))
+    monkeypatch.setattr(AsyncPooledTransport, "handle_async_request", handle_async_request)
+
+@pytest.fixture
+def update_manager():
+    """
+    Builds UpdateManagers for tests: hashing on a thread pool and planning
+    from fixed rates, with no state kept beyond the test. Keyword arguments
+    override those defaults and pass through to UpdateManager.
+    """
+    from update_logic import UpdateManager
+    from planner import CostModel, UpdatePlanner
+    managers = []
+
+    def make(game_dir, manifest_url="http://manifest", downloader=None, **kwargs):
+        kwargs.setdefault("hash_backend", "thread")
+        kwargs.setdefault("planner", UpdatePlanner(CostModel(throughput=10_000_000, patch_rate=100_000_000)))
+        manager = UpdateManager(str(game_dir), manifest_url, downloader or MagicMock(), **kwargs)
+        managers.append(manager)
+        return manager
+
+    yield make
+    for manager in managers:
+        manager.hash_cache.close()
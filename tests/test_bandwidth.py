@@ -0,0 +1,191 @@
+import time
+import json
+import asyncio
+import threading
+import pytest
+from io import StringIO
+from unittest.mock import patch
+from bandwidth import BandwidthScheduler, priority_for, get_scheduler
+from download import DownloadQueue
+
+CHUNK = 16 * 1024
+
+def drain(transfer, total, chunk=CHUNK):
+    for _ in range(total // chunk):
+        transfer.consume(chunk)
+
+def test_unlimited_scheduler_never_waits():
+    scheduler = BandwidthScheduler()
+    with scheduler.open("a") as transfer:
+        start = time.monotonic()
+        drain(transfer, 64 * 1024 * 1024, chunk=1024 * 1024)
+        assert time.monotonic() - start < 0.5
+        assert transfer.bytes == 64 * 1024 * 1024
+    assert scheduler.status()['transfers'] == []
+
+def test_rate_cap_is_enforced():
+    rate = 1_000_000
+    scheduler = BandwidthScheduler(rate)
+    with scheduler.open("a") as transfer:
+        start = time.monotonic()
+        drain(transfer, 768 * 1024)
+        elapsed = time.monotonic() - start
+    # Nothing is banked up front, so 768 KiB needs ~0.79 s at 1 MB/s
+    assert 0.6 <= elapsed < 1.5
+
+def test_higher_priority_class_finishes_first():
+    scheduler = BandwidthScheduler(2_000_000)
+    base = scheduler.open("base.package", "base")
+    language = scheduler.open("strings_fr.package", "language")
+    finished = []
+    language_bytes_when_base_done = []
+
+    def run(transfer):
+        drain(transfer, 512 * 1024)
+        if transfer is base:
+            language_bytes_when_base_done.append(language.bytes)
+        finished.append(transfer.name)
+
+    threads = [threading.Thread(target=run, args=(t,)) for t in (language, base)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert finished == ["base.package", "strings_fr.package"]
+    # The language file only got bytes while the base file had nothing queued
+    assert language_bytes_when_base_done[0] <= 128 * 1024
+
+def test_weighted_fair_share_within_a_class():
+    scheduler = BandwidthScheduler(2_000_000)
+    heavy = scheduler.open("heavy", "pack", weight=3)
+    light = scheduler.open("light", "pack", weight=1)
+    stop = threading.Event()
+
+    def run(transfer):
+        while not stop.is_set():
+            transfer.consume(CHUNK)
+
+    threads = [threading.Thread(target=run, args=(t,)) for t in (heavy, light)]
+    for t in threads:
+        t.start()
+    time.sleep(0.8)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    assert 2.0 <= heavy.bytes / light.bytes <= 4.5
+
+def test_rate_change_applies_to_waiting_transfer():
+    scheduler = BandwidthScheduler(1000)
+    done = threading.Event()
+
+    def run():
+        with scheduler.open("slow") as transfer:
+            drain(transfer, 1024 * 1024)
+        done.set()
+
+    threading.Thread(target=run, daemon=True).start()
+    time.sleep(0.1)
+    assert not done.is_set()
+    scheduler.set_rate(0)
+    assert done.wait(2.0)
+
+def test_async_consume_cancellation_releases_its_place():
+    scheduler = BandwidthScheduler(1000)
+
+    async def main():
+        with scheduler.open("a") as transfer:
+            task = asyncio.ensure_future(transfer.consume_async(1024 * 1024))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(main())
+    assert scheduler._waiting == []
+
+def test_invalid_settings_are_rejected():
+    scheduler = BandwidthScheduler()
+    with pytest.raises(ValueError):
+        scheduler.set_rate(-1)
+    with pytest.raises(ValueError):
+        scheduler.open("a", priority="urgent")
+
+def test_priority_for_manifest_entries():
+    assert priority_for({"name": "core.dll"}) == "base"
+    assert priority_for({"category": "Base", "pack_id": "Base"}) == "base"
+    assert priority_for({"category": "EP", "pack_id": "EP01"}) == "pack"
+    assert priority_for({"category": "Language", "language": "fr_FR"}) == "language"
+
+class RecordingManager:
+    def __init__(self):
+        self.bandwidth = BandwidthScheduler()
+        self.calls = []
+
+    def download(self, url, output_dir, filename=None, callback=None, priority="pack", **kwargs):
+        self.calls.append((filename, priority))
+        return True
+
+def test_queue_starts_higher_priority_tasks_first():
+    manager = RecordingManager()
+    queue = DownloadQueue(manager, max_concurrent=1)
+    queue.add_task("http://a.example/fr", "dist", "fr.package", priority="language")
+    queue.add_task("http://b.example/ep", "dist", "ep01.package", priority="pack")
+    queue.add_task("http://a.example/base", "dist", "base.package", priority="base")
+
+    report = queue.process_all()
+
+    assert manager.calls == [("base.package", "base"), ("ep01.package", "pack"), ("fr.package", "language")]
+    # Results stay in queue order
+    assert [r['filename'] for r in report.results] == ["fr.package", "ep01.package", "base.package"]
+
+def test_aria2_rpc_follows_scheduler_rate():
+    from test_download import FakeAria2Rpc
+    import httpx
+    from download import Aria2RpcManager
+
+    fake = FakeAria2Rpc()
+    options = []
+    dispatch = fake._dispatch
+
+    def with_global_option(method, params):
+        if method == "aria2.changeGlobalOption":
+            options.append(params[1])
+            return "OK"
+        return dispatch(method, params)
+    fake._dispatch = with_global_option
+
+    scheduler = BandwidthScheduler()
+    client = httpx.Client(transport=httpx.MockTransport(fake.handler))
+    manager = Aria2RpcManager(rpc_url="http://127.0.0.1:6800/jsonrpc", secret=fake.secret, client=client,
+                              poll_interval=0, bandwidth=scheduler).start()
+
+    assert manager.download("http://a.example/1", "dist", "one.package") is True
+    assert options == []
+    scheduler.set_rate(500_000)
+    assert manager.download("http://a.example/2", "dist", "two.package") is True
+    assert options == [{"max-overall-download-limit": "500000"}]
+
+def test_sidecar_set_bandwidth_control_command():
+    import sidecar
+    requests = [
+        {"command": "set_bandwidth", "id": "bw1", "limit": 250000},
+        {"command": "set_bandwidth", "id": "bw2", "limit": -5},
+        {"command": "get_bandwidth", "id": "bw3"},
+    ]
+    try:
+        with patch('sys.stdin', StringIO("".join(json.dumps(r) + "\n" for r in requests))):
+            with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+                sidecar.main()
+        responses = {}
+        for line in mock_stdout.getvalue().strip().split("\n"):
+            message = json.loads(line)
+            if "id" in message:
+                responses[message["id"]] = message
+    finally:
+        get_scheduler().set_rate(0)
+
+    assert responses["bw1"]["result"]["rate"] == 250000
+    assert responses["bw2"]["error"]["code"] == "INVALID_ARGUMENT"
+    assert responses["bw3"]["result"]["rate"] == 250000
@@ -0,0 +1,192 @@
+import io
+import os
+import hashlib
+import httpx
+import pytest
+from unittest.mock import MagicMock
+from bundle import BundleError, PatchBundle, entry_matches, open_bundle, write_bundle
+from vcdiff import decode_stream
+from patch import Patcher, INPROCESS_MAX_BYTES
+from download import DownloadQueue
+from manifest import ManifestFetcher, URLResolver
+from test_vcdiff import SOURCE, delta, enc_int, window
+
+class Trickle(io.RawIOBase):
+    """Returns at most one byte per read, like a slow network stream."""
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, n=-1):
+        chunk = self.data[self.pos:self.pos + 1]
+        self.pos += len(chunk)
+        return chunk
+
+def make_delta(target, source=SOURCE):
+    # Copies the shared prefix from the source and adds the rest
+    common = os.path.commonprefix([source, target])
+    ops = ([("copy", len(common), 0, enc_int(0))] if common else []) + [("add", target[len(common):])]
+    return delta(window(target, ops, segment=(len(source), 0)))
+
+def md5(data):
+    return hashlib.md5(data).hexdigest().upper()
+
+def test_decode_stream_reads_the_delta_front_to_back(tmp_path):
+    (tmp_path / "src").write_bytes(SOURCE)
+    target = b"The quick brown fox likes cats"
+    patch = delta(window(target[:20], [("copy", 20, 0, enc_int(0))], segment=(20, 0)),
+                  window(target[20:], [("add", target[20:])]))
+    progress = []
+
+    written = decode_stream(tmp_path / "src", Trickle(patch), tmp_path / "out",
+                            progress=lambda done, total: progress.append(done), total=len(patch))
+
+    assert written == len(target)
+    assert (tmp_path / "out").read_bytes() == target
+    assert progress[-1] == len(patch)
+
+def test_bundle_round_trip_in_archive_order(tmp_path):
+    members = []
+    for name, body in (("a.package", b"A"), ("b.package", b"BB")):
+        path = tmp_path / f"{name}.delta"
+        path.write_bytes(body)
+        members.append(({"file": name, "MD5_to": md5(body)}, str(path)))
+    write_bundle(tmp_path / "bundle.tar", members)
+
+    with open_bundle(str(tmp_path / "bundle.tar")) as bundle:
+        seen = [(entry["file"], entry["size"], stream.read()) for entry, stream in bundle]
+
+    assert seen == [("a.package", 1, b"A"), ("b.package", 2, b"BB")]
+
+def test_bundle_streams_over_http_with_progress(tmp_path):
+    path = tmp_path / "x.delta"
+    path.write_bytes(b"payload")
+    write_bundle(tmp_path / "bundle.tar", [({"file": "x", "hash_to": "ab"}, str(path))])
+    body = (tmp_path / "bundle.tar").read_bytes()
+    client = httpx.Client(transport=httpx.MockTransport(lambda r: httpx.Response(200, content=body)))
+    events = []
+
+    with open_bundle("https://cdn.example/bundle.tar", client=client, callback=events.append) as bundle:
+        assert [stream.read() for _, stream in bundle] == [b"payload"]
+
+    assert events[-1]['total_bytes'] == len(body)
+    assert events[-1]['completed_bytes'] == len(body)
+
+def test_malformed_bundles_are_rejected():
+    with pytest.raises(BundleError):
+        PatchBundle(io.BytesIO(b"not a tar archive" * 64))
+
+def test_entry_matching_checks_file_and_hashes():
+    task = {'file': 'a', 'source_md5': 'old', 'target_md5': 'NEW'}
+    assert entry_matches({'file': 'a', 'MD5_from': 'OLD', 'MD5_to': 'new'}, task)
+    assert not entry_matches({'file': 'a', 'MD5_from': 'OTHER', 'MD5_to': 'NEW'}, task)
+    assert not entry_matches({'file': 'b', 'MD5_to': 'NEW'}, task)
+
+def test_patch_stream_applies_without_a_patch_file(tmp_path):
+    source = tmp_path / "game.package"
+    source.write_bytes(SOURCE)
+    target = b"The quick brown cat"
+
+    success, message = Patcher(decoder="vcdiff").apply_patch_stream(str(source), Trickle(make_delta(target)),
+                                                                    md5(target))
+
+    assert success is True, message
+    assert source.read_bytes() == target
+    assert os.listdir(tmp_path) == ["game.package"]
+
+def test_patch_stream_falls_back_to_xdelta_stdin(tmp_path):
+    script = tmp_path / "fake_xdelta.sh"
+    # -d -c -s <source>: echo the source, then the delta read from stdin
+    script.write_text('#!/bin/sh\ncat "$4" -\n')
+    script.chmod(0o755)
+    source = tmp_path / "f"
+    source.write_bytes(b"old")
+    patch = delta(window(b"hi", [("add", b"hi")], delta_indicator=0x01))
+
+    success, message = Patcher(xdelta_exe=str(script)).apply_patch_stream(
+        str(source), Trickle(patch), md5(b"old" + patch))
+
+    assert success is True, message
+    assert source.read_bytes() == b"old" + patch
+
+def test_patch_stream_for_a_large_target_goes_to_xdelta(tmp_path):
+    calls = tmp_path / "calls"
+    script = tmp_path / "fake_xdelta.sh"
+    # Stands in for xdelta3 -d -c -s <source>: records the call, decodes nothing
+    target = b"The quick brown cat"
+    (tmp_path / "target").write_bytes(target)
+    script.write_text(f'#!/bin/sh\necho "$@" >> "{calls}"\ncat > /dev/null\ncat "{tmp_path / "target"}"\n')
+    script.chmod(0o755)
+    source = tmp_path / "game.package"
+    patcher = Patcher(xdelta_exe=str(script))
+    patch = make_delta(target)
+
+    for target_size in (len(target), INPROCESS_MAX_BYTES + 1):
+        source.write_bytes(SOURCE)
+        success, message = patcher.apply_patch_stream(str(source), Trickle(patch), md5(target), size=len(patch),
+                                                      target_size=target_size)
+        assert success is True, message
+        assert source.read_bytes() == target
+
+    # Only the large target was piped to the executable
+    assert calls.read_text().count("\n") == 1
+
+def test_broken_stream_leaves_source_untouched(tmp_path):
+    source = tmp_path / "f"
+    source.write_bytes(SOURCE)
+
+    class Broken:
+        def read(self, n=-1):
+            raise httpx.ReadError("connection reset")
+
+    with pytest.raises(httpx.ReadError):
+        Patcher(decoder="vcdiff").apply_patch_stream(str(source), Broken(), "ANY")
+    assert source.read_bytes() == SOURCE
+    assert not (tmp_path / "f.tmp").exists()
+
+class DeltaServer:
+    """Downloader serving prepared delta bytes for the per-file patch pipeline."""
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.requested = []
+
+    def download(self, url, output_dir, filename=None, callback=None, **kwargs):
+        self.requested.append(url)
+        with open(os.path.join(output_dir, filename), "wb") as f:
+            f.write(self.deltas[url])
+        return True
+
+def test_update_streams_bundled_deltas_and_fetches_the_rest(tmp_path, update_manager):
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+    targets = {name: SOURCE[:10] + name.encode() for name in ("a.package", "b.package", "c.package")}
+    for name in targets:
+        (game_dir / name).write_bytes(SOURCE)
+    delta_files = []
+    for name in ("a.package", "b.package"):
+        path = tmp_path / f"{name}.delta"
+        path.write_bytes(make_delta(targets[name]))
+        delta_files.append(({"file": name, "MD5_from": md5(SOURCE), "MD5_to": md5(targets[name])}, str(path)))
+    write_bundle(tmp_path / "bundle.tar", delta_files)
+
+    manifest = {"version": "2.0", "patch_bundle": str(tmp_path / "bundle.tar"), "patch": {"files": [
+        {"name": name, "type": "delta", "MD5_from": md5(SOURCE), "MD5_to": md5(target),
+         "url": f"http://cdn/{name}", "patch_url": f"http://cdn/{name}.delta"}
+        for name, target in targets.items()]}}
+    server = DeltaServer({"http://cdn/c.package.delta": make_delta(targets["c.package"])})
+    fetcher = MagicMock(spec=ManifestFetcher)
+    fetcher.fetch_manifest_json.return_value = manifest
+    resolver = MagicMock(spec=URLResolver)
+    resolver.resolve_url.side_effect = lambda url: url
+    manager = update_manager(game_dir, "http://manifest", server, fetcher=fetcher, resolver=resolver)
+    manager.patch_pipeline.download_queue = DownloadQueue(server)
+    manager.patcher = Patcher(decoder="vcdiff")
+
+    ops = manager.get_operations()
+    assert all(op['bundle_url'] == str(tmp_path / "bundle.tar") for op in ops)
+    success, message = manager.apply_operations(ops)
+
+    assert success is True, message
+    assert all((game_dir / name).read_bytes() == target for name, target in targets.items())
+    # Only the delta missing from the bundle was downloaded as a file
+    assert server.requested == ["http://cdn/c.package.delta"]
@@ -0,0 +1,129 @@
+import os
+import time
+import hashlib
+import pytest
+from unittest.mock import MagicMock
+from change_journal import ChangeJournal, PollingWatcher, InotifyWatcher, start_watcher
+from manifest import ManifestFetcher, URLResolver
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "Data").mkdir()
+    paths = []
+    for i in range(5):
+        p = tmp_path / "Data" / f"file_{i}.package"
+        p.write_bytes(f"content {i}".encode())
+        paths.append(str(p))
+    return tmp_path, paths
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+def test_journal_requires_full_scan_until_verified(tree):
+    root, paths = tree
+    journal = ChangeJournal(root, audit_count=0)
+
+    to_hash, reused = journal.plan(paths, "md5")
+    assert to_hash == paths and reused == {}
+
+    journal.mark_verified(journal.snapshot(), {p: "HASH" for p in paths}, "md5")
+    journal.mark_dirty(paths[2])
+
+    to_hash, reused = journal.plan(paths, "md5")
+    assert to_hash == [paths[2]]
+    assert set(reused) == set(paths) - {paths[2]}
+    # A different algorithm invalidates every recorded digest
+    assert journal.plan(paths, "sha256")[0] == paths
+
+def test_journal_keeps_changes_made_during_hashing(tree):
+    root, paths = tree
+    journal = ChangeJournal(root, audit_count=0)
+
+    snapshot = journal.snapshot()
+    journal.mark_dirty(paths[0])
+    journal.mark_verified(snapshot, {p: "HASH" for p in paths}, "md5")
+    assert journal.plan(paths, "md5")[0] == [paths[0]]
+
+    snapshot = journal.snapshot()
+    journal.mark_all_dirty()
+    journal.mark_verified(snapshot, {p: "HASH" for p in paths}, "md5")
+    assert journal.needs_full_scan("md5")
+
+def test_journal_directory_change_taints_children(tree):
+    root, paths = tree
+    journal = ChangeJournal(root, audit_count=0)
+    journal.mark_verified(journal.snapshot(), {p: "HASH" for p in paths}, "md5")
+
+    journal.mark_dirty(str(root / "Data"))
+    assert journal.plan(paths, "md5")[0] == paths
+
+def test_journal_audit_rolls_through_every_file(tree):
+    root, paths = tree
+    journal = ChangeJournal(root, audit_count=2, seed=1)
+    journal.mark_verified(journal.snapshot(), {p: "HASH" for p in paths}, "md5")
+
+    audited = set()
+    for _ in range(3):
+        to_hash, reused = journal.plan(paths, "md5")
+        assert len(to_hash) == 2
+        audited.update(to_hash)
+    assert audited == set(paths)
+
+@pytest.mark.parametrize("kind", ["polling", "inotify"])
+def test_watcher_records_modifications(tree, kind):
+    if kind == "inotify" and not InotifyWatcher.available():
+        pytest.skip("inotify not available")
+    root, paths = tree
+    journal = ChangeJournal(root, audit_count=0)
+    watcher = start_watcher(journal, prefer=kind, poll_interval=0.05)
+    try:
+        journal.mark_verified(journal.snapshot(), {p: "HASH" for p in paths}, "md5")
+        with open(paths[1], "ab") as f:
+            f.write(b" modified")
+        new_dir = root / "Data" / "Sub"
+        new_dir.mkdir()
+        time.sleep(0.1)
+        new_file = new_dir / "late.package"
+        new_file.write_bytes(b"late")
+
+        assert wait_for(lambda: journal.plan(paths, "md5")[0] == [paths[1]])
+        assert wait_for(lambda: str(new_file) in journal._dirty)
+    finally:
+        watcher.stop()
+
+def test_incremental_verify_level_hashes_only_changed_files(tree, update_manager):
+    root, paths = tree
+    fetcher = MagicMock(spec=ManifestFetcher)
+    fetcher.fetch_manifest_json.return_value = {
+        "version": "1.0",
+        "patch": {"files": [
+            {"name": os.path.relpath(p, root), "MD5_to": hashlib.md5(open(p, "rb").read()).hexdigest().upper(),
+             "type": "full", "url": "http://example.com/x"}
+            for p in paths
+        ]}
+    }
+    resolver = MagicMock(spec=URLResolver)
+    journal = ChangeJournal(root, audit_count=1, seed=0)
+
+    manager = update_manager(root, "http://manifest", MagicMock(), fetcher=fetcher, resolver=resolver, journal=journal)
+    # No journal history yet: behaves like a full verification
+    ops = manager.get_operations(verify_level="incremental")
+    assert all(op['type'] == 'nothing' for op in ops)
+
+    with open(paths[3], "ab") as f:
+        f.write(b"!")
+    journal.mark_dirty(paths[3])
+
+    verify_files = manager.engine.verify_files
+    manager.engine.verify_files = MagicMock(side_effect=verify_files)
+    ops = manager.get_operations(verify_level="incremental")
+
+    hashed = manager.engine.verify_files.call_args[0][0]
+    assert paths[3] in hashed
+    assert len(hashed) == 2  # the changed file plus one audited file
+    assert [op['type'] for op in ops].count('download_full') == 1
@@ -0,0 +1,192 @@
+import os
+import time
+import hashlib
+import pytest
+from unittest.mock import MagicMock
+from content_store import ContentStore, clone_file
+from manifest import ManifestFetcher, URLResolver
+
+def md5(data):
+    return hashlib.md5(data).hexdigest().upper()
+
+@pytest.fixture
+def store(tmp_path):
+    s = ContentStore(tmp_path / "store", max_bytes=1000, clone_only=False)
+    yield s
+    s.close()
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+def test_deposit_and_materialize_roundtrip(tmp_path, store):
+    data = b"payload" * 10
+    src = write(tmp_path / "a" / "file.package", data)
+    assert store.deposit(src, md5(data))
+
+    dest = tmp_path / "b" / "Data" / "file.package"
+    method = store.materialize(md5(data), dest)
+    assert method in ("reflink", "copy")
+    assert dest.read_bytes() == data
+
+    # The store keeps its own copy: changing the materialized file does not affect it
+    dest.write_bytes(b"modified")
+    assert store.lookup(md5(data)).read_bytes() == data
+
+def test_materialize_unknown_digest_returns_none(tmp_path, store):
+    assert store.materialize("0" * 32, tmp_path / "x") is None
+    assert not (tmp_path / "x").exists()
+
+def test_corrupt_object_of_the_right_size_is_dropped(tmp_path, store):
+    data = b"payload" * 10
+    store.deposit(write(tmp_path / "src", data), md5(data))
+    # Same size, different contents: bit rot the size check cannot see
+    store.object_path(md5(data)).write_bytes(b"X" * len(data))
+    dest = write(tmp_path / "game" / "file.package", b"old")
+
+    assert store.materialize(md5(data), dest) is None
+    assert dest.read_bytes() == b"old"
+    assert not (tmp_path / "game" / "file.package.store.tmp").exists()
+    assert store.lookup(md5(data)) is None
+    assert not store.object_path(md5(data)).exists()
+
+def test_lru_eviction_keeps_recently_used_objects(tmp_path, store):
+    blobs = [bytes([i]) * 400 for i in range(3)]
+    store.deposit(write(tmp_path / "0", blobs[0]), md5(blobs[0]))
+    time.sleep(0.01)
+    store.deposit(write(tmp_path / "1", blobs[1]), md5(blobs[1]))
+    time.sleep(0.01)
+    # Using the first object makes the second the least recently used
+    store.materialize(md5(blobs[0]), tmp_path / "copy0")
+    time.sleep(0.01)
+    store.deposit(write(tmp_path / "2", blobs[2]), md5(blobs[2]))
+
+    assert store.total_bytes() <= 1000
+    assert store.lookup(md5(blobs[0])) is not None
+    assert store.lookup(md5(blobs[1])) is None
+    assert store.lookup(md5(blobs[2])) is not None
+    assert not store.object_path(md5(blobs[1])).exists()
+
+def test_oversized_files_are_not_stored(tmp_path, store):
+    data = b"x" * 2000
+    assert store.deposit(write(tmp_path / "big", data), md5(data)) is False
+    assert store.total_bytes() == 0
+
+def test_damaged_object_is_dropped(tmp_path, store):
+    data = b"payload" * 10
+    store.deposit(write(tmp_path / "f", data), md5(data))
+    store.object_path(md5(data)).write_bytes(b"trunc")
+    assert store.lookup(md5(data)) is None
+    assert store.total_bytes() == 0
+
+def test_store_is_shared_between_instances(tmp_path):
+    data = b"shared"
+    first = ContentStore(tmp_path / "store", clone_only=False)
+    first.deposit(write(tmp_path / "f", data), md5(data), algorithm="md5")
+    second = ContentStore(tmp_path / "store", clone_only=False)
+    assert second.lookup(md5(data)) is not None
+    first.close()
+    second.close()
+
+def test_clone_only_store_skips_files_it_cannot_reflink(tmp_path, monkeypatch):
+    import content_store
+    monkeypatch.setattr(content_store, "_reflink", lambda src, dst: False)
+    data = b"payload"
+    store = ContentStore(tmp_path / "store")
+    assert store.deposit(write(tmp_path / "f", data), md5(data)) is False
+    assert store.lookup(md5(data)) is None
+    assert not list((tmp_path / "store").rglob("*.tmp"))
+    store.close()
+
+def test_clone_file_copies_content(tmp_path):
+    src = write(tmp_path / "src", os.urandom(64 * 1024))
+    assert clone_file(src, tmp_path / "dst") in ("reflink", "copy")
+    assert (tmp_path / "dst").read_bytes() == src.read_bytes()
+
+class WritingDownloader:
+    def __init__(self, files):
+        self.files = files
+        self.urls = []
+
+    def download(self, url, output_dir, filename=None, callback=None, **kwargs):
+        self.urls.append(url)
+        path = os.path.join(output_dir, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(self.files[url])
+        return True
+
+@pytest.fixture
+def make_manager(update_manager):
+    def make(game_dir, store, downloader, data):
+        fetcher = MagicMock(spec=ManifestFetcher)
+        fetcher.fetch_manifest_json.return_value = {
+            "version": "1.0",
+            "patch": {"files": [
+                {"name": "Data/core.package", "MD5_to": md5(data), "type": "full", "url": "http://cdn/core.package"}
+            ]}
+        }
+        resolver = MagicMock(spec=URLResolver)
+        resolver.resolve_url.side_effect = lambda u: u
+        return update_manager(game_dir, "http://manifest", downloader, fetcher=fetcher, resolver=resolver,
+                              content_store=store)
+    return make
+
+def test_second_install_copies_from_store_instead_of_downloading(tmp_path, make_manager):
+    data = os.urandom(4096)
+    store = ContentStore(tmp_path / "store", clone_only=False)
+    downloader = WritingDownloader({"http://cdn/core.package": data})
+
+    first = make_manager(tmp_path / "install_a", store, downloader, data)
+    (tmp_path / "install_a").mkdir()
+    ops = first.get_operations()
+    assert ops[0]['type'] == 'download_full'
+    assert first.apply_operations(ops)[0] is True
+    assert downloader.urls == ["http://cdn/core.package"]
+
+    (tmp_path / "install_b").mkdir()
+    second = make_manager(tmp_path / "install_b", store, downloader, data)
+    ops = second.get_operations()
+    assert ops[0]['type'] == 'copy_from_store'
+    success, message = second.apply_operations(ops)
+
+    assert success is True, message
+    assert downloader.urls == ["http://cdn/core.package"]
+    assert (tmp_path / "install_b" / "Data" / "core.package").read_bytes() == data
+    store.close()
+
+def test_evicted_store_entry_falls_back_to_download(tmp_path, make_manager):
+    data = os.urandom(4096)
+    store = ContentStore(tmp_path / "store", clone_only=False)
+    store.deposit(write(tmp_path / "seed", data), md5(data))
+    downloader = WritingDownloader({"http://cdn/core.package": data})
+    (tmp_path / "game").mkdir()
+    manager = make_manager(tmp_path / "game", store, downloader, data)
+
+    ops = manager.get_operations()
+    assert ops[0]['type'] == 'copy_from_store'
+    store.evict(max_bytes=0)
+    success, message = manager.apply_operations(ops)
+
+    assert success is True, message
+    assert downloader.urls == ["http://cdn/core.package"]
+    store.close()
+
+def test_corrupt_store_entry_falls_back_to_download(tmp_path, make_manager):
+    data = os.urandom(4096)
+    store = ContentStore(tmp_path / "store", clone_only=False)
+    store.deposit(write(tmp_path / "seed", data), md5(data))
+    store.object_path(md5(data)).write_bytes(os.urandom(4096))
+    downloader = WritingDownloader({"http://cdn/core.package": data})
+    (tmp_path / "game").mkdir()
+    manager = make_manager(tmp_path / "game", store, downloader, data)
+
+    ops = manager.get_operations()
+    assert ops[0]['type'] == 'copy_from_store'
+    success, message = manager.apply_operations(ops)
+
+    assert success is True, message
+    assert downloader.urls == ["http://cdn/core.package"]
+    assert (tmp_path / "game" / "Data" / "core.package").read_bytes() == data
+    store.close()
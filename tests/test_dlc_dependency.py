@@ -62,7 +62,7 @@ class TestDLCDependency(unittest.TestCase):
         mock_fetcher = MagicMock()
         mock_fetcher.fetch_manifest_json.return_value = manifest
         
-        manager = UpdateManager(".", "http://mock", MagicMock(), fetcher=mock_fetcher)
+        manager = UpdateManager(".", "http://mock", MagicMock(), fetcher=mock_fetcher, hash_backend="thread")
         
         # Select only GP01 and English
         ops = manager.get_operations(selected_packs=["GP01"], target_language="en_US")
@@ -1,3 +1,5 @@
+import os
+import pytest
 from download import Aria2Manager, DownloadQueue
 
 # ... existing tests ...
@@ -13,3 +15,516 @@ def test_download_queue_clear():
     queue.add_task("http://example.com/file1.zip", "dist", "file1.zip")
     queue.clear()
     assert len(queue.tasks) == 0
+
+def test_verifies_checksum_asks_only_the_manager():
+    from download import Aria2RpcManager, HttpDownloader, SegmentedDownloader
+
+    class PlainManager:
+        def download(self, url, output_dir, filename=None, callback=None, **kwargs):
+            return True
+
+    assert not DownloadQueue(PlainManager()).verifies_checksum("md5")
+    assert DownloadQueue(Aria2Manager()).verifies_checksum("md5")
+    assert not DownloadQueue(Aria2Manager()).verifies_checksum("blake2b")
+    rpc = Aria2RpcManager(rpc_url="http://127.0.0.1:6800/jsonrpc", secret="s")
+    assert DownloadQueue(rpc).verifies_checksum("sha256")
+    rpc.client.close()
+    for manager in (HttpDownloader(), SegmentedDownloader()):
+        assert DownloadQueue(manager).verifies_checksum("blake2b")
+        # hexdigest() of a shake needs a length, so these are never verified inline
+        assert not DownloadQueue(manager).verifies_checksum("shake_128")
+
+def make_downloader(body, status=200, headers=None):
+    import httpx
+    from download import HttpDownloader
+
+    def handler(request):
+        return httpx.Response(status, content=body, headers=headers)
+    return HttpDownloader(client=httpx.Client(transport=httpx.MockTransport(handler)), chunk_size=1024)
+
+def test_http_downloader_verifies_while_writing(tmp_path):
+    import hashlib
+    body = b"x" * 10000
+    downloader = make_downloader(body)
+    events = []
+
+    ok = downloader.download("http://example.com/file.bin", str(tmp_path), "Data/file.bin", callback=events.append,
+                             checksum=hashlib.sha256(body).hexdigest(), checksum_type="sha256")
+
+    assert ok is True
+    assert (tmp_path / "Data" / "file.bin").read_bytes() == body
+    assert not (tmp_path / "Data" / "file.bin.part").exists()
+    assert events[-1]['percentage'] == 100
+
+def test_http_downloader_discards_mismatch(tmp_path):
+    downloader = make_downloader(b"corrupted")
+
+    assert downloader.download("http://example.com/file.bin", str(tmp_path), "file.bin", checksum="ABCDEF") is False
+    assert list(tmp_path.iterdir()) == []
+
+def test_http_downloader_fails_on_http_error(tmp_path):
+    downloader = make_downloader(b"", status=404)
+
+    assert downloader.download("http://example.com/file.bin", str(tmp_path), "file.bin") is False
+    assert not (tmp_path / "file.bin").exists()
+
+class RecordingManager:
+    """Fake downloader tracking how many downloads run at once, overall and per host."""
+    def __init__(self, delay=0.05, fail=()):
+        import threading
+        self.delay = delay
+        self.fail = set(fail)
+        self.lock = threading.Lock()
+        self.active = {}
+        self.peak_total = 0
+        self.peak_host = {}
+        self.order = []
+
+    def download(self, url, output_dir, filename=None, callback=None, **kwargs):
+        import time
+        host = url.split("/")[2]
+        with self.lock:
+            self.order.append(url)
+            self.active[host] = self.active.get(host, 0) + 1
+            self.peak_total = max(self.peak_total, sum(self.active.values()))
+            self.peak_host[host] = max(self.peak_host.get(host, 0), self.active[host])
+        time.sleep(self.delay)
+        if callback:
+            callback({'percentage': 100, 'speed': '1MiB', 'eta': '0s'})
+        with self.lock:
+            self.active[host] -= 1
+        if url in self.fail:
+            raise RuntimeError("connection reset")
+        return True
+
+def test_process_all_respects_global_and_per_host_limits():
+    manager = RecordingManager()
+    queue = DownloadQueue(manager, max_concurrent=4, per_host=2)
+    for i in range(6):
+        queue.add_task(f"http://a.example/{i}", "dist", f"a{i}")
+    for i in range(6):
+        queue.add_task(f"http://b.example/{i}", "dist", f"b{i}")
+    queue.add_task("http://c.example/0", "dist", "c0")
+    events = []
+
+    report = queue.process_all(callback=events.append)
+
+    assert report
+    assert len(report.results) == 13
+    assert manager.peak_total <= 4
+    assert max(manager.peak_host.values()) <= 2
+    # Round-robin: the lone file on host c is not stuck behind all of a and b
+    assert manager.order.index("http://c.example/0") < 6
+    assert {e['file'] for e in events} == {t['filename'] for t in queue.tasks}
+
+def test_process_all_reports_failures_per_task():
+    manager = RecordingManager(delay=0, fail={"http://a.example/1"})
+    queue = DownloadQueue(manager)
+    for i in range(3):
+        queue.add_task(f"http://a.example/{i}", "dist", f"a{i}")
+
+    report = queue.process_all()
+
+    assert not report
+    assert [r['filename'] for r in report.failed] == ["a1"]
+    assert report.failed[0]['error'] == "connection reset"
+    assert len(report.succeeded) == 2
+
+class FakeAria2Rpc:
+    """
+    In-memory aria2 JSON-RPC endpoint: each download completes after two status
+    polls, with at most max_active running and the rest waiting.
+    """
+    def __init__(self, secret="s3cret", fail_urls=(), max_active=None):
+        self.secret = secret
+        self.fail_urls = set(fail_urls)
+        self.max_active = max_active
+        self.queued = []
+        self.downloads = {}
+        self.calls = []
+
+    def _queue(self):
+        return [g for g, d in self.downloads.items() if not d.get("removed") and d["polls"] < 2]
+
+    def _waiting(self, gid):
+        # Slots free up between round trips, not halfway through one
+        return self.max_active is not None and gid in self.queued[self.max_active:]
+
+    def _dispatch(self, method, params):
+        assert params[0] == f"token:{self.secret}"
+        params = params[1:]
+        if method == "aria2.getVersion":
+            return {"version": "1.37.0"}
+        if method == "aria2.addUri":
+            gid = f"{len(self.downloads) + 1:016x}"
+            self.downloads[gid] = {"url": params[0][0], "options": params[1], "polls": 0}
+            return gid
+        if method == "aria2.tellStatus":
+            d = self.downloads[params[0]]
+            status = {"gid": params[0], "totalLength": "100", "downloadSpeed": "50"}
+            if d.get("removed"):
+                return {**status, "status": "removed"}
+            if self._waiting(params[0]):
+                return {**status, "status": "waiting", "completedLength": "0"}
+            d["polls"] += 1
+            if d["url"] in self.fail_urls:
+                return {**status, "status": "error", "errorCode": "1", "errorMessage": "Checksum validation failed"}
+            done = d["polls"] >= 2
+            return {**status, "status": "complete" if done else "active", "completedLength": "100" if done else "50"}
+        if method == "aria2.removeDownloadResult":
+            return "OK"
+        if method == "aria2.remove":
+            self.downloads[params[0]]["removed"] = True
+            return params[0]
+        raise AssertionError(method)
+
+    def handler(self, request):
+        import json
+        import httpx
+        body = json.loads(request.content)
+        self.calls.append(body["method"])
+        if body["method"] == "system.multicall":
+            self.queued = self._queue()
+            result = [[self._dispatch(c["methodName"], c["params"])] for c in body["params"][0]]
+        else:
+            result = self._dispatch(body["method"], body["params"])
+        return httpx.Response(200, json={"jsonrpc": "2.0", "id": body["id"], "result": result})
+
+def make_rpc_manager(fake):
+    import httpx
+    from download import Aria2RpcManager
+    client = httpx.Client(transport=httpx.MockTransport(fake.handler))
+    return Aria2RpcManager(rpc_url="http://127.0.0.1:6800/jsonrpc", secret=fake.secret, client=client,
+                           poll_interval=0).start()
+
+def test_aria2_rpc_submits_queue_in_one_multicall():
+    fake = FakeAria2Rpc(fail_urls={"http://a.example/bad"})
+    queue = DownloadQueue(make_rpc_manager(fake))
+    queue.add_task("http://a.example/1", "dist", "one.package", checksum="ABC", checksum_type="sha256")
+    queue.add_task("http://a.example/bad", "dist", "bad.package")
+    events = []
+
+    report = queue.process_all(callback=events.append)
+
+    assert [r['success'] for r in report.results] == [True, False]
+    assert report.failed[0]['error'] == "Checksum validation failed"
+    # Both downloads were added with a single round trip
+    assert fake.calls.count("system.multicall") >= 2
+    assert "aria2.addUri" not in fake.calls
+    options = fake.downloads["0000000000000001"]["options"]
+    assert options == {"dir": "dist", "out": "one.package", "checksum": "sha-256=abc"}
+    assert any(e['file'] == "one.package" and e['percentage'] == 100 for e in events)
+
+def test_aria2_rpc_batch_reports_each_completion():
+    fake = FakeAria2Rpc(fail_urls={"http://a.example/bad"})
+    queue = DownloadQueue(make_rpc_manager(fake))
+    queue.add_task("http://a.example/fr", "dist", "fr.package", priority="language")
+    queue.add_task("http://a.example/bad", "dist", "bad.package")
+    queue.add_task("http://a.example/base", "dist", "base.package", priority="base")
+    completed = []
+
+    queue.process_all(on_complete=lambda i, result: completed.append((i, result['success'])))
+
+    # Indices refer to queue order even though the batch was submitted by priority
+    assert sorted(completed) == [(0, True), (1, False), (2, True)]
+    assert [d["options"]["out"] for d in fake.downloads.values()] == ["base.package", "bad.package", "fr.package"]
+
+def test_aria2_rpc_batch_withdraws_waiting_downloads_once_cancelled():
+    import threading
+    fake = FakeAria2Rpc(max_active=1)
+    queue = DownloadQueue(make_rpc_manager(fake))
+    for n in range(3):
+        queue.add_task(f"http://a.example/{n}", "dist", f"{n}.package")
+    cancel = threading.Event()
+
+    report = queue.process_all(on_complete=lambda i, result: cancel.set(), cancel=cancel)
+
+    # The daemon started the second download as the first finished; only the
+    # third was still waiting when cancel was set
+    assert [r['success'] for r in report.results] == [True, True, False]
+    assert report.results[2]['cancelled'] is True
+    assert [d["polls"] for d in fake.downloads.values()] == [2, 2, 0]
+
+def test_queue_skips_tasks_not_started_once_cancelled():
+    import threading
+    started = []
+    cancel = threading.Event()
+
+    class FailingManager:
+        def download(self, url, output_dir, filename=None, callback=None, **kwargs):
+            started.append(url)
+            cancel.set()
+            return False
+
+    queue = DownloadQueue(FailingManager(), max_concurrent=1)
+    for n in range(4):
+        queue.add_task(f"http://a.example/{n}", "dist", f"{n}.package")
+
+    report = queue.process_all(cancel=cancel)
+
+    assert started == ["http://a.example/0"]
+    assert [r.get('cancelled', False) for r in report.results] == [False, True, True, True]
+
+def test_aria2_rpc_single_download_interface():
+    fake = FakeAria2Rpc()
+    manager = make_rpc_manager(fake)
+    events = []
+
+    assert manager.download("http://a.example/1", "dist", "one.package", callback=events.append) is True
+    assert events and 'file' not in events[0]
+
+def test_create_aria2_manager_falls_back_to_subprocess(monkeypatch):
+    from download import create_aria2_manager, Aria2RpcManager
+
+    def broken_start(self, timeout=10.0):
+        raise OSError("aria2c not found")
+    monkeypatch.setattr(Aria2RpcManager, "start", broken_start)
+
+    assert isinstance(create_aria2_manager(), Aria2Manager)
+
+@pytest.fixture
+def range_server():
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        files = {}
+        support_ranges = True
+        range_requests = 0
+
+        def do_GET(self):
+            data = self.files.get(self.path)
+            if data is None:
+                self.send_error(404)
+                return
+            range_header = self.headers.get("Range")
+            if range_header and self.support_ranges:
+                type(self).range_requests += 1
+                start, end = (int(x) for x in range_header.split("=")[1].split("-"))
+                body = data[start:end + 1]
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{start + len(body) - 1}/{len(data)}")
+            else:
+                body = data
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", Handler
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_segmented_downloader_fetches_ranges_and_verifies(tmp_path, range_server):
+    import hashlib
+    from download import SegmentedDownloader
+    base, handler = range_server
+    data = os.urandom(1024 * 1024 + 123)
+    handler.files["/big.package"] = data
+
+    downloader = SegmentedDownloader(segment_size=64 * 1024, max_connections=4, min_segmented_size=0, window=3)
+    events = []
+    ok = downloader.download(f"{base}/big.package", str(tmp_path), "Data/big.package", callback=events.append,
+                             checksum=hashlib.sha256(data).hexdigest(), checksum_type="sha256")
+
+    assert ok is True
+    assert (tmp_path / "Data" / "big.package").read_bytes() == data
+    # One probe plus one request per segment
+    assert handler.range_requests == 1 + 17
+    assert events[-1]['percentage'] == 100
+
+def test_segmented_downloader_without_range_support(tmp_path, range_server):
+    import hashlib
+    from download import SegmentedDownloader
+    base, handler = range_server
+    handler.support_ranges = False
+    data = os.urandom(200 * 1024)
+    handler.files["/small.package"] = data
+
+    downloader = SegmentedDownloader(segment_size=64 * 1024, min_segmented_size=0)
+    assert downloader.download(f"{base}/small.package", str(tmp_path), "small.package",
+                               checksum=hashlib.md5(data).hexdigest()) is True
+    assert (tmp_path / "small.package").read_bytes() == data
+
+    assert downloader.download(f"{base}/small.package", str(tmp_path), "again.package", checksum="BAD") is False
+    assert not (tmp_path / "again.package").exists()
+    assert not (tmp_path / "again.package.part").exists()
+
+def test_http_downloader_resumes_after_connection_drop(tmp_path):
+    import hashlib
+    import httpx
+    from download import HttpDownloader
+    from janitor import OperationLogger
+
+    data = os.urandom(64 * 1024)
+    requests = []
+
+    def handler(request):
+        requests.append(request.headers.get("Range"))
+        if len(requests) == 1:
+            def interrupted():
+                yield data[:40 * 1024]
+                raise httpx.ReadError("connection reset")
+            return httpx.Response(200, headers={"Content-Length": str(len(data)), "ETag": '"v1"'},
+                                  content=interrupted())
+        assert request.headers["If-Range"] == '"v1"'
+        start = int(request.headers["Range"].split("=")[1].rstrip("-"))
+        return httpx.Response(206, content=data[start:], headers={
+            "Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}", "Content-Length": str(len(data) - start)
+        })
+
+    store = OperationLogger(tmp_path / "ops.json")
+    downloader = HttpDownloader(client=httpx.Client(transport=httpx.MockTransport(handler)), chunk_size=8 * 1024,
+                                progress_interval=0, resume_store=store)
+    target = str(tmp_path / "file.bin")
+    digest = hashlib.md5(data).hexdigest()
+
+    assert downloader.download("http://example.com/file.bin", str(tmp_path), "file.bin", checksum=digest) is False
+    assert (tmp_path / "file.bin.part").exists()
+    saved = store.get_resume_state(target)["bytes_written"]
+    assert 0 < saved <= 40 * 1024
+
+    assert downloader.download("http://example.com/file.bin", str(tmp_path), "file.bin", checksum=digest) is True
+    assert requests[1] == f"bytes={saved}-"
+    assert (tmp_path / "file.bin").read_bytes() == data
+    assert store.get_resume_state(target) is None
+
+def test_http_downloader_resumes_when_part_is_longer_than_checkpoint(tmp_path):
+    import hashlib
+    import httpx
+    from download import HttpDownloader
+    from janitor import OperationLogger
+
+    # A crash left 2 MiB on disk but only the first 1 MiB was checkpointed
+    data = os.urandom(3 * 1024 * 1024)
+    checkpoint = 1024 * 1024
+    (tmp_path / "file.bin.part").write_bytes(data[:checkpoint] + os.urandom(checkpoint))
+    target = str(tmp_path / "file.bin")
+    digest = hashlib.md5(data).hexdigest()
+    store = OperationLogger(tmp_path / "ops.json")
+    store.save_resume_state(target, {'url': "http://example.com/file.bin", 'checksum': digest,
+                                     'bytes_written': checkpoint, 'validator': None})
+
+    def handler(request):
+        start = int(request.headers["Range"].split("=")[1].rstrip("-"))
+        return httpx.Response(206, content=data[start:], headers={
+            "Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}", "Content-Length": str(len(data) - start)
+        })
+
+    downloader = HttpDownloader(client=httpx.Client(transport=httpx.MockTransport(handler)), chunk_size=64 * 1024,
+                                progress_interval=0, resume_store=store)
+    assert downloader.download("http://example.com/file.bin", str(tmp_path), "file.bin", checksum=digest) is True
+    assert (tmp_path / "file.bin").read_bytes() == data
+
+def test_segmented_downloader_resumes_from_saved_segments(tmp_path, range_server):
+    import hashlib
+    from download import SegmentedDownloader
+    from janitor import OperationLogger
+    base, handler = range_server
+    segment = 64 * 1024
+    data = os.urandom(segment * 8)
+    handler.files["/big.package"] = data
+    url = f"{base}/big.package"
+    target = str(tmp_path / "big.package")
+
+    # An earlier attempt finished segments 0-3; segment 2 was damaged on disk since
+    partial = bytearray(data[:segment * 4]) + bytearray(segment * 4)
+    partial[segment * 2] ^= 0xFF
+    (tmp_path / "big.package.part").write_bytes(bytes(partial))
+    store = OperationLogger(tmp_path / "ops.json")
+    checksum = hashlib.md5(data).hexdigest()
+    store.save_resume_state(target, {
+        'url': url, 'checksum': checksum, 'size': len(data), 'segment_size': segment,
+        'segments': {str(i): hashlib.md5(data[i * segment:(i + 1) * segment]).hexdigest() for i in range(4)}
+    })
+
+    downloader = SegmentedDownloader(segment_size=segment, min_segmented_size=0, resume_store=store)
+    assert downloader.download(url, str(tmp_path), "big.package", checksum=checksum) is True
+
+    assert (tmp_path / "big.package").read_bytes() == data
+    # Probe, the damaged segment and the four never downloaded
+    assert handler.range_requests == 1 + 1 + 4
+    assert store.get_resume_state(target) is None
+
+def test_aria2_continue_only_with_control_file(tmp_path, monkeypatch):
+    import subprocess
+    captured = []
+
+    class FakeProcess:
+        stdout = []
+        returncode = 0
+        def wait(self):
+            return 0
+
+    monkeypatch.setattr(subprocess, "Popen", lambda args, **kw: captured.append(args) or FakeProcess())
+    manager = Aria2Manager(aria2_exe="aria2c")
+
+    manager.download("http://example.com/a.package", str(tmp_path), "a.package")
+    (tmp_path / "a.package.aria2").write_bytes(b"")
+    manager.download("http://example.com/a.package", str(tmp_path), "a.package")
+
+    assert "--continue=true" not in captured[0]
+    assert "--continue=true" in captured[1]
+
+def test_striped_downloader_spreads_segments_across_mirrors(tmp_path):
+    import time
+    import hashlib
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from download import StripedDownloader
+
+    data = os.urandom(64 * 1024 * 24)
+    served = {}
+
+    def make_server(name, delay=0.0, broken=False):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if broken:
+                    self.send_error(503)
+                    return
+                start, end = (int(x) for x in self.headers["Range"].split("=")[1].split("-"))
+                body = data[start:end + 1]
+                time.sleep(delay)
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{start + len(body) - 1}/{len(data)}")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                served[name] = served.get(name, 0) + len(body)
+
+            def log_message(self, *args):
+                pass
+
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return httpd, f"http://127.0.0.1:{httpd.server_address[1]}/mirror"
+
+    servers = [make_server("fast"), make_server("slow", delay=0.2), make_server("broken", broken=True)]
+    try:
+        mirrors = [{"url": url, "available": True} for _, url in servers]
+        downloader = StripedDownloader(mirrors, max_connections=6, segment_size=64 * 1024, min_segmented_size=0,
+                                       max_errors=1)
+        assert downloader.mirror_urls(f"{servers[1][1]}/Data/x.package")[0][1] == f"{servers[1][1]}/Data/x.package"
+
+        ok = downloader.download(f"{servers[0][1]}/Data/big.package", str(tmp_path), "big.package",
+                                 checksum=hashlib.md5(data).hexdigest())
+
+        assert ok is True
+        assert (tmp_path / "big.package").read_bytes() == data
+        # Both healthy mirrors contributed, the fast one more than the slow one
+        assert served.get("slow", 0) > 0
+        assert served["fast"] > served["slow"]
+        assert "broken" not in served
+    finally:
+        for httpd, _ in servers:
+            httpd.shutdown()
+            httpd.server_close()
@@ -72,6 +72,7 @@ def test_full_update_workflow_success(tmp_path, mock_fetcher_resolver):
     # Setup mocks for Aria2Manager and Patcher
     mock_aria2_manager_client = MagicMock(spec=Aria2Manager)
     mock_aria2_manager_client.download.return_value = True # Simulate successful download
+    mock_aria2_manager_client.checksum_types = Aria2Manager.checksum_types # Verified by aria2c itself
 
     # Mock the DownloadQueue behavior directly on manager.queue
     class MockDownloadQueue(DownloadQueue):
@@ -103,7 +104,8 @@ def test_full_update_workflow_success(tmp_path, mock_fetcher_resolver):
     # We'll simulate the sidecar call by creating a manager and calling its methods
     # directly for testing purposes.
     # The actual sidecar receives manifest_url, not manifest_json
-    manager = MockedUpdateManager(str(game_dir), "http://mock.com/manifest.json", mock_aria2_manager_client)
+    manager = MockedUpdateManager(str(game_dir), "http://mock.com/manifest.json", mock_aria2_manager_client,
+                                  hash_backend="thread")
     
     progress_updates = []
     def on_progress(p):
@@ -32,3 +32,111 @@ def test_multithreaded_hashing(tmp_path):
     for i in range(num_files):
         expected = hashlib.md5(f"content {i}".encode()).hexdigest().upper()
         assert results_dict[file_paths[i]] == expected
+
+def test_parallel_hashing_with_progress(tmp_path):
+    file_paths = []
+    for i in range(8):
+        p = tmp_path / f"file_{i}.bin"
+        p.write_bytes(os.urandom(1024 * (i + 1)))
+        file_paths.append(str(p))
+
+    events = []
+    engine = VerificationEngine(max_workers=4)
+    results = engine.verify_files(file_paths, progress_callback=events.append)
+
+    assert list(results) == file_paths
+    for path in file_paths:
+        with open(path, 'rb') as f:
+            assert results[path] == hashlib.md5(f.read()).hexdigest().upper()
+
+    file_events = [e for e in events if 'file' in e]
+    assert len(file_events) == len(file_paths)
+    assert [e['current'] for e in file_events] == list(range(1, len(file_paths) + 1))
+    assert file_events[-1]['bytes_done'] == file_events[-1]['bytes_total'] == sum(1024 * (i + 1) for i in range(8))
+    assert all(e['status'] == 'hashing' for e in events)
+
+def test_verify_blocks_reports_corrupt_ranges(tmp_path):
+    block_size = 4096
+    original = os.urandom(block_size * 5 + 100)
+    p = tmp_path / "big.package"
+    p.write_bytes(original)
+
+    engine = VerificationEngine(max_workers=4)
+    hashes = engine.compute_block_hashes(str(p), block_size)
+    assert len(hashes) == 6
+    assert engine.verify_blocks(str(p), block_size, hashes)['valid'] is True
+
+    corrupted = bytearray(original)
+    corrupted[block_size + 10] ^= 0xFF
+    corrupted[block_size * 2 + 5] ^= 0xFF
+    corrupted[-1] ^= 0xFF
+    p.write_bytes(bytes(corrupted))
+
+    report = engine.verify_blocks(str(p), block_size, hashes)
+    assert report['valid'] is False
+    assert report['bad_ranges'] == [[block_size, block_size * 3], [block_size * 5, block_size * 5 + 100]]
+    assert report['blocks_checked'] == 6
+
+def test_verify_blocks_stop_at_first_and_truncated_file(tmp_path):
+    block_size = 1024
+    p = tmp_path / "file.bin"
+    p.write_bytes(os.urandom(block_size * 4))
+    engine = VerificationEngine(max_workers=1)
+    hashes = engine.compute_block_hashes(str(p), block_size)
+
+    p.write_bytes(p.read_bytes()[:block_size * 2])
+    report = engine.verify_blocks(str(p), block_size, hashes)
+    assert report['bad_ranges'] == [[block_size * 2, block_size * 4]]
+
+    report = engine.verify_blocks(str(p), block_size, ["0" * 32] * 4, stop_at_first=True)
+    assert report['valid'] is False
+    # Blocks already in flight may still be reported, but the scan starts at the first
+    assert report['bad_ranges'][0][0] == 0
+
+def test_quick_verify_tiers(tmp_path):
+    block_size = 1024
+    content = os.urandom(block_size * 20)
+    p = tmp_path / "file.package"
+    p.write_bytes(content)
+    engine = VerificationEngine(max_workers=2)
+    block_map = {'block_size': block_size, 'hashes': engine.compute_block_hashes(str(p), block_size)}
+
+    assert engine.quick_verify(str(p), len(content) + 1)['suspicious'] is True
+    assert engine.quick_verify(str(p), len(content)) == {'confidence': 'size', 'suspicious': False, 'hash': None}
+    assert engine.quick_verify(str(p), len(content), block_map, seed="X")['confidence'] == 'sampled'
+    assert engine.quick_verify(str(p))['suspicious'] is True
+
+    # Corrupt the first block, which is always part of the sample
+    corrupted = bytearray(content)
+    corrupted[0] ^= 0xFF
+    p.write_bytes(bytes(corrupted))
+    assert engine.quick_verify(str(p), len(content), block_map, seed="X")['suspicious'] is True
+
+def test_quick_verify_default_sample_is_stable_per_file_and_version(tmp_path):
+    block_size = 1024
+    p = tmp_path / "file.package"
+    p.write_bytes(os.urandom(block_size * 50))
+    engine = VerificationEngine(max_workers=2)
+    block_map = {'block_size': block_size, 'hashes': engine.compute_block_hashes(str(p), block_size)}
+    sampled = []
+    engine._hash_block = lambda path, offset, size, algorithm: (
+        sampled.append(offset // block_size) or block_map['hashes'][offset // block_size].upper())
+
+    def sample(expected_hash):
+        sampled.clear()
+        assert engine.quick_verify(str(p), None, block_map, expected_hash=expected_hash)['suspicious'] is False
+        return list(sampled)
+
+    first = sample("ABC")
+    assert all(sample("ABC") == first for _ in range(5))
+    assert any(sample(f"V{i}") != first for i in range(5))
+
+def test_quick_verify_checks_empty_files_by_size(tmp_path):
+    p = tmp_path / "empty.package"
+    p.write_bytes(b"")
+    engine = VerificationEngine(max_workers=2)
+    empty_map = {'block_size': 1024, 'hashes': []}
+
+    assert engine.quick_verify(str(p), 0, empty_map) == {'confidence': 'size', 'suspicious': False, 'hash': None}
+    p.write_bytes(b"x")
+    assert engine.quick_verify(str(p), None, empty_map)['suspicious'] is True
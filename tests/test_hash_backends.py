@@ -0,0 +1,109 @@
+import os
+import hashlib
+import pytest
+from engine import VerificationEngine
+from hash_backends import (
+    ThreadPoolBackend, ProcessPoolBackend, AdaptiveBackend, TuningStore, make_backend,
+    digest_file_multi, validate_algorithm
+)
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i in range(6):
+        p = tmp_path / f"file_{i}.bin"
+        p.write_bytes(os.urandom(64 * 1024 * (i + 1)))
+        paths.append(str(p))
+    return paths
+
+def expected_hashes(paths):
+    result = {}
+    for p in paths:
+        with open(p, 'rb') as f:
+            result[p] = hashlib.md5(f.read()).hexdigest().upper()
+    return result
+
+@pytest.mark.parametrize("backend_factory", [
+    lambda tmp: ThreadPoolBackend(max_workers=2, chunk_size=4096),
+    lambda tmp: ProcessPoolBackend(max_workers=2),
+    lambda tmp: AdaptiveBackend(tmp, store=TuningStore(tmp / "tuning.json")),
+])
+def test_backends_produce_correct_hashes(tmp_path, files, backend_factory):
+    engine = VerificationEngine(backend=backend_factory(tmp_path))
+    events = []
+    assert engine.verify_files(files) == expected_hashes(files)
+    assert engine.verify_files(files, progress_callback=events.append) == expected_hashes(files)
+    assert len([e for e in events if 'file' in e]) == len(files)
+
+def test_adaptive_backend_persists_tuning_per_device(tmp_path, files):
+    store = TuningStore(tmp_path / "tuning.json")
+    backend = AdaptiveBackend(tmp_path, max_workers=4, store=store, probe_window=0.0)
+    engine = VerificationEngine(backend=backend)
+
+    # Re-hash until every candidate has had a measurement window
+    for _ in range(20):
+        engine.verify_files(files)
+        if backend.tuned:
+            break
+
+    assert backend.tuned
+    saved = store.load(TuningStore.device_id(tmp_path))
+    assert saved["workers"] == backend.workers
+    assert saved["chunk_size"] == backend.chunk_size
+
+    reloaded = AdaptiveBackend(tmp_path, max_workers=4, store=store)
+    assert reloaded.tuned
+    assert (reloaded.workers, reloaded.chunk_size) == (backend.workers, backend.chunk_size)
+
+def test_update_manager_keeps_adaptive_tuning_in_the_given_store(tmp_path, update_manager):
+    from unittest.mock import MagicMock
+    store = TuningStore(tmp_path / "tuning.json")
+
+    manager = update_manager(tmp_path, fetcher=MagicMock(), resolver=MagicMock(), hash_backend="adaptive",
+                             tuning_store=store)
+
+    assert isinstance(manager.engine.backend, AdaptiveBackend)
+    assert manager.engine.backend.store is store
+    assert make_backend("adaptive", tmp_path, store=store).store is store
+
+def test_make_backend_rejects_unknown_name(tmp_path):
+    assert isinstance(make_backend("thread"), ThreadPoolBackend)
+    with pytest.raises(ValueError):
+        make_backend("gpu")
+    with pytest.raises(ValueError):
+        make_backend("adaptive")
+
+def test_multi_digest_reads_file_once(tmp_path):
+    p = tmp_path / "file.bin"
+    data = os.urandom(300 * 1024)
+    p.write_bytes(data)
+    reads = []
+
+    digests = digest_file_multi(str(p), ("sha256", "md5", "blake2b"), chunk_size=64 * 1024, on_bytes=reads.append)
+
+    assert sum(reads) == len(data)
+    assert digests == {
+        "sha256": hashlib.sha256(data).hexdigest().upper(),
+        "md5": hashlib.md5(data).hexdigest().upper(),
+        "blake2b": hashlib.blake2b(data).hexdigest().upper(),
+    }
+
+def test_engine_caches_extra_algorithms_from_one_pass(tmp_path, files):
+    from hash_cache import HashCache
+    cache = HashCache(tmp_path / "cache.db")
+    engine = VerificationEngine(cache=cache, backend=ThreadPoolBackend(max_workers=2),
+                                algorithm="sha256", extra_algorithms=("md5",))
+
+    result = engine.verify_files(files)
+
+    for p in files:
+        with open(p, 'rb') as f:
+            data = f.read()
+        assert result[p] == hashlib.sha256(data).hexdigest().upper()
+        assert cache.lookup(p, "md5") == hashlib.md5(data).hexdigest().upper()
+    cache.close()
+
+def test_validate_algorithm():
+    assert validate_algorithm("SHA-256") == "sha256"
+    with pytest.raises(ValueError):
+        validate_algorithm("crc32")
@@ -0,0 +1,58 @@
+import os
+import hashlib
+import pytest
+from hash_cache import HashCache
+from engine import VerificationEngine
+
+@pytest.fixture
+def cache(tmp_path):
+    c = HashCache(tmp_path / "cache.db")
+    yield c
+    c.close()
+
+def test_lookup_hits_unchanged_file(tmp_path, cache):
+    p = tmp_path / "file.bin"
+    p.write_bytes(b"content")
+    assert cache.lookup(p) is None
+
+    assert cache.record(p, "abc123") is True
+    assert cache.lookup(p) == "ABC123"
+
+def test_lookup_misses_after_modification(tmp_path, cache):
+    p = tmp_path / "file.bin"
+    p.write_bytes(b"content")
+    cache.record(p, "ABC123")
+
+    p.write_bytes(b"different content")
+    assert cache.lookup(p) is None
+
+def test_record_rejects_stale_stat_key(tmp_path, cache):
+    p = tmp_path / "file.bin"
+    p.write_bytes(b"content")
+    key = cache.stat_key(p)
+    p.write_bytes(b"changed while hashing")
+
+    assert cache.record(p, "ABC123", stat_key=key) is False
+    assert cache.lookup(p) is None
+
+def test_cache_shared_between_instances(tmp_path, cache):
+    p = tmp_path / "file.bin"
+    p.write_bytes(b"content")
+    cache.record(p, "ABC123")
+
+    other = HashCache(tmp_path / "cache.db")
+    assert other.lookup(p) == "ABC123"
+    other.close()
+
+def test_engine_skips_hashing_cached_files(tmp_path, cache, monkeypatch):
+    p = tmp_path / "file.bin"
+    p.write_bytes(b"content")
+    expected = hashlib.md5(b"content").hexdigest().upper()
+    engine = VerificationEngine(max_workers=2, cache=cache)
+
+    assert engine.verify_files([str(p)]) == {str(p): expected}
+
+    calls = []
+    monkeypatch.setattr(VerificationEngine, "_digest_file", staticmethod(lambda path: calls.append(path)))
+    assert engine.hash_file(str(p)) == expected
+    assert calls == []
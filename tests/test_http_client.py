@@ -0,0 +1,230 @@
+import asyncio
+import threading
+import time
+import pytest
+import httpx
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http_client import (DnsCache, create_client, create_async_client, get_client, close_clients,
+                         pool_metrics, client_status)
+from manifest import ManifestFetcher, VersionScanner, URLResolver, MirrorOptimizer
+from discovery import MirrorDiscovery
+from doctor import BackendDoctor
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def _reply(self, body=b""):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        time.sleep(cls.delay)
+        with cls.lock:
+            cls.active -= 1
+        if self.path == "/manifest.json":
+            body = b'{"version": "1.0"}'
+        elif self.path == "/index.html":
+            body = b'<a href="1.118.242.1020/">1.118.242.1020</a>'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply()
+
+    def do_HEAD(self):
+        self._reply()
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    Handler.delay, Handler.active, Handler.peak = 0.0, 0, 0
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_modules_share_one_keep_alive_connection(server):
+    client = create_client(dns=DnsCache())
+    ManifestFetcher(f"{server}/manifest.json", client=client).fetch_manifest_json()
+    assert VersionScanner(client=client).scan_versions(f"{server}/index.html") == ["1.118.242.1020"]
+    assert URLResolver(client=client).resolve_url(f"{server}/file") == f"{server}/file"
+    assert MirrorOptimizer(client=client).test_mirror(f"{server}/mirror")['available']
+    doctor = BackendDoctor(client=client)
+    assert doctor.client is client
+
+    status = client_status(client)
+    assert status['requests'] == 4
+    assert status['connections_opened'] == 1
+    assert status['dns'] == {'entries': 1, 'hits': 0, 'misses': 1}
+    assert status['pool']['connections'] == 1 and status['pool']['idle'] == 1
+    client.close()
+
+def test_per_host_limit_caps_concurrent_requests(server):
+    Handler.delay = 0.1
+    client = create_client(per_host=2, dns=DnsCache())
+    threads = [threading.Thread(target=client.get, args=(f"{server}/x",)) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert Handler.peak == 2
+    assert client_status(client)['waits_for_host_slot'] >= 4
+    client.close()
+
+def test_streamed_response_holds_host_slot_until_closed(server):
+    client = create_client(per_host=1, dns=DnsCache())
+    # The body has not been read, so the first request still owns the only slot
+    with client.stream("GET", f"{server}/a"):
+        blocked = threading.Thread(target=client.get, args=(f"{server}/b",))
+        blocked.start()
+        blocked.join(0.2)
+        assert blocked.is_alive()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    client.close()
+
+def test_connections_resolve_through_the_dns_cache(server):
+    port = int(server.rsplit(":", 1)[1])
+    dns = DnsCache()
+    # Only the cache knows this name; without the backend hook the lookup fails
+    dns.put("mirror.invalid", port, ["127.0.0.1"])
+    client = create_client(dns=dns)
+
+    assert client.get(f"http://mirror.invalid:{port}/x").status_code == 200
+    assert dns.status()['hits'] == 1
+    assert client_status(client)['connections_opened'] == 1
+    client.close()
+
+def test_async_connections_resolve_through_the_dns_cache(server):
+    port = int(server.rsplit(":", 1)[1])
+    dns = DnsCache()
+    dns.put("mirror.invalid", port, ["127.0.0.1"])
+
+    async def run():
+        async with create_async_client(dns=dns) as client:
+            response = await client.get(f"http://mirror.invalid:{port}/x")
+            return response.status_code, client_status(client)
+
+    status_code, status = asyncio.run(run())
+    assert status_code == 200
+    assert status['connections_opened'] == 1
+
+def test_waiting_for_a_host_slot_honours_the_pool_timeout(server):
+    client = create_client(per_host=1, dns=DnsCache())
+    with client.stream("GET", f"{server}/a"):
+        started = time.monotonic()
+        with pytest.raises(httpx.PoolTimeout):
+            client.get(f"{server}/b", timeout=httpx.Timeout(5.0, pool=0.2))
+        assert time.monotonic() - started < 2
+    # The slot is free again once the first response is closed
+    assert client.get(f"{server}/c", timeout=httpx.Timeout(5.0, pool=0.2)).status_code == 200
+    client.close()
+
+def test_async_host_slot_wait_honours_the_pool_timeout(server):
+    async def run():
+        async with create_async_client(per_host=1, dns=DnsCache()) as client:
+            async with client.stream("GET", f"{server}/a"):
+                with pytest.raises(httpx.PoolTimeout):
+                    await client.get(f"{server}/b", timeout=httpx.Timeout(5.0, pool=0.2))
+            return (await client.get(f"{server}/c")).status_code
+
+    assert asyncio.run(run()) == 200
+
+def test_dns_cache_expires_and_invalidates():
+    clock = [0.0]
+    cache = DnsCache(ttl=10, clock=lambda: clock[0])
+    cache.put("cdn.example", 443, ["192.0.2.1"])
+    assert cache.get("cdn.example", 443) == ["192.0.2.1"]
+    clock[0] = 11
+    assert cache.get("cdn.example", 443) is None
+    cache.put("cdn.example", 443, ["192.0.2.1"])
+    cache.invalidate("cdn.example", 443)
+    assert cache.get("cdn.example", 443) is None
+    assert cache.status()['hits'] == 1
+
+def test_unresolvable_host_raises_connect_error():
+    client = create_client(dns=DnsCache())
+    with pytest.raises(httpx.ConnectError):
+        client.get("http://nonexistent.invalid/")
+    client.close()
+
+def test_transport_maps_pool_errors_and_closes_its_pool(server):
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        refused = f"http://127.0.0.1:{s.getsockname()[1]}/"
+    Handler.delay = 0.5
+    client = create_client(dns=DnsCache())
+    with pytest.raises(httpx.ConnectError):
+        client.get(refused)
+    with pytest.raises(httpx.ReadTimeout):
+        client.get(f"{server}/slow", timeout=0.1)
+    assert client.get(f"{server}/manifest.json", timeout=5).json() == {"version": "1.0"}
+    assert client_status(client)['pool']['connections'] >= 1
+
+    client.close()
+    assert client_status(client)['pool']['connections'] == 0
+
+def test_async_transport_maps_pool_errors(server):
+    Handler.delay = 0.5
+    async def run():
+        async with create_async_client(dns=DnsCache()) as client:
+            with pytest.raises(httpx.ReadTimeout):
+                await client.get(f"{server}/slow", timeout=0.1)
+            return (await client.get(f"{server}/manifest.json", timeout=5)).json()
+
+    assert asyncio.run(run()) == {"version": "1.0"}
+
+def test_async_discovery_reuses_pooled_connection(server):
+    async def run():
+        client = create_async_client(dns=DnsCache())
+        discovery = MirrorDiscovery([{"url": f"{server}/m{i}", "weight": i} for i in range(3)], client=client)
+        results = await discovery.discover_best_mirrors()
+        results = await discovery.discover_best_mirrors()
+        status = client_status(client)
+        await client.aclose()
+        return results, status
+
+    results, status = asyncio.run(run())
+    assert all(r['available'] for r in results)
+    assert status['requests'] == 6
+    # Three probes in parallel need three connections; the second round reuses them
+    assert status['connections_opened'] == 3
+
+def test_discovery_closes_the_client_it_created(server, monkeypatch):
+    import http_client
+    created = []
+    def record(*args, **kwargs):
+        created.append(create_async_client(*args, **kwargs))
+        return created[-1]
+    monkeypatch.setattr(http_client, "create_async_client", record)
+    discovery = MirrorDiscovery([{"url": f"{server}/m0"}])
+
+    # Each call runs in its own loop, as the sidecar's discover_mirrors does
+    for _ in range(2):
+        assert asyncio.run(discovery.discover_best_mirrors())[0]['available']
+
+    assert len(created) == 2
+    assert all(client.is_closed for client in created)
+    assert not http_client._async_clients
+
+def test_shared_client_is_process_wide_and_reported():
+    close_clients()
+    assert ManifestFetcher("http://x/manifest.json").client is get_client()
+    assert URLResolver().client is get_client()
+    metrics = pool_metrics()
+    assert metrics['sync']['pool']['connections'] == 0
+    assert 'hits' in metrics['dns']
+    close_clients()
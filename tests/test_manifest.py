@@ -40,4 +40,23 @@ def test_parse_missing_keys():
     manifest_data = {"something": "else"}
     parser = ManifestParser(json.dumps(manifest_data))
     assert parser.get_target_version() is None
-    assert parser.get_patches() == []
\ No newline at end of file
+    assert parser.get_patches() == []
+def test_get_block_map():
+    entry = {"name": "Data/Client/ClientFullBuild0.package", "MD5_to": "HASH",
+             "blocks": {"size": 4194304, "hashes": ["A", "B"]}}
+    assert ManifestParser.get_block_map(entry) == {'block_size': 4194304, 'hashes': ["A", "B"]}
+    assert ManifestParser.get_block_map({"name": "x"}) is None
+    assert ManifestParser.get_block_map({"name": "x", "blocks": {"size": 0, "hashes": ["A"]}}) is None
+
+def test_get_hash_type_and_entry_hashes():
+    assert ManifestParser(json.dumps({"patch": {"files": []}})).get_hash_type() == "md5"
+    assert ManifestParser(json.dumps({"patch_details": {"hash_type": "SHA-256"}})).get_hash_type() == "sha256"
+
+    parser = ManifestParser(json.dumps({"hash_type": "blake2b", "patch": {"files": []}}))
+    assert parser.get_target_hash({"name": "a", "hash_to": "ab", "MD5_to": "cd"}) == ("blake2b", "AB")
+    assert parser.get_target_hash({"name": "a", "MD5_to": "cd"}) == ("md5", "CD")
+    assert parser.get_source_hash({"name": "a", "hash_from": "ef"}) == ("blake2b", "EF")
+    assert parser.get_source_hash({"name": "a"}) == (None, None)
+
+    with pytest.raises(ValueError):
+        ManifestParser(json.dumps({"hash_type": "crc32"})).get_hash_type()
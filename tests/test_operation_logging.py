@@ -39,5 +39,18 @@ class TestOperationLogger(unittest.TestCase):
         self.assertEqual(len(self.logger.get_pending_operations()), 0)
         self.assertFalse(self.log_path.exists())
 
+    def test_resume_state_survives_session_clear(self):
+        self.logger.log_operation("dl_0", {"type": "download_full", "file": "a.package"})
+        self.logger.save_resume_state("/game/a.package", {"url": "http://x/a", "bytes_written": 4096})
+
+        # A new session clears its operations but keeps partial-download state
+        resumer = OperationLogger(self.log_path)
+        resumer.clear_log(keep_resume=True)
+        self.assertEqual(resumer.get_pending_operations(), [])
+        self.assertEqual(OperationLogger(self.log_path).get_resume_state("/game/a.package")["bytes_written"], 4096)
+
+        resumer.clear_resume_state("/game/a.package")
+        self.assertIsNone(OperationLogger(self.log_path).get_resume_state("/game/a.package"))
+
 if __name__ == '__main__':
     unittest.main()
@@ -18,3 +18,70 @@ def test_verify_md5_missing_file():
     assert patcher.verify_md5("non_existent_file", "ANYHASH") is False
 
 # More tests will be added once xdelta3 wrapper is implemented
+
+def test_verify_hash_other_algorithms(tmp_path):
+    p = tmp_path / "test.txt"
+    p.write_bytes(b"hello world")
+
+    assert Patcher.verify_hash(str(p), hashlib.sha256(b"hello world").hexdigest(), "sha256") is True
+    assert Patcher.verify_hash(str(p), hashlib.blake2b(b"hello world").hexdigest(), "blake2b") is True
+    assert Patcher.verify_hash(str(p), hashlib.md5(b"hello world").hexdigest(), "sha256") is False
+
+@pytest.fixture
+def fake_xdelta(tmp_path):
+    # Stands in for "xdelta3 -d -c -s <source> <patch>": writes source + patch to stdout
+    script = tmp_path / "fake_xdelta.sh"
+    script.write_text('#!/bin/sh\n[ "$1 $2 $3" = "-d -c -s" ] || exit 2\ncat "$4" "$5"\n')
+    script.chmod(0o755)
+    return str(script)
+
+def test_apply_patch_safe_streams_and_verifies(tmp_path, fake_xdelta):
+    source = tmp_path / "source.bin"
+    source.write_bytes(b"old" * 1000)
+    patch_file = tmp_path / "source.delta"
+    patch_file.write_bytes(b"new" * 1000)
+    expected = b"old" * 1000 + b"new" * 1000
+
+    patcher = Patcher(xdelta_exe=fake_xdelta, buffer_size=1024)
+    patcher.verify_hash = None  # Streaming mode must not re-read the output
+    success, message = patcher.apply_patch_safe(str(source), str(patch_file),
+                                                hashlib.sha256(expected).hexdigest(), "sha256")
+
+    assert success is True, message
+    assert source.read_bytes() == expected
+
+def test_apply_patch_safe_streaming_mismatch_keeps_source(tmp_path, fake_xdelta):
+    source = tmp_path / "source.bin"
+    source.write_bytes(b"old")
+    patch_file = tmp_path / "source.delta"
+    patch_file.write_bytes(b"new")
+
+    success, message = Patcher(xdelta_exe=fake_xdelta).apply_patch_safe(str(source), str(patch_file), "WRONGHASH")
+
+    assert success is False
+    assert source.read_bytes() == b"old"
+    assert not (tmp_path / "source.bin.tmp").exists()
+
+@pytest.mark.parametrize("stream_output", [True, False])
+def test_cancel_kills_running_decoder(tmp_path, stream_output):
+    import time
+    import threading
+    from patch import CANCELLED
+    script = tmp_path / "slow_xdelta.sh"
+    script.write_text('#!/bin/sh\nexec sleep 30\n')
+    script.chmod(0o755)
+    source = tmp_path / "source.bin"
+    source.write_bytes(b"old")
+    patch_file = tmp_path / "source.delta"
+    patch_file.write_bytes(b"new")
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+
+    start = time.monotonic()
+    success, message = Patcher(xdelta_exe=str(script), stream_output=stream_output).apply_patch_safe(
+        str(source), str(patch_file), "ANYHASH", cancel=cancel)
+
+    assert (success, message) == (False, CANCELLED)
+    assert time.monotonic() - start < 5
+    assert source.read_bytes() == b"old"
+    assert not (tmp_path / "source.bin.tmp").exists()
@@ -0,0 +1,227 @@
+import os
+import time
+import threading
+import pytest
+from unittest.mock import MagicMock
+from download import DownloadQueue
+from pipeline import PatchPipeline
+from manifest import ManifestFetcher, URLResolver
+
+class FakeManager:
+    """Writes each file after a per-URL delay and records when it finished."""
+    def __init__(self, delays=None, fail=()):
+        self.delays = delays or {}
+        self.fail = set(fail)
+        self.finished = {}
+        self.started = []
+        self.lock = threading.Lock()
+        self.staged_peak = 0
+
+    def download(self, url, output_dir, filename=None, callback=None, **kwargs):
+        with self.lock:
+            self.started.append(url)
+        time.sleep(self.delays.get(url, 0.01))
+        if url in self.fail:
+            return False
+        with open(os.path.join(output_dir, filename), "wb") as f:
+            f.write(url.encode())
+        with self.lock:
+            self.finished[url] = time.monotonic()
+            staged = len([n for n in os.listdir(output_dir) if n.endswith(".delta")])
+            self.staged_peak = max(self.staged_peak, staged)
+        return True
+
+def patch_tasks(count):
+    return [{'type': 'patch_delta', 'file': f"f{i}.package", 'target_md5': f"H{i}",
+             'patch_url': f"http://cdn.example/f{i}.delta"} for i in range(count)]
+
+def test_patches_apply_while_later_patch_files_download(tmp_path):
+    tasks = patch_tasks(3)
+    manager = FakeManager(delays={"http://cdn.example/f2.delta": 0.5})
+    applied = {}
+
+    def apply(i, task, patch_file):
+        assert open(patch_file, "rb").read() == task['patch_url'].encode()
+        applied[task['file']] = time.monotonic()
+        return True, "Success"
+
+    results = PatchPipeline(DownloadQueue(manager, max_concurrent=2)).run(tasks, tmp_path, apply)
+
+    assert all(r['success'] for r in results)
+    # The first patches were applied before the slow patch file arrived
+    assert applied["f0.package"] < manager.finished["http://cdn.example/f2.delta"]
+    assert applied["f1.package"] < manager.finished["http://cdn.example/f2.delta"]
+    # Patch files are removed once applied
+    assert not [n for n in os.listdir(tmp_path) if n.endswith(".delta")]
+
+def test_staging_queue_bounds_downloaded_patch_files(tmp_path):
+    tasks = patch_tasks(8)
+    manager = FakeManager()
+
+    def slow_apply(i, task, patch_file):
+        time.sleep(0.05)
+        return True, "Success"
+
+    PatchPipeline(DownloadQueue(manager, max_concurrent=2, per_host=2), max_staged=1,
+                  max_workers=1).run(tasks, tmp_path, slow_apply)
+
+    # One being applied, one waiting for admission, one in the queue, one per
+    # download slot blocked on the queue
+    assert manager.staged_peak <= 1 + 1 + 1 + 2
+
+def test_pipeline_stops_applying_after_failure(tmp_path):
+    tasks = patch_tasks(4)
+    manager = FakeManager(delays={f"http://cdn.example/f{i}.delta": 0.02 * i for i in range(4)})
+    applied = []
+
+    def apply(i, task, patch_file):
+        applied.append(task['file'])
+        return (False, "xdelta3 error") if task['file'] == "f1.package" else (True, "Success")
+
+    results = PatchPipeline(DownloadQueue(manager, max_concurrent=1)).run(tasks, tmp_path, apply)
+
+    assert applied == ["f0.package", "f1.package"]
+    assert [r['success'] for r in results] == [True, False, False, False]
+    assert results[1]['error'] == "xdelta3 error"
+    assert not [n for n in os.listdir(tmp_path) if n.endswith(".delta")]
+
+def test_failure_skips_queued_patch_downloads(tmp_path):
+    tasks = patch_tasks(6)
+    manager = FakeManager(delays={f"http://cdn.example/f{i}.delta": 0.05 for i in range(1, 6)})
+
+    def apply(i, task, patch_file):
+        return (False, "xdelta3 error") if i == 0 else (True, "Success")
+
+    results = PatchPipeline(DownloadQueue(manager, max_concurrent=1)).run(tasks, tmp_path, apply)
+
+    # Only the download in flight when f0 failed went ahead
+    assert manager.started == ["http://cdn.example/f0.delta", "http://cdn.example/f1.delta"]
+    assert results[0]['cancelled'] is False
+    assert all(r['cancelled'] and not r['success'] for r in results[1:])
+    assert not [n for n in os.listdir(tmp_path) if n.endswith(".delta")]
+
+def test_apply_operations_overlaps_full_downloads_and_patching(tmp_path, update_manager):
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+    (game_dir / "f0.package").write_bytes(b"old")
+    manager_dl = FakeManager(delays={"http://cdn.example/big.package": 0.5})
+
+    manager = update_manager(game_dir, "http://manifest", manager_dl, fetcher=MagicMock(spec=ManifestFetcher),
+                             resolver=MagicMock(spec=URLResolver))
+    applied = {}
+
+    def apply_patch_safe(source, patch_file, target, hash_type="md5", cancel=None, **kwargs):
+        applied[os.path.basename(source)] = time.monotonic()
+        return True, "Success"
+    manager.patcher.apply_patch_safe = apply_patch_safe
+
+    ops = [
+        {'type': 'download_full', 'file': 'big.package', 'target_md5': None, 'url': "http://cdn.example/big.package"},
+        {'type': 'patch_delta', 'file': 'f0.package', 'source_md5': 'OLD', 'target_md5': 'NEW',
+         'patch_url': "http://cdn.example/f0.delta"},
+    ]
+    events = []
+    success, message = manager.apply_operations(ops, progress_callback=events.append)
+
+    assert success is True, message
+    assert applied["f0.package"] < manager_dl.finished["http://cdn.example/big.package"]
+    assert any(e['status'] == 'patching' for e in events)
+
+def test_apply_operations_reports_patch_download_failure(tmp_path, update_manager):
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+    manager = update_manager(game_dir, "http://manifest", FakeManager(fail={"http://cdn.example/f0.delta"}),
+                             fetcher=MagicMock(spec=ManifestFetcher), resolver=MagicMock(spec=URLResolver))
+    manager.patcher.apply_patch_safe = MagicMock()
+
+    success, message = manager.apply_operations(patch_tasks(1))
+
+    assert success is False
+    assert "f0.package" in message and "download failed" in message
+    manager.patcher.apply_patch_safe.assert_not_called()
+
+def test_patches_run_in_parallel_up_to_max_workers(tmp_path):
+    tasks = patch_tasks(6)
+    active = []
+    peak = [0]
+    lock = threading.Lock()
+
+    def apply(i, task, patch_file):
+        with lock:
+            active.append(i)
+            peak[0] = max(peak[0], len(active))
+        time.sleep(0.2)
+        with lock:
+            active.remove(i)
+        return True, "Success"
+
+    pipeline = PatchPipeline(DownloadQueue(FakeManager(), max_concurrent=6, per_host=6), max_staged=6, max_workers=3)
+    results = pipeline.run(tasks, tmp_path, apply)
+
+    assert all(r['success'] for r in results)
+    assert peak[0] == 3
+
+def test_temp_budget_limits_concurrent_patches(tmp_path):
+    tasks = patch_tasks(4)
+    for task in tasks:
+        task['size'] = 100
+    active = []
+    peak = [0]
+
+    def apply(i, task, patch_file):
+        active.append(i)
+        peak[0] = max(peak[0], len(active))
+        time.sleep(0.05)
+        active.remove(i)
+        return True, "Success"
+
+    pipeline = PatchPipeline(DownloadQueue(FakeManager(), max_concurrent=4, per_host=4), max_staged=4,
+                             max_workers=4, temp_budget=250)
+    assert all(r['success'] for r in pipeline.run(tasks, tmp_path, apply))
+    assert peak[0] == 2
+
+def test_failure_cancels_running_patches_and_commits_in_order(tmp_path):
+    tasks = patch_tasks(4)
+    manager = FakeManager(delays={"http://cdn.example/f3.delta": 0.3})
+    cancel = threading.Event()
+    applied = []
+    committed = []
+
+    def apply(i, task, patch_file):
+        applied.append(i)
+        if i == 1:
+            time.sleep(0.05)
+            return False, "xdelta3 error"
+        # A long decode that only ends when cancelled
+        return (False, "Cancelled") if cancel.wait(5) else (True, "Success")
+
+    pipeline = PatchPipeline(DownloadQueue(manager, max_concurrent=4, per_host=4), max_workers=4)
+    results = pipeline.run(tasks, tmp_path, apply, commit=lambda i, task, result: committed.append(i),
+                           cancel=cancel)
+
+    assert 3 not in applied
+    assert committed == [0, 1, 2, 3]
+    assert results[1] == {'file': "f1.package", 'success': False, 'error': "xdelta3 error", 'cancelled': False}
+    assert all(results[i]['cancelled'] for i in (0, 2, 3))
+    assert not [n for n in os.listdir(tmp_path) if n.endswith(".delta")]
+
+def test_apply_operations_reports_root_cause_of_cancelled_patches(tmp_path, update_manager):
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+    manager = update_manager(game_dir, "http://manifest", FakeManager(), fetcher=MagicMock(spec=ManifestFetcher),
+                             resolver=MagicMock(spec=URLResolver))
+
+    def apply_patch_safe(source, patch_file, target, hash_type="md5", cancel=None, **kwargs):
+        if source.endswith("f1.package"):
+            time.sleep(0.05)
+            return False, "Patch failed: bad delta"
+        return (False, "Cancelled") if cancel.wait(5) else (True, "Success")
+    manager.patcher.apply_patch_safe = apply_patch_safe
+    manager.patch_pipeline.max_workers = 4
+
+    success, message = manager.apply_operations(patch_tasks(3))
+
+    assert success is False
+    assert message == "Patching failed for f1.package: Patch failed: bad delta"
+    statuses = {op_id: info['status'] for op_id, info in manager.op_logger._cache.items()}
+    assert statuses == {"patch_0": "pending", "patch_1": "failed", "patch_2": "pending"}
@@ -0,0 +1,152 @@
+import os
+import hashlib
+import pytest
+from unittest.mock import MagicMock
+from planner import CostModel, UpdatePlanner, MIN_SAMPLE_BYTES
+from pipeline import PatchPipeline
+from download import DownloadQueue
+from manifest import ManifestFetcher, URLResolver
+
+MB = 1024 ** 2
+
+def edge(src, dst, size, url=None):
+    return {'from': ('md5', src), 'to': ('md5', dst), 'patch_url': url or f"http://cdn/{src}-{dst}",
+            'size': size, 'from_label': src, 'to_label': dst}
+
+def planner():
+    # 10 MB/s download, 100 MB/s patching, 0.5s per request
+    return UpdatePlanner(CostModel(throughput=10 * MB, patch_rate=100 * MB))
+
+def test_two_hop_chain_beats_full_download():
+    edges = [edge("V98", "V99", 5 * MB), edge("V99", "V100", 5 * MB)]
+    plan = planner().plan({('md5', "V98")}, ('md5', "V100"), edges, full_size=500 * MB, file_size=500 * MB)
+
+    assert plan['strategy'] == 'delta'
+    assert [e['to_label'] for e in plan['hops']] == ["V99", "V100"]
+    assert plan['download_bytes'] == 10 * MB
+    # Two requests, 1s transfer, two 5s patch passes
+    assert plan['cost'] == pytest.approx(12.0)
+    assert plan['alternatives']['full'] == pytest.approx(50.5)
+    assert "V98 -> V99 -> V100" in plan['reason']
+
+def test_cheapest_path_wins_over_fewest_hops():
+    edges = [edge("A", "C", 40 * MB), edge("A", "B", 1 * MB), edge("B", "C", 1 * MB)]
+    plan = planner().plan({('md5', "A")}, ('md5', "C"), edges, full_size=100 * MB, file_size=1 * MB)
+    assert [e['to_label'] for e in plan['hops']] == ["B", "C"]
+
+def test_full_download_chosen_when_cheaper_than_delta():
+    edges = [edge("OLD", "NEW", 95 * MB)]
+    plan = planner().plan({('md5', "OLD")}, ('md5', "NEW"), edges, full_size=100 * MB, file_size=100 * MB)
+    assert plan['strategy'] == 'full'
+    assert "cheaper" in plan['reason']
+
+def test_unknown_sizes_keep_preferring_deltas():
+    plan = planner().plan({('md5', "OLD")}, ('md5', "NEW"), [edge("OLD", "NEW", None)])
+    assert plan['strategy'] == 'delta'
+    assert plan['alternatives']['full'] is None
+
+def test_unreachable_target_falls_back_to_full():
+    plan = planner().plan({('md5', "OTHER")}, ('md5', "NEW"), [edge("OLD", "NEW", MB)], full_size=MB)
+    assert plan['strategy'] == 'full'
+    assert plan['reason'] == 'Source hash mismatch for delta'
+
+def test_chains_longer_than_max_hops_are_ignored():
+    edges = [edge(f"V{i}", f"V{i + 1}", 1) for i in range(5)]
+    limited = UpdatePlanner(CostModel(), max_hops=3)
+    assert limited.cheapest_chain({('md5', "V0")}, ('md5', "V5"), edges) is None
+    assert len(planner().cheapest_chain({('md5', "V0")}, ('md5', "V5"), edges)[2]) == 5
+
+def test_cost_model_learns_and_persists(tmp_path):
+    store = tmp_path / "cost_model.json"
+    model = CostModel(store, alpha=0.5)
+    model.observe_throughput(100 * MB, sample_bytes=1024)  # Too small to count
+    model.observe_throughput(20 * MB, sample_bytes=MIN_SAMPLE_BYTES)
+    model.observe_patch(MIN_SAMPLE_BYTES, 0.04)
+    model.save()
+
+    reloaded = CostModel(store)
+    assert reloaded.throughput == pytest.approx((5 + 20) / 2 * MB)
+    assert reloaded.patch_rate == pytest.approx((50 * MB + MIN_SAMPLE_BYTES / 0.04) / 2)
+
+def test_cost_model_without_store_stays_in_memory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    model = CostModel(throughput=10 * MB, patch_rate=100 * MB)
+    model.observe_throughput(20 * MB, sample_bytes=MIN_SAMPLE_BYTES)
+    model.save()
+
+    assert model.throughput > 10 * MB
+    assert list(tmp_path.iterdir()) == []
+
+def test_get_operations_plans_delta_chain_and_explains_it(tmp_path, update_manager):
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+    (game_dir / "game.package").write_bytes(b"version 1.98")
+    v98 = hashlib.md5(b"version 1.98").hexdigest().upper()
+    manifest = {"version": "1.100", "patch": {"files": [{
+        "name": "game.package", "type": "delta", "size": 400 * MB,
+        "MD5_from": "V99", "MD5_to": "V100", "patch_size": 2 * MB,
+        "url": "http://cdn/full", "patch_url": "http://cdn/99-100",
+        "version_from": "1.99", "version_to": "1.100",
+        "deltas": [{"MD5_from": v98, "MD5_to": "V99", "patch_url": "http://cdn/98-99", "patch_size": 3 * MB,
+                    "version_from": "1.98", "version_to": "1.99"}]
+    }]}}
+    fetcher = MagicMock(spec=ManifestFetcher)
+    fetcher.fetch_manifest_json.return_value = manifest
+    resolver = MagicMock(spec=URLResolver)
+    resolver.resolve_url.side_effect = lambda url: f"resolved_{url}"
+    manager = update_manager(game_dir, "http://manifest", MagicMock(), fetcher=fetcher, resolver=resolver,
+                             planner=planner())
+
+    op = manager.get_operations()[0]
+
+    assert op['type'] == 'patch_delta'
+    assert op['source_md5'] == v98 and op['target_md5'] == "V100"
+    assert [step['patch_url'] for step in op['chain']] == ["resolved_http://cdn/98-99", "resolved_http://cdn/99-100"]
+    assert [step['target_md5'] for step in op['chain']] == ["V99", "V100"]
+    assert op['patch_size'] == 5 * MB
+    assert op['plan']['strategy'] == 'delta' and op['plan']['hops'] == 2
+    assert "1.98 -> 1.99 -> 1.100" in op['reason']
+
+    # Without the intermediate delta the file can only be downloaded in full
+    del manifest["patch"]["files"][0]["deltas"]
+    op = manager.get_operations()[0]
+    assert op['type'] == 'download_full'
+    assert op['reason'] == 'Source hash mismatch for delta'
+    assert op['plan']['strategy'] == 'full'
+
+class FileManager:
+    def download(self, url, output_dir, filename=None, callback=None, **kwargs):
+        with open(os.path.join(output_dir, filename), "w") as f:
+            f.write(url)
+        return True
+
+def test_pipeline_applies_chain_hops_in_order(tmp_path):
+    task = {'type': 'patch_delta', 'file': 'a.package', 'target_md5': "V100", 'hash_type': 'md5',
+            'patch_url': "http://cdn/98-99",
+            'chain': [{'patch_url': "http://cdn/98-99", 'source_md5': "V98", 'target_md5': "V99"},
+                      {'patch_url': "http://cdn/99-100", 'source_md5': "V99", 'target_md5': "V100"}]}
+    applied = []
+
+    def apply(i, step, patch_file):
+        applied.append((open(patch_file).read(), step['target_md5']))
+        return True, "Success"
+
+    results = PatchPipeline(DownloadQueue(FileManager())).run([task], tmp_path, apply)
+
+    assert results[0]['success'] is True
+    assert applied == [("http://cdn/98-99", "V99"), ("http://cdn/99-100", "V100")]
+    assert not [n for n in os.listdir(tmp_path) if n.endswith(".delta")]
+
+def test_failed_hop_stops_the_chain(tmp_path):
+    task = {'type': 'patch_delta', 'file': 'a.package', 'target_md5': "C", 'patch_url': "http://cdn/1",
+            'chain': [{'patch_url': f"http://cdn/{n}", 'target_md5': t} for n, t in ((1, "B"), (2, "C"))]}
+    applied = []
+
+    def apply(i, step, patch_file):
+        applied.append(step['target_md5'])
+        return False, "Hash mismatch"
+
+    results = PatchPipeline(DownloadQueue(FileManager())).run([task], tmp_path, apply)
+
+    assert applied == ["B"]
+    assert results[0]['success'] is False and results[0]['error'] == "Hash mismatch"
@@ -0,0 +1,125 @@
+import time
+import pytest
+from unittest.mock import MagicMock
+from progress import ProgressAggregator
+from download import DownloadQueue, Aria2Manager, HttpDownloader
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+def test_snapshot_combines_transfers_with_numeric_fields():
+    clock = FakeClock()
+    aggregator = ProgressAggregator(lambda s: None, expected_files=3, clock=clock)
+    aggregator._last_sample = (clock(), 0)
+
+    aggregator.ingest({'file': 'a', 'completed_bytes': 100, 'total_bytes': 400, 'percentage': 25})
+    aggregator.ingest({'file': 'b', 'completed_bytes': 300, 'total_bytes': 600, 'percentage': 50})
+    clock.now += 1.0
+    snap = aggregator.snapshot()
+
+    assert snap['current'] == 400
+    assert snap['total'] == 1000
+    assert snap['percentage'] == 40.0
+    assert snap['speed'] == pytest.approx(400.0)
+    assert snap['eta'] == pytest.approx(1.5)
+    assert snap['active'] == 2
+    assert snap['files_total'] == 3
+
+def test_throughput_is_an_exponential_moving_average():
+    clock = FakeClock()
+    aggregator = ProgressAggregator(lambda s: None, alpha=0.5, clock=clock)
+    aggregator._last_sample = (clock(), 0)
+
+    aggregator.ingest({'file': 'a', 'completed_bytes': 1000, 'total_bytes': 10000})
+    clock.now += 1.0
+    assert aggregator.snapshot()['speed'] == pytest.approx(1000.0)
+
+    aggregator.ingest({'file': 'a', 'completed_bytes': 4000, 'total_bytes': 10000})
+    clock.now += 1.0
+    # 0.5 * 3000 + 0.5 * 1000
+    assert aggregator.snapshot()['speed'] == pytest.approx(2000.0)
+
+    # A retry moving the counter backwards does not produce negative throughput
+    aggregator.ingest({'file': 'a', 'completed_bytes': 3000, 'total_bytes': 10000})
+    clock.now += 1.0
+    assert aggregator.snapshot()['speed'] == pytest.approx(1000.0)
+
+def test_events_without_byte_counts_fall_back_to_percentages():
+    aggregator = ProgressAggregator(lambda s: None)
+    aggregator.ingest({'percentage': 100, 'speed': '1M', 'eta': '0s'})
+    snap = aggregator.snapshot()
+    assert snap['total'] is None and snap['eta'] is None
+    assert snap['percentage'] == 100
+    assert snap['files_completed'] == 1
+
+def test_publishes_at_fixed_rate_regardless_of_event_volume():
+    published = []
+    latest = {}
+    aggregator = ProgressAggregator(published.append, interval=0.1)
+    with aggregator:
+        deadline = time.monotonic() + 0.55
+        n = 0
+        while time.monotonic() < deadline:
+            n += 1
+            latest[f"f{n % 8}"] = n
+            aggregator.ingest({'file': f"f{n % 8}", 'completed_bytes': n, 'total_bytes': 10 ** 9})
+    # Thousands of events, about six reports (five ticks plus the final one)
+    assert n > 1000
+    assert 4 <= len(published) <= 8
+    assert published[-1]['current'] == sum(latest.values())
+
+def test_nothing_published_without_events():
+    published = []
+    with ProgressAggregator(published.append, interval=0.02):
+        time.sleep(0.1)
+    assert published == []
+
+def test_aria2_console_line_carries_byte_counts():
+    progress = Aria2Manager.parse_progress(None, "[#2089b0 1.5MiB/4.0MiB(37%) CN:1 DL:512KiB ETA:5s]")
+    assert progress['completed_bytes'] == int(1.5 * 1024 ** 2)
+    assert progress['total_bytes'] == 4 * 1024 ** 2
+    assert progress['percentage'] == 37
+
+def test_http_downloader_events_feed_aggregator(tmp_path):
+    import httpx
+    body = b"x" * 300000
+    client = httpx.Client(transport=httpx.MockTransport(lambda r: httpx.Response(200, content=body)))
+    published = []
+    aggregator = ProgressAggregator(published.append, interval=10)
+    queue = DownloadQueue(HttpDownloader(client=client, chunk_size=65536, progress_interval=0))
+    queue.add_task("http://a.example/one", str(tmp_path), "one.bin")
+    queue.add_task("http://b.example/two", str(tmp_path), "two.bin")
+
+    with aggregator:
+        assert queue.process_all(callback=aggregator.ingest)
+
+    assert published[-1]['current'] == 600000
+    assert published[-1]['total'] == 600000
+    assert published[-1]['files_completed'] == 2
+
+def test_apply_operations_emits_aggregated_download_progress(tmp_path, update_manager):
+    from manifest import ManifestFetcher, URLResolver
+    import httpx
+    from download import HttpDownloader
+
+    client = httpx.Client(transport=httpx.MockTransport(lambda r: httpx.Response(200, content=b"y" * 5000)))
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+    manager = update_manager(game_dir, "http://manifest", HttpDownloader(client=client, progress_interval=0),
+                             fetcher=MagicMock(spec=ManifestFetcher), resolver=MagicMock(spec=URLResolver))
+    ops = [{'type': 'download_full', 'file': f"f{i}.bin", 'target_md5': None, 'url': f"http://dl/{i}"}
+           for i in range(3)]
+    events = []
+
+    success, message = manager.apply_operations(ops, progress_callback=events.append)
+
+    assert success is True, message
+    downloading = [e for e in events if e['status'] == 'downloading']
+    assert downloading
+    assert downloading[-1]['current'] == 15000
+    assert downloading[-1]['files_total'] == 3
+    assert isinstance(downloading[-1]['speed'], float)
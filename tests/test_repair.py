@@ -0,0 +1,162 @@
+import os
+import json
+import hashlib
+import time
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest.mock import MagicMock
+from engine import VerificationEngine
+from repair import RangeRepairer
+from http_client import get_client
+from manifest import ManifestFetcher, URLResolver
+
+BLOCK_SIZE = 4096
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves in-memory files, honouring single 'bytes=a-b' Range headers."""
+    files = {}
+    served_bytes = 0
+    support_ranges = True
+    # Seconds each response is held back, and the most requests seen at once
+    delay = 0.0
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        time.sleep(cls.delay)
+        with cls.lock:
+            cls.active -= 1
+        data = self.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        range_header = self.headers.get("Range")
+        if range_header and self.support_ranges:
+            start, end = (int(x) for x in range_header.split("=")[1].split("-"))
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{start + len(body) - 1}/{len(data)}")
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        type(self).served_bytes += len(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    RangeHandler.files = {}
+    RangeHandler.served_bytes = 0
+    RangeHandler.support_ranges = True
+    RangeHandler.delay, RangeHandler.active, RangeHandler.peak = 0.0, 0, 0
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+def make_corrupt_copy(tmp_path, good):
+    bad = bytearray(good)
+    bad[BLOCK_SIZE * 3 + 7] ^= 0xFF
+    bad[BLOCK_SIZE * 40] ^= 0xFF
+    p = tmp_path / "ClientFullBuild0.package"
+    p.write_bytes(bytes(bad))
+    return p
+
+def block_map_for(good):
+    return {
+        'block_size': BLOCK_SIZE,
+        'hashes': [hashlib.md5(good[i:i + BLOCK_SIZE]).hexdigest().upper() for i in range(0, len(good), BLOCK_SIZE)]
+    }
+
+def test_repair_fetches_only_bad_ranges(tmp_path, server):
+    good = os.urandom(BLOCK_SIZE * 64 + 123)
+    RangeHandler.files["/ClientFullBuild0.package"] = good
+    p = make_corrupt_copy(tmp_path, good)
+
+    engine = VerificationEngine(max_workers=4)
+    block_map = block_map_for(good)
+    report = engine.verify_blocks(str(p), BLOCK_SIZE, block_map['hashes'])
+    assert report['bad_ranges'] == [[BLOCK_SIZE * 3, BLOCK_SIZE * 4], [BLOCK_SIZE * 40, BLOCK_SIZE * 41]]
+
+    repairer = RangeRepairer(engine)
+    success, message = repairer.repair(
+        str(p), f"{server}/ClientFullBuild0.package", report['bad_ranges'], block_map,
+        hashlib.md5(good).hexdigest(), report['expected_size']
+    )
+
+    assert success is True, message
+    assert p.read_bytes() == good
+    assert RangeHandler.served_bytes == BLOCK_SIZE * 2
+
+def test_repair_fails_without_range_support(tmp_path, server):
+    good = os.urandom(BLOCK_SIZE * 64)
+    RangeHandler.files["/ClientFullBuild0.package"] = good
+    RangeHandler.support_ranges = False
+    p = make_corrupt_copy(tmp_path, good)
+
+    success, message = RangeRepairer().repair(
+        str(p), f"{server}/ClientFullBuild0.package", [[BLOCK_SIZE * 3, BLOCK_SIZE * 4]], block_map_for(good),
+        hashlib.md5(good).hexdigest(), len(good)
+    )
+    assert success is False
+    assert "range" in message.lower()
+
+def test_update_manager_plans_and_applies_repair_from_blockmap(tmp_path, server, update_manager):
+    good = os.urandom(BLOCK_SIZE * 64)
+    url = f"{server}/ClientFullBuild0.package"
+    RangeHandler.files["/ClientFullBuild0.package"] = good
+    block_map = block_map_for(good)
+    RangeHandler.files["/ClientFullBuild0.package.blockmap"] = json.dumps(
+        {"size": BLOCK_SIZE, "hashes": block_map['hashes']}
+    ).encode()
+
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+    make_corrupt_copy(game_dir, good)
+
+    fetcher = MagicMock(spec=ManifestFetcher)
+    fetcher.fetch_manifest_json.return_value = {
+        "version": "1.0",
+        "patch": {"files": [{
+            "name": "ClientFullBuild0.package", "MD5_to": hashlib.md5(good).hexdigest().upper(),
+            "type": "full", "url": url
+        }]}
+    }
+    resolver = MagicMock(spec=URLResolver)
+    resolver.resolve_url.side_effect = lambda u: u
+
+    manager = update_manager(game_dir, "http://manifest", MagicMock(), fetcher=fetcher, resolver=resolver)
+    manager.repair_min_size = 0
+    ops = manager.get_operations()
+
+    assert ops[0]['type'] == 'repair_blocks'
+    assert ops[0]['repair_bytes'] == BLOCK_SIZE * 2
+
+    success, message = manager.apply_operations(ops)
+    assert success is True, message
+    assert (game_dir / "ClientFullBuild0.package").read_bytes() == good
+
+def test_block_maps_are_fetched_concurrently_through_the_shared_client(server):
+    urls = [f"{server}/f{i}.package" for i in range(4)]
+    for i in range(3):
+        RangeHandler.files[f"/f{i}.package.blockmap"] = json.dumps({"size": BLOCK_SIZE, "hashes": ["AA"]}).encode()
+    RangeHandler.delay = 0.2
+    repairer = RangeRepairer()
+
+    maps = repairer.fetch_block_maps(urls + urls[:1])
+
+    assert repairer.client is get_client()
+    assert RangeHandler.peak > 1
+    assert [maps[url] is not None for url in urls] == [True, True, True, False]
@@ -0,0 +1,108 @@
+import httpx
+from unittest.mock import MagicMock
+from space import SpaceScheduler, footprint, volumes_for
+from update_logic import SpaceCalculator
+from download import HttpDownloader
+from manifest import ManifestFetcher, URLResolver
+
+class SimulatedDisk:
+    """Tracks used bytes per device and fails if an operation overfills one."""
+    def __init__(self, capacity, used):
+        self.capacity = capacity
+        self.used = dict(used)
+        self.high_water = dict(used)
+
+    def run_batch(self, fps):
+        for fp in fps:
+            for device, (peak, _) in fp.items():
+                self.used[device] += peak
+        for device, used in self.used.items():
+            assert used <= self.capacity[device], f"{device} overfilled: {used} > {self.capacity[device]}"
+            self.high_water[device] = max(self.high_water[device], used)
+        for fp in fps:
+            for device, (peak, final) in fp.items():
+                self.used[device] += final - peak
+
+def download(name, size, local_size=0):
+    return {'type': 'download_full', 'file': name, 'size': size, 'local_size': local_size}
+
+def fp(op, deposits=False):
+    return footprint(op, op.get('local_size', 0), deposits=deposits)
+
+def test_footprints_count_temporary_copies():
+    assert fp(download("a", 100, local_size=80)) == {'game': (100, 20)}
+    patch = {'type': 'patch_delta', 'file': 'b', 'size': 100, 'patch_size': 10}
+    assert footprint(patch, 90) == {'game': (100, 10), 'patches': (10, 0)}
+    assert fp(download("c", 50), deposits=True)['store'] == (50, 50)
+    assert footprint({'type': 'nothing', 'file': 'd'}) == {}
+
+def test_batches_keep_a_small_disk_from_overflowing():
+    # 1000-byte disk with 400 free; every file is replaced by one of the same size
+    ops = [download(f"f{i}", 150, local_size=150) for i in range(6)]
+    plan = SpaceScheduler({'game': 400}).schedule(ops, fp)
+
+    assert not plan['unschedulable']
+    assert [len(b) for b in plan['batches']] == [2, 2, 2]
+    assert plan['peak'] == {'game': 300}
+    disk = SimulatedDisk({'game': 1000}, {'game': 600})
+    for batch in plan['batches']:
+        disk.run_batch([fp(op) for op in batch])
+    assert disk.used == {'game': 600}
+
+def test_space_freeing_operations_run_first():
+    ops = [download("grow", 300), download("shrink", 100, local_size=400), download("big", 250, local_size=250)]
+    plan = SpaceScheduler({'game': 300}).schedule(ops, fp)
+
+    # Shrinking first frees the room "big" and "grow" then share
+    assert [[op['file'] for op in batch] for batch in plan['batches']] == [["shrink"], ["big", "grow"]]
+    disk = SimulatedDisk({'game': 1000}, {'game': 700})
+    for batch in plan['batches']:
+        disk.run_batch([fp(op) for op in batch])
+
+def test_each_filesystem_has_its_own_budget():
+    # Game files have room; the content store on another device fills first
+    ops = [download(f"f{i}", 100, local_size=100) for i in range(4)]
+    scheduler = SpaceScheduler({'dev-game': 1000, 'dev-store': 250},
+                               volumes={'game': 'dev-game', 'patches': 'dev-game', 'store': 'dev-store'})
+    plan = scheduler.schedule(ops, lambda op: fp(op, deposits=True))
+
+    assert [len(b) for b in plan['batches']] == [2]
+    assert len(plan['unschedulable']) == 2
+    assert plan['peak'] == {'dev-game': 200, 'dev-store': 200}
+
+def test_roles_on_one_device_share_its_budget(tmp_path):
+    volumes, budgets = volumes_for({'game': tmp_path, 'patches': tmp_path / "missing" / "dir"}, max_extra=1234)
+    assert volumes['game'] == volumes['patches']
+    assert budgets == {volumes['game']: 1234}
+
+def test_operation_larger_than_disk_is_unschedulable():
+    plan = SpaceScheduler({'game': 100}).schedule([download("huge", 500), download("small", 50)], fp)
+    assert [op['file'] for op in plan['unschedulable']] == ["huge"]
+    assert [[op['file'] for op in batch] for batch in plan['batches']] == [["small"]]
+
+def test_space_calculator_reports_peak_temporary_usage():
+    ops = [download("a", 1000), {'type': 'patch_delta', 'file': 'b', 'size': 3000, 'patch_size': 300}]
+    assert SpaceCalculator.estimate(ops)['peak_size'] == 3300
+
+def test_apply_operations_runs_batches_within_budget(tmp_path, update_manager):
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+    for i in range(3):
+        (game_dir / f"f{i}.bin").write_bytes(b"x" * 1000)
+    client = httpx.Client(transport=httpx.MockTransport(lambda r: httpx.Response(200, content=b"y" * 1000)))
+    manager = update_manager(game_dir, "http://manifest", HttpDownloader(client=client, progress_interval=0),
+                             fetcher=MagicMock(spec=ManifestFetcher), resolver=MagicMock(spec=URLResolver))
+    manager.space_budget = 2500
+    ops = [{'type': 'download_full', 'file': f"f{i}.bin", 'target_md5': None, 'url': f"http://dl/{i}",
+            'size': 1000} for i in range(3)]
+    events = []
+
+    success, message = manager.apply_operations(ops, progress_callback=events.append)
+
+    assert success is True, message
+    assert [e['current'] for e in events if e['status'] == 'batch'] == [1, 2]
+    assert all((game_dir / f"f{i}.bin").read_bytes() == b"y" * 1000 for i in range(3))
+
+    manager.space_budget = 500
+    success, message = manager.apply_operations(ops)
+    assert success is False and "Not enough disk space" in message
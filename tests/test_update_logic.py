@@ -3,6 +3,7 @@ import os
 import pytest
 from unittest.mock import MagicMock
 from update_logic import UpdateManager
+from hash_cache import HashCache
 from manifest import ManifestFetcher, URLResolver
 from download import DownloadQueue
 
@@ -19,7 +20,7 @@ def mock_resolver():
     resolver.resolve_url.side_effect = lambda url: f"resolved_{url}"
     return resolver
 
-def test_get_operations_up_to_date(tmp_path, mock_fetcher, mock_resolver):
+def test_get_operations_up_to_date(tmp_path, mock_fetcher, mock_resolver, update_manager):
     game_dir = tmp_path / "game"
     game_dir.mkdir()
     file1 = game_dir / "file1.txt"
@@ -37,12 +38,12 @@ def test_get_operations_up_to_date(tmp_path, mock_fetcher, mock_resolver):
     }
     mock_fetcher.fetch_manifest_json.return_value = manifest
     
-    manager = UpdateManager(str(game_dir), "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver)
+    manager = update_manager(game_dir, "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver)
     ops = manager.get_operations()
     assert len(ops) == 1
     assert ops[0]['type'] == 'nothing'
 
-def test_get_operations_requires_download(tmp_path, mock_fetcher, mock_resolver):
+def test_get_operations_requires_download(tmp_path, mock_fetcher, mock_resolver, update_manager):
     game_dir = tmp_path / "game"
     game_dir.mkdir()
     
@@ -56,12 +57,12 @@ def test_get_operations_requires_download(tmp_path, mock_fetcher, mock_resolver)
     }
     mock_fetcher.fetch_manifest_json.return_value = manifest
     
-    manager = UpdateManager(str(game_dir), "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver)
+    manager = update_manager(game_dir, "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver)
     ops = manager.get_operations()
     assert ops[0]['type'] == 'download_full'
     assert ops[0]['url'] == 'resolved_http://example.com/missing.txt'
 
-def test_get_operations_delta_match(tmp_path, mock_fetcher, mock_resolver):
+def test_get_operations_delta_match(tmp_path, mock_fetcher, mock_resolver, update_manager):
     game_dir = tmp_path / "game"
     game_dir.mkdir()
     file1 = game_dir / "patchable.txt"
@@ -86,12 +87,12 @@ def test_get_operations_delta_match(tmp_path, mock_fetcher, mock_resolver):
     }
     mock_fetcher.fetch_manifest_json.return_value = manifest
     
-    manager = UpdateManager(str(game_dir), "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver)
+    manager = update_manager(game_dir, "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver)
     ops = manager.get_operations()
     assert ops[0]['type'] == 'patch_delta'
     assert ops[0]['patch_url'] == 'resolved_http://example.com/patch'
 
-def test_apply_operations_download_fail(tmp_path, mock_fetcher, mock_resolver):
+def test_apply_operations_download_fail(tmp_path, mock_fetcher, mock_resolver, update_manager):
     # Mock DownloadQueue instead of Aria2 directly, as UpdateManager uses queue.process_all
     mock_queue = MagicMock(spec=DownloadQueue)
     mock_queue.process_all.return_value = False
@@ -99,7 +100,7 @@ def test_apply_operations_download_fail(tmp_path, mock_fetcher, mock_resolver):
     game_dir = tmp_path / "game"
     game_dir.mkdir()
     
-    manager = UpdateManager(str(game_dir), "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver)
+    manager = update_manager(game_dir, "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver)
     manager.queue = mock_queue # Inject mock queue
 
     ops = [{'type': 'download_full', 'file': 'test.txt', 'target_md5': 'HASH', 'url': 'http://dl.com'}]
@@ -108,18 +109,134 @@ def test_apply_operations_download_fail(tmp_path, mock_fetcher, mock_resolver):
     assert success is False
     assert "downloads failed" in message
 
-def test_apply_operations_success(tmp_path, mock_fetcher, mock_resolver):
+def test_apply_operations_success(tmp_path, mock_fetcher, mock_resolver, update_manager):
     mock_queue = MagicMock(spec=DownloadQueue)
     mock_queue.process_all.return_value = True
 
     game_dir = tmp_path / "game"
     game_dir.mkdir()
     
-    manager = UpdateManager(str(game_dir), "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver)
+    manager = update_manager(game_dir, "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver)
     manager.queue = mock_queue # Inject mock queue
 
     # Mock some download ops
     ops = [{'type': 'download_full', 'file': 'test.txt', 'target_md5': 'HASH', 'url': 'http://dl.com'}]
     
     success, message = manager.apply_operations(ops)
-    assert success is True
\ No newline at end of file
+    assert success is True
+def test_get_operations_quick_level(tmp_path, mock_fetcher, mock_resolver, update_manager):
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+    (game_dir / "good.txt").write_bytes(b"good content")
+    (game_dir / "wrong_size.txt").write_bytes(b"short")
+    import hashlib
+    good_hash = hashlib.md5(b"good content").hexdigest().upper()
+
+    manifest = {
+        "version": "1.0",
+        "patch": {
+            "files": [
+                {"name": "good.txt", "MD5_to": good_hash, "size": 12, "type": "full", "url": "http://example.com/good.txt"},
+                {"name": "wrong_size.txt", "MD5_to": "OTHERHASH", "size": 100, "type": "full", "url": "http://example.com/wrong_size.txt"}
+            ]
+        }
+    }
+    mock_fetcher.fetch_manifest_json.return_value = manifest
+
+    manager = update_manager(game_dir, "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver)
+    manager.engine.verify_files = MagicMock(side_effect=lambda paths, progress_callback=None: {p: "LOCALHASH" for p in paths})
+    ops = manager.get_operations(verify_level="quick")
+
+    # Only the file that failed the size check is fully hashed
+    manager.engine.verify_files.assert_called_once()
+    assert manager.engine.verify_files.call_args[0][0] == [str(game_dir / "wrong_size.txt")]
+    assert ops[0] == {'type': 'nothing', 'file': 'good.txt', 'reason': 'Up to date', 'confidence': 'size'}
+    assert ops[1]['type'] == 'download_full'
+    assert ops[1]['confidence'] == 'verified'
+
+    with pytest.raises(ValueError):
+        manager.get_operations(verify_level="bogus")
+
+def test_get_operations_migrating_hash_type(tmp_path, mock_fetcher, mock_resolver, update_manager):
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+    (game_dir / "new.txt").write_bytes(b"new content")
+    (game_dir / "legacy.txt").write_bytes(b"legacy content")
+    (game_dir / "delta.txt").write_bytes(b"old content")
+    import hashlib
+
+    manifest = {
+        "version": "1.0",
+        "hash_type": "sha256",
+        "patch": {
+            "files": [
+                {"name": "new.txt", "hash_to": hashlib.sha256(b"new content").hexdigest(),
+                 "type": "full", "url": "http://example.com/new.txt"},
+                {"name": "legacy.txt", "MD5_to": hashlib.md5(b"legacy content").hexdigest().upper(),
+                 "type": "full", "url": "http://example.com/legacy.txt"},
+                {"name": "delta.txt", "hash_to": "NEWSHA", "hash_from": hashlib.sha256(b"old content").hexdigest(),
+                 "type": "delta", "url": "http://example.com/delta.txt", "patch_url": "http://example.com/delta.xdelta"}
+            ]
+        }
+    }
+    mock_fetcher.fetch_manifest_json.return_value = manifest
+
+    manager = update_manager(game_dir, "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver)
+    ops = manager.get_operations()
+
+    assert manager.engine.algorithm == "sha256"
+    assert manager.engine.algorithms == ("sha256", "md5")
+    assert [op['type'] for op in ops] == ['nothing', 'nothing', 'patch_delta']
+    assert ops[2]['hash_type'] == 'sha256'
+    assert ops[2]['target_md5'] == 'NEWSHA'
+
+def test_apply_operations_http_download_records_hash_without_reread(tmp_path, mock_fetcher, mock_resolver, update_manager):
+    import hashlib
+    import httpx
+    from download import HttpDownloader
+
+    body = b"payload" * 1000
+    client = httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=body)))
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+
+    manager = update_manager(game_dir, "http://manifest", HttpDownloader(client=client), fetcher=mock_fetcher,
+                             resolver=mock_resolver)
+    manager.engine._digest_file = MagicMock(side_effect=AssertionError("file was re-read"))
+    digest = hashlib.blake2b(body).hexdigest().upper()
+    ops = [{'type': 'download_full', 'file': 'payload.bin', 'target_md5': digest, 'hash_type': 'blake2b',
+            'url': 'http://dl.com/payload.bin'}]
+
+    success, message = manager.apply_operations(ops)
+    assert success is True, message
+    assert manager.engine.hash_file(str(game_dir / "payload.bin"), algorithm="blake2b") == digest
+
+def test_update_manager_uses_injected_hash_cache(tmp_path, mock_fetcher, mock_resolver, update_manager):
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+    cache = HashCache(tmp_path / "hash_cache.db")
+
+    manager = update_manager(game_dir, "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver,
+                             hash_cache=cache)
+
+    assert manager.hash_cache is cache
+    assert manager.engine.cache is cache
+    assert manager.patcher.hash_cache is cache
+
+def test_update_manager_keeps_state_in_memory_unless_given_a_state_dir(tmp_path, mock_fetcher, mock_resolver):
+    game_dir = tmp_path / "game"
+    game_dir.mkdir()
+
+    manager = UpdateManager(str(game_dir), "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver)
+    assert manager.hash_cache.db_path is None
+    assert manager.planner.cost_model.store_path is None
+    assert manager.engine.backend.store.store_path is None
+    manager.hash_cache.close()
+
+    state = tmp_path / "state"
+    manager = UpdateManager(str(game_dir), "http://manifest", MockAria2(), fetcher=mock_fetcher, resolver=mock_resolver,
+                            state_dir=state)
+    assert manager.hash_cache.db_path == state / "hash_cache.db"
+    assert manager.planner.cost_model.store_path == state / "cost_model.json"
+    assert manager.engine.backend.store.store_path == state / "hash_tuning.json"
+    manager.hash_cache.close()
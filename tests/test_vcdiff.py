@@ -0,0 +1,264 @@
+import zlib
+import shutil
+import hashlib
+import threading
+import subprocess
+from pathlib import Path
+import pytest
+from vcdiff import (iter_windows, decode_file, VcdiffError, VcdiffUnsupported, CODE_TABLE, MAGIC,
+                    VCD_SOURCE, VCD_ADLER32, VCD_APPHEADER, ADD, RUN, COPY, NOOP)
+from patch import Patcher, CANCELLED, INPROCESS_MAX_BYTES
+
+def enc_int(n):
+    out = [n & 0x7F]
+    n >>= 7
+    while n:
+        out.append(0x80 | (n & 0x7F))
+        n >>= 7
+    return bytes(reversed(out))
+
+def window(target, ops, segment=None, adler=True, delta_indicator=0):
+    """Encodes one window from ("add", bytes), ("run", byte, n), ("copy", size, mode, addr_bytes)
+    and raw ("code", index, inst_bytes, data, addr_bytes) instructions."""
+    data, inst, addr = b"", b"", b""
+    for op in ops:
+        if op[0] == "add":
+            inst += bytes([1]) + enc_int(len(op[1]))
+            data += op[1]
+        elif op[0] == "run":
+            inst += bytes([0]) + enc_int(op[2])
+            data += bytes([op[1]])
+        elif op[0] == "copy":
+            inst += bytes([19 + 16 * op[2]]) + enc_int(op[1])
+            addr += op[3]
+        else:
+            inst += bytes([op[1]]) + op[2]
+            data += op[3]
+            addr += op[4]
+    indicator = (VCD_SOURCE if segment else 0) | (VCD_ADLER32 if adler else 0)
+    body = enc_int(len(target)) + bytes([delta_indicator]) + enc_int(len(data)) + enc_int(len(inst)) + enc_int(len(addr))
+    if adler:
+        body += zlib.adler32(target).to_bytes(4, "big")
+    body += data + inst + addr
+    head = bytes([indicator])
+    if segment:
+        head += enc_int(segment[0]) + enc_int(segment[1])
+    return head + enc_int(len(body)) + body
+
+def delta(*windows, appheader=b"xdelta3 app header"):
+    header = MAGIC + b"\x00" + bytes([VCD_APPHEADER])
+    return header + enc_int(len(appheader)) + appheader + b"".join(windows)
+
+SOURCE = b"The quick brown fox jumps over the lazy dog"
+# Deltas written by the real xdelta3 encoder; see fixtures/vcdiff/README.md
+FIXTURES = Path(__file__).parent / "fixtures" / "vcdiff"
+
+def decode(source, patch):
+    return b"".join(bytes(w) for w in iter_windows(source, patch))
+
+def test_code_table_matches_rfc_layout():
+    assert len(CODE_TABLE) == 256
+    assert CODE_TABLE[0] == (RUN, 0, 0, NOOP, 0, 0)
+    assert CODE_TABLE[18] == (ADD, 17, 0, NOOP, 0, 0)
+    assert CODE_TABLE[19] == (COPY, 0, 0, NOOP, 0, 0)
+    assert CODE_TABLE[162] == (COPY, 18, 8, NOOP, 0, 0)
+    assert CODE_TABLE[163] == (ADD, 1, 0, COPY, 4, 0)
+    assert CODE_TABLE[247] == (COPY, 4, 0, ADD, 1, 0)
+
+def test_add_copy_and_run_from_source():
+    target = b"The quick red fox jumps over the lazy dog!!!!"
+    patch = delta(window(target, [
+        ("copy", 10, 0, enc_int(0)),
+        ("add", b"red"),
+        ("copy", 28, 0, enc_int(15)),
+        ("run", ord("!"), 4),
+    ], segment=(len(SOURCE), 0)))
+    assert decode(SOURCE, patch) == target
+
+def test_overlapping_copy_within_target_replicates():
+    target = b"ab" * 6
+    # COPY in VCD_HERE mode: address = here - 2, i.e. the "ab" just added
+    patch = delta(window(target, [("add", b"ab"), ("copy", 10, 1, enc_int(2))]))
+    assert decode(b"", patch) == target
+
+def test_near_and_same_address_modes():
+    source = b"0123456789ABCDEF"
+    # SELF 5 fills near[0]=5 and same[5]; near[0]+3 = 8; same[5] = 5
+    target = b"56789" + b"89ABC" + b"56789"
+    patch = delta(window(target, [
+        ("copy", 5, 0, enc_int(5)),
+        ("copy", 5, 2, enc_int(3)),
+        ("copy", 5, 6, bytes([5])),
+    ], segment=(len(source), 0)))
+    assert decode(source, patch) == target
+
+def test_combined_add_copy_opcode():
+    # Code 163 is ADD size 1 then COPY size 4 in SELF mode
+    target = b"X" + SOURCE[4:8]
+    patch = delta(window(target, [("code", 163, b"", b"X", enc_int(4))], segment=(len(SOURCE), 0)))
+    assert decode(SOURCE, patch) == target
+
+def test_copy_address_is_relative_to_segment_position():
+    # The window's source segment starts at byte 10; address 0 refers to it
+    patch = delta(window(b"brown", [("copy", 5, 0, enc_int(0))], segment=(5, 10)))
+    assert decode(SOURCE, patch) == b"brown"
+
+def test_checksum_mismatch_is_detected():
+    patch = bytearray(delta(window(b"hello", [("add", b"hello")])))
+    patch[-1] ^= 0xFF  # Corrupt the added data
+    with pytest.raises(VcdiffError):
+        decode(b"", bytes(patch))
+
+def test_unsupported_features_raise_unsupported():
+    with pytest.raises(VcdiffUnsupported):
+        decode(b"", b"not a delta")
+    compressed = delta(window(b"hi", [("add", b"hi")], delta_indicator=0x01))
+    with pytest.raises(VcdiffUnsupported):
+        decode(b"", compressed)
+
+def test_decode_file_streams_windows_and_reports_progress(tmp_path):
+    source = tmp_path / "src"
+    source.write_bytes(SOURCE)
+    first, second = b"The quick ", b"lazy dog"
+    patch = tmp_path / "patch.vcdiff"
+    patch.write_bytes(delta(window(first, [("copy", 10, 0, enc_int(0))], segment=(10, 0)),
+                            window(second, [("copy", 8, 0, enc_int(0))], segment=(8, 35))))
+    windows, progress = [], []
+
+    written = decode_file(source, patch, tmp_path / "out", on_window=lambda w: windows.append(bytes(w)),
+                          progress=lambda done, total: progress.append((done, total)))
+
+    assert written == len(first + second)
+    assert (tmp_path / "out").read_bytes() == first + second
+    assert windows == [first, second]
+    assert progress[-1] == (patch.stat().st_size, patch.stat().st_size)
+    assert progress[0][0] < progress[1][0]
+
+def test_patcher_decodes_in_process_without_xdelta(tmp_path):
+    source = tmp_path / "game.package"
+    source.write_bytes(SOURCE)
+    target = b"The quick red fox"
+    patch = tmp_path / "game.package.delta"
+    patch.write_bytes(delta(window(target, [("copy", 10, 0, enc_int(0)), ("add", b"red"), ("copy", 4, 0, enc_int(15))],
+                                   segment=(len(SOURCE), 0))))
+    patcher = Patcher(xdelta_exe=str(tmp_path / "missing-xdelta3"))
+    patcher.verify_hash = None  # The digest comes from the decoded windows
+    progress = []
+
+    success, message = patcher.apply_patch_safe(str(source), str(patch), hashlib.md5(target).hexdigest(),
+                                                progress=lambda done, total: progress.append(done))
+
+    assert success is True, message
+    assert source.read_bytes() == target
+    assert progress
+
+def test_patcher_falls_back_to_xdelta_for_unsupported_deltas(tmp_path):
+    script = tmp_path / "fake_xdelta.sh"
+    script.write_text('#!/bin/sh\ncat "$4" "$5"\n')
+    script.chmod(0o755)
+    source = tmp_path / "f"
+    source.write_bytes(b"old")
+    patch = tmp_path / "f.delta"
+    patch.write_bytes(delta(window(b"hi", [("add", b"hi")], delta_indicator=0x01)))
+    expected = b"old" + patch.read_bytes()
+
+    auto = Patcher(xdelta_exe=str(script))
+    assert auto.apply_patch_safe(str(source), str(patch), hashlib.md5(expected).hexdigest()) == (True, "Success")
+
+    source.write_bytes(b"old")
+    strict = Patcher(xdelta_exe=str(script), decoder="vcdiff")
+    success, message = strict.apply_patch_safe(str(source), str(patch), hashlib.md5(expected).hexdigest())
+    assert success is False and "Secondary compression" in message
+    assert source.read_bytes() == b"old"
+
+def test_in_process_decode_can_be_cancelled(tmp_path):
+    source = tmp_path / "f"
+    source.write_bytes(SOURCE)
+    patch = tmp_path / "f.delta"
+    patch.write_bytes(delta(window(b"x", [("add", b"x")])))
+    cancel = threading.Event()
+    cancel.set()
+
+    result = Patcher(decoder="vcdiff").apply_patch_safe(str(source), str(patch), "ANY", cancel=cancel)
+
+    assert result == (False, CANCELLED)
+    assert source.read_bytes() == SOURCE
+    assert not (tmp_path / "f.tmp").exists()
+
+def test_unknown_decoder_is_rejected():
+    with pytest.raises(ValueError):
+        Patcher(decoder="bsdiff")
+
+def test_real_xdelta3_delta_decodes_in_process(tmp_path):
+    out = tmp_path / "out"
+    progress = []
+
+    written = decode_file(FIXTURES / "source.bin", FIXTURES / "plain.vcdiff", out,
+                          progress=lambda done, total: progress.append(done))
+
+    assert out.read_bytes() == (FIXTURES / "target.bin").read_bytes()
+    assert written == (FIXTURES / "target.bin").stat().st_size
+    assert len(progress) == 2  # -W 16384 split the target into two windows
+
+@pytest.mark.parametrize("name, reason", [
+    ("djw.vcdiff", "Secondary compression"),
+    ("gzip-apphead.vcdiff", r"External compression \(G\)"),
+])
+def test_real_xdelta3_deltas_needing_the_executable_are_unsupported(tmp_path, name, reason):
+    with pytest.raises(VcdiffUnsupported, match=reason):
+        decode_file(FIXTURES / "source.bin", FIXTURES / name, tmp_path / "out")
+
+@pytest.mark.parametrize("name", ["djw.vcdiff", "gzip-apphead.vcdiff"])
+def test_patcher_hands_unsupported_real_deltas_to_xdelta(tmp_path, name):
+    calls = tmp_path / "calls"
+    script = tmp_path / "fake_xdelta.sh"
+    # Stands in for xdelta3 -d -c -s <source> <delta>: records the call, prints the target
+    script.write_text(f'#!/bin/sh\necho "$@" >> "{calls}"\ncat "{FIXTURES / "target.bin"}"\n')
+    script.chmod(0o755)
+    source = tmp_path / "source.bin"
+    shutil.copyfile(FIXTURES / "source.bin", source)
+    patch = tmp_path / name
+    shutil.copyfile(FIXTURES / name, patch)
+    target = (FIXTURES / "target.bin").read_bytes()
+
+    success, message = Patcher(xdelta_exe=str(script)).apply_patch_safe(str(source), str(patch),
+                                                                         hashlib.md5(target).hexdigest())
+
+    assert success is True, message
+    assert source.read_bytes() == target
+    assert calls.read_text().split()[:2] == ["-d", "-c"]
+    assert not (tmp_path / "source.bin.tmp").exists()
+
+@pytest.mark.skipif(shutil.which("xdelta3") is None, reason="xdelta3 is not installed")
+@pytest.mark.parametrize("name", ["plain.vcdiff", "djw.vcdiff"])
+def test_fixtures_match_the_installed_xdelta3(tmp_path, name):
+    out = tmp_path / "out"
+    subprocess.run(["xdelta3", "-d", "-f", "-s", str(FIXTURES / "source.bin"), str(FIXTURES / name), str(out)],
+                   check=True)
+    assert out.read_bytes() == (FIXTURES / "target.bin").read_bytes()
+
+def test_auto_mode_routes_on_the_expected_target_size(tmp_path):
+    calls = tmp_path / "calls"
+    script = tmp_path / "fake_xdelta.sh"
+    script.write_text(f'#!/bin/sh\necho "$@" >> "{calls}"\ncat "{FIXTURES / "target.bin"}"\n')
+    script.chmod(0o755)
+    source = tmp_path / "source.bin"
+    patch = tmp_path / "plain.vcdiff"
+    shutil.copyfile(FIXTURES / "plain.vcdiff", patch)
+    target = (FIXTURES / "target.bin").read_bytes()
+    patcher = Patcher(xdelta_exe=str(script))
+
+    def apply(**kwargs):
+        shutil.copyfile(FIXTURES / "source.bin", source)
+        success, message = patcher.apply_patch_safe(str(source), str(patch), hashlib.md5(target).hexdigest(), **kwargs)
+        assert success is True, message
+        assert source.read_bytes() == target
+        return calls.read_text().count("\n") if calls.exists() else 0
+
+    # A small delta for a large file goes to xdelta3
+    assert apply(target_size=len(target)) == 0
+    assert apply(target_size=INPROCESS_MAX_BYTES + 1) == 1
+    # Without a target size, source plus delta size decides
+    assert apply() == 1
+    patcher.inprocess_max_bytes = (FIXTURES / "source.bin").stat().st_size
+    assert apply() == 2
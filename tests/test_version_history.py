@@ -50,8 +50,7 @@ def test_fetch_versioned_manifest_non_json_url(httpx_mock):
     data = fetcher.fetch_manifest_json(version=target_version)
     assert data["v"] == target_version
 
-def test_update_manager_handles_legacy_version(tmp_path):
-    from update_logic import UpdateManager
+def test_update_manager_handles_legacy_version(tmp_path, update_manager):
     from unittest.mock import MagicMock
     
     game_dir = tmp_path / "game"
@@ -70,7 +69,7 @@ def test_update_manager_handles_legacy_version(tmp_path):
     mock_fetcher = MagicMock()
     mock_fetcher.fetch_manifest_json.return_value = manifest
     
-    manager = UpdateManager(str(game_dir), "http://mock", MagicMock(), fetcher=mock_fetcher)
+    manager = update_manager(game_dir, "http://mock", MagicMock(), fetcher=mock_fetcher)
     
     # Target the legacy version specifically
     ops = manager.get_operations(target_version="1.119.0")
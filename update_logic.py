@@ -8,13 +8,25 @@ Provides:
 
 import os
 import json
+import time
+import threading
+import httpx
 from pathlib import Path
 from typing import Optional, List, Set
 from engine import ManifestParser, VerificationEngine, Version, DLCGraph
 from download import DownloadQueue
+from bandwidth import DEFAULT_PRIORITY, priority_for
 from patch import Patcher
 from manifest import ManifestFetcher, URLResolver
 from janitor import OperationLogger, RecoveryOrchestrator
+from hash_cache import HashCache
+from hash_backends import TuningStore, make_backend
+from repair import RangeRepairer
+from pipeline import PatchPipeline, SKIPPED
+from bundle import BundleError, entry_matches, open_bundle
+from planner import CostModel, UpdatePlanner
+from space import SPACE_RESERVE, SpaceScheduler, footprint, volumes_for
+from progress import ProgressAggregator
 from paths import get_app_data_path
 from logging_system import get_logger
 
@@ -24,31 +36,79 @@ from content_db import EXPANSIONS, STUFF_PACKS, COMMUNITY_CONTENT
 logger = get_logger()
 
 class UpdateManager:
-    def __init__(self, game_dir, manifest_url, aria2_manager, fetcher=None, resolver=None):
+    def __init__(self, game_dir, manifest_url, aria2_manager, fetcher=None, resolver=None, hash_backend="adaptive",
+                 journal=None, content_store=None, planner=None, hash_cache=None,
+                 tuning_store=None, state_dir=None):
         self.game_dir = Path(game_dir)
         self.fetcher = fetcher or ManifestFetcher(manifest_url)
         self.resolver = resolver or URLResolver()
         self.parser = None # Will be initialized after fetching manifest
-        self.engine = VerificationEngine()
+        app_data = get_app_data_path()
+        # state_dir: where the hash cache, planner cost model and hashing tuning
+        # persist between runs (the sidecar passes app data); None keeps them in memory
+        state_dir = Path(state_dir) if state_dir else None
+        # Digests keyed by path, size and mtime
+        self.hash_cache = hash_cache or HashCache(state_dir / "hash_cache.db" if state_dir else None)
+        # tuning_store: where the adaptive hashing backend keeps per-device settings
+        if tuning_store is None and state_dir:
+            tuning_store = TuningStore(state_dir / "hash_tuning.json")
+        self.engine = VerificationEngine(cache=self.hash_cache,
+                                         backend=make_backend(hash_backend, self.game_dir, store=tuning_store))
         self.queue = DownloadQueue(aria2_manager)
-        self.patcher = Patcher()
+        # Patch files get their own small queue so they overlap with full downloads
+        self.patch_pipeline = PatchPipeline(DownloadQueue(aria2_manager, max_concurrent=2))
+        self.patcher = Patcher(hash_cache=self.hash_cache)
+        self.repairer = RangeRepairer(self.engine)
         self.graph = DLCGraph()
+        # Range repair is only attempted for files at least this large, and only
+        # when the corrupt ranges are at most this fraction of the file
+        self.repair_min_size = 16 * 1024 * 1024
+        self.repair_max_fraction = 0.5
+        # Seconds between aggregated download progress reports
+        self.progress_interval = 0.5
+        # Optional ChangeJournal kept up to date by a watcher (see change_journal)
+        self.journal = journal
+        # Optional ContentStore shared with other installs: consulted before
+        # downloading, and fed with every verified download
+        self.content_store = content_store
+        # Chooses between delta chains and full downloads from measured throughput
+        self.planner = planner or UpdatePlanner(CostModel(state_dir / "cost_model.json" if state_dir else None))
+        # Extra disk bytes operations may hold at once on any one filesystem
+        # (None: its free space), and free space never used
+        self.space_budget = None
+        self.space_reserve = SPACE_RESERVE
         
         # Professional Alignment: Resilience Components
-        app_data = get_app_data_path()
         self.op_logger = OperationLogger(app_data / "operations.json")
         self.recovery = RecoveryOrchestrator(self.game_dir)
         self.lock_file = self.game_dir / "update.lock"
+        # Downloaders that can resume persist their progress in the operation journal
+        if getattr(aria2_manager, 'resume_store', False) is None:
+            aria2_manager.resume_store = self.op_logger
 
     def check_interrupted(self) -> bool:
         """Checks if a previous update session was interrupted."""
         return self.lock_file.exists()
 
-    def get_operations(self, progress_callback=None, target_version: Optional[str] = None, selected_packs: Optional[List[str]] = None, target_language: str = "en_US"):
+    VERIFY_LEVELS = ("full", "quick", "incremental")
+
+    def get_operations(self, progress_callback=None, target_version: Optional[str] = None, selected_packs: Optional[List[str]] = None, target_language: str = "en_US", verify_level: str = "full"):
         """
         Analyzes local files against manifest and returns list of operations.
         Filtering logic included for selective DLC installation.
+
+        verify_level "quick" checks sizes and a sample of blocks first and only
+        fully hashes files that look wrong; every operation then carries a
+        'confidence' of 'verified', 'sampled', 'size' or 'none'.
+
+        verify_level "incremental" uses the change journal to hash only paths
+        changed since the last verification plus a rolling audit sample, reusing
+        the recorded digests of everything else. Without a journal, or when the
+        journal cannot vouch for the tree, it behaves like "full".
         """
+        if verify_level not in self.VERIFY_LEVELS:
+            raise ValueError(f"Unknown verify level: {verify_level}")
+
         # Fetch manifest first
         try:
             if progress_callback:
@@ -130,6 +190,8 @@ class UpdateManager:
             filtered_patches.append(p)
 
         operations = []
+        # Full downloads that might be repaired by range instead, decided once all are known
+        repairs = []
         
         # 3. Identify files to check
         file_paths = [os.path.join(self.game_dir, p['name']) for p in filtered_patches]
@@ -137,104 +199,583 @@ class UpdateManager:
         # 4. Hash existing files
         existing_files = [p for p in file_paths if os.path.exists(p)]
         
-        if progress_callback:
-            local_hashes = {}
-            for i, p in enumerate(existing_files):
-                local_hashes[p] = self.engine.hash_file(p)
-                progress_callback({
-                    'status': 'hashing',
-                    'current': i + 1,
-                    'total': len(existing_files),
-                    'file': os.path.basename(p)
-                })
+        # The manifest's hash_type drives verification; legacy MD5-only entries
+        # are hashed in the same pass while the manifest migrates
+        hash_type = self.parser.get_hash_type()
+        targets = {p['name']: self.parser.get_target_hash(p) for p in filtered_patches}
+        sources = {p['name']: self.parser.get_source_hash(p) for p in filtered_patches}
+        entry_algorithms = {a for a, _ in targets.values()} | {a for a, _ in sources.values() if a}
+        self.engine.set_algorithms(hash_type, sorted(entry_algorithms - {hash_type}))
+
+        local_hashes = {}
+        confidence = {}
+        assumed_current = set()
+        # Taken before any file is read, so changes made while hashing stay dirty
+        journal_snapshot = self.journal.snapshot() if self.journal is not None else None
+        if verify_level == "quick":
+            files_to_hash = []
+            by_path = {os.path.join(self.game_dir, p['name']): p for p in filtered_patches}
+            if progress_callback:
+                progress_callback({'status': 'quick_verifying', 'total': len(existing_files)})
+            quick_results = self.engine.quick_verify_files(
+                {
+                    'path': path,
+                    'size': by_path[path].get('size'),
+                    'block_map': self.parser.get_block_map(by_path[path]),
+                    'hash': targets[by_path[path]['name']][1]
+                }
+                for path in existing_files
+            )
+            for path, result in quick_results.items():
+                if result['suspicious']:
+                    files_to_hash.append(path)
+                else:
+                    # Plausibly at the target version; use the exact hash when the cache had it
+                    if result['hash']:
+                        local_hashes[path] = result['hash']
+                    else:
+                        assumed_current.add(path)
+                    confidence[path] = result['confidence']
+        elif verify_level == "incremental" and self.journal is not None:
+            files_to_hash, reused = self.journal.plan(existing_files, hash_type)
+            local_hashes.update(reused)
         else:
-            local_hashes = self.engine.verify_files(existing_files)
+            files_to_hash = existing_files
+
+        if progress_callback:
+            progress_callback({'status': 'hashing', 'current': 0, 'total': len(files_to_hash)})
+        local_hashes.update(self.engine.verify_files(files_to_hash, progress_callback=progress_callback))
+        if verify_level != "quick" and journal_snapshot is not None:
+            self.journal.mark_verified(journal_snapshot, local_hashes, hash_type)
+
+        def local_hash(path, algorithm):
+            if path not in local_hashes:
+                return None
+            if algorithm == hash_type:
+                return local_hashes[path]
+            # Computed alongside the primary digest, so this is a cache hit
+            return self.engine.hash_file(path, algorithm=algorithm)
         
         for patch_info in filtered_patches:
             rel_path = patch_info['name']
             full_path = os.path.join(self.game_dir, rel_path)
-            target_md5 = patch_info['MD5_to']
+            target_type, target_md5 = targets[rel_path]
             patch_type = patch_info['type']
             
-            current_hash = local_hashes.get(full_path)
+            current_hash = local_hash(full_path, target_type)
             
-            if current_hash == target_md5:
+            if full_path in assumed_current or current_hash == target_md5:
                 operations.append({'type': 'nothing', 'file': rel_path, 'reason': 'Up to date'})
                 continue
                 
-            if patch_type == 'full':
+            edges = self.parser.get_delta_edges(patch_info)
+            if not edges and patch_type == 'full':
                 download_url = self.resolver.resolve_url(patch_info['url'])
-                operations.append({'type': 'download_full', 'file': rel_path, 'target_md5': target_md5, 'url': download_url})
-            elif patch_type == 'delta':
-                source_md5 = patch_info.get('MD5_from')
-                if current_hash == source_md5:
-                    patch_url = self.resolver.resolve_url(patch_info['patch_url'])
-                    operations.append({'type': 'patch_delta', 'file': rel_path, 'source_md5': source_md5, 'target_md5': target_md5, 'patch_url': patch_url})
+                op = self._plan_from_store(patch_info, download_url)
+                if op is None:
+                    repairs.append((len(operations), patch_info, full_path, download_url, current_hash))
+                    op = {'type': 'download_full', 'file': rel_path, 'target_md5': target_md5,
+                          'hash_type': target_type, 'url': download_url, 'priority': priority_for(patch_info)}
+                operations.append(op)
+            elif edges or patch_type == 'delta':
+                # Every hash the local file has in an algorithm some delta starts from
+                start = set()
+                for algorithm in {edge['from'][0] for edge in edges}:
+                    digest = local_hash(full_path, algorithm)
+                    if digest:
+                        start.add((algorithm, digest))
+                try:
+                    file_size = os.path.getsize(full_path)
+                except OSError:
+                    file_size = None
+                plan = self.planner.plan(start, (target_type, target_md5), edges, full_size=patch_info.get('size'),
+                                         file_size=file_size, full_available=bool(patch_info.get('url')))
+                explanation = {
+                    'strategy': plan['strategy'], 'hops': len(plan['hops']), 'cost': plan['cost'],
+                    'download_bytes': plan['download_bytes'], 'alternatives': plan['alternatives'],
+                    'reason': plan['reason']
+                }
+                if plan['strategy'] == 'delta':
+                    operations.append(self._plan_delta(patch_info, plan['hops'], explanation))
                 else:
                     download_url = self.resolver.resolve_url(patch_info['url'])
-                    operations.append({'type': 'download_full', 'file': rel_path, 'reason': 'Source hash mismatch for delta', 'url': download_url})
+                    op = self._plan_from_store(patch_info, download_url)
+                    if op is None:
+                        repairs.append((len(operations), patch_info, full_path, download_url, current_hash))
+                        op = {'type': 'download_full', 'file': rel_path, 'target_md5': target_md5,
+                              'hash_type': target_type, 'reason': plan['reason'], 'url': download_url,
+                              'priority': priority_for(patch_info)}
+                    op['plan'] = explanation
+                    operations.append(op)
+
+        self._plan_repairs(operations, repairs)
+
+        # Single deltas can be streamed from the manifest's patch bundle, if it has one
+        bundle_url = self.parser.get_patch_bundle()
+        if bundle_url:
+            bundle_url = self.resolver.resolve_url(bundle_url)
+            for op in operations:
+                if op['type'] == 'patch_delta' and not op.get('chain'):
+                    op['bundle_url'] = bundle_url
+
+        # Real file sizes drive space estimates and scheduling
+        sizes = {p['name']: p.get('size') for p in filtered_patches}
+        for op in operations:
+            if op['type'] != 'nothing' and sizes.get(op['file']) is not None:
+                op.setdefault('size', sizes[op['file']])
+
+        if verify_level == "quick":
+            for op in operations:
+                op['confidence'] = confidence.get(os.path.join(self.game_dir, op['file']), 'verified')
                     
         return operations
 
+    def _plan_delta(self, patch_info, hops, explanation) -> dict:
+        """
+        Returns a 'patch_delta' operation applying hops (planner edges) in order.
+
+        The operation describes the first hop like a single delta; chains of
+        more than one hop also list every hop under 'chain'.
+        """
+        target_type, target_md5 = self.parser.get_target_hash(patch_info)
+        steps = [{
+            'source_md5': hop['from'][1],
+            'target_md5': hop['to'][1],
+            'hash_type': hop['to'][0],
+            'patch_url': self.resolver.resolve_url(hop['patch_url']),
+            'patch_size': hop['size']
+        } for hop in hops]
+        op = {'type': 'patch_delta', 'file': patch_info['name'], 'source_md5': steps[0]['source_md5'],
+              'target_md5': target_md5, 'hash_type': target_type, 'patch_url': steps[0]['patch_url'],
+              'reason': explanation['reason'], 'plan': explanation}
+        if all(step['patch_size'] is not None for step in steps):
+            op['patch_size'] = sum(step['patch_size'] for step in steps)
+        if len(steps) > 1:
+            op['chain'] = steps
+        return op
+
+    def _plan_from_store(self, patch_info, download_url) -> Optional[dict]:
+        """
+        Returns a 'copy_from_store' operation if the content store already
+        holds the target version of the file, otherwise None.
+        """
+        if self.content_store is None:
+            return None
+        target_type, target_md5 = self.parser.get_target_hash(patch_info)
+        if self.content_store.lookup(target_md5, target_type) is None:
+            return None
+        return {
+            'type': 'copy_from_store',
+            'file': patch_info['name'],
+            'target_md5': target_md5,
+            'hash_type': target_type,
+            'url': download_url,
+            'priority': priority_for(patch_info)
+        }
+
+    def _plan_repairs(self, operations, candidates):
+        """
+        Replaces full downloads with 'repair_blocks' operations where a
+        corrupted local file can be fixed by range.
+
+        candidates holds (operation index, patch_info, full_path, download_url,
+        current_hash). Block hashes come from the manifest entry, or from a
+        '.blockmap' file published next to the payload; those are fetched
+        concurrently, and only for files large enough to repair.
+        """
+        candidates = [c for c in candidates if c[4] is not None and self._repair_size_ok(c[2])]
+        remote = self.repairer.fetch_block_maps(
+            [url for _, patch_info, _, url, _ in candidates if not self.parser.get_block_map(patch_info)]
+        )
+        for index, patch_info, full_path, download_url, current_hash in candidates:
+            block_map = self.parser.get_block_map(patch_info) or remote.get(download_url)
+            repair = self._plan_repair(patch_info, full_path, download_url, block_map)
+            if repair is not None:
+                if 'plan' in operations[index]:
+                    repair['plan'] = operations[index]['plan']
+                operations[index] = repair
+
+    def _repair_size_ok(self, full_path) -> bool:
+        try:
+            return os.path.getsize(full_path) >= self.repair_min_size
+        except OSError:
+            return False
+
+    def _plan_repair(self, patch_info, full_path, download_url, block_map) -> Optional[dict]:
+        """
+        Returns a 'repair_blocks' operation if the corrupted local file can be
+        fixed by fetching only the blocks that do not match block_map,
+        otherwise None.
+        """
+        if not block_map:
+            return None
+        try:
+            report = self.engine.verify_blocks(
+                full_path, block_map['block_size'], block_map['hashes'], expected_size=patch_info.get('size')
+            )
+        except OSError as e:
+            logger.warning(f"Block verification of {full_path} failed, falling back to full download: {e}")
+            return None
+
+        target_type, target_md5 = self.parser.get_target_hash(patch_info)
+
+        # All blocks matching a mismatched whole-file hash means the block map is stale
+        if report['valid']:
+            return None
+        repair_bytes = sum(end - start for start, end in report['bad_ranges'])
+        if repair_bytes > report['expected_size'] * self.repair_max_fraction:
+            return None
+
+        return {
+            'type': 'repair_blocks',
+            'file': patch_info['name'],
+            'target_md5': target_md5,
+            'hash_type': target_type,
+            'url': download_url,
+            'bad_ranges': report['bad_ranges'],
+            'block_map': block_map,
+            'expected_size': report['expected_size'],
+            'repair_bytes': repair_bytes,
+            'priority': priority_for(patch_info)
+        }
+
     def apply_operations(self, operations, progress_callback=None):
         """
         Executes the provided operations with resilience (lock file + logging).
+
+        Full downloads, patch-file downloads and patching overlap, so the
+        session takes about as long as the slower of network and patching.
+
+        Operations are first split into batches (see plan_space) so that the
+        temporary copies they write never need more space than the disk has;
+        usually everything fits in one batch.
         """
+        if progress_callback:
+            # Progress arrives from the download and patch stages at once
+            progress_lock = threading.Lock()
+            user_callback = progress_callback
+
+            def progress_callback(p):
+                with progress_lock:
+                    user_callback(p)
+
+        # Refuse up front, before anything is touched, if some file cannot fit
+        plan = self.plan_space(operations)
+        if plan['unschedulable']:
+            files = ", ".join(op['file'] for op in plan['unschedulable'])
+            return False, f"Not enough disk space for: {files}"
+
         # Create session lock
         self.lock_file.touch()
+        # Keep partial-download state so interrupted transfers resume
+        self.op_logger.clear_log(keep_resume=True)
+
+        batches = plan['batches']
+        if len(batches) > 1:
+            logger.info(f"Running {len(operations)} operations in {len(batches)} batches to stay within disk space")
+        for n, batch in enumerate(batches):
+            if progress_callback and len(batches) > 1:
+                progress_callback({'status': 'batch', 'current': n + 1, 'total': len(batches)})
+            # Journal ids of later batches are prefixed so they do not replace earlier entries
+            success, message = self._apply_batch(batch, progress_callback, prefix=f"b{n}_" if n else "")
+            if not success:
+                return False, message
+
+        # Successful completion: cleanup
+        if self.lock_file.exists():
+            self.lock_file.unlink()
         self.op_logger.clear_log()
 
-        # 1. Handle full downloads
+        return True, "All operations completed successfully"
+
+    def plan_space(self, operations) -> dict:
+        """
+        Batches operations so their peak extra disk usage fits each filesystem.
+
+        Budgets are the free space on the game directory's and the content
+        store's filesystems less space_reserve, capped at space_budget when set.
+
+        Returns:
+            dict: SpaceScheduler.schedule result
+        """
+        paths = {'game': self.game_dir, 'patches': self.game_dir}
+        if self.content_store is not None:
+            paths['store'] = self.content_store.root
+        volumes, budgets = volumes_for(paths, reserve=self.space_reserve, max_extra=self.space_budget)
+        deposits = self.content_store is not None
+
+        def footprint_of(op):
+            try:
+                local_size = os.path.getsize(os.path.join(self.game_dir, op['file']))
+            except (OSError, KeyError):
+                local_size = 0
+            return footprint(op, local_size, deposits=deposits)
+
+        return SpaceScheduler(budgets, volumes).schedule(operations, footprint_of)
+
+    def _apply_batch(self, operations, progress_callback=None, prefix=""):
+        """
+        Runs one batch of operations; see apply_operations.
+
+        Returns:
+            (success, message)
+        """
         download_tasks = [op for op in operations if op['type'] == 'download_full']
-        if download_tasks:
-            self.queue.clear()
-            for i, task in enumerate(download_tasks):
-                url = task['url']
-                self.queue.add_task(url, self.game_dir, filename=task['file'])
-                self.op_logger.log_operation(f"dl_{i}", task)
-            
-            def dl_callback(p):
+
+        # 0. Copy files the content store already holds; anything it no longer
+        # has (evicted by another install) falls back to a full download
+        copy_tasks = [op for op in operations if op['type'] == 'copy_from_store']
+        for i, task in enumerate(copy_tasks):
+            self.op_logger.log_operation(f"{prefix}copy_{i}", task)
+            full_path = os.path.join(self.game_dir, task['file'])
+            hash_type = task.get('hash_type', 'md5')
+            method = None
+            if self.content_store is not None:
+                method = self.content_store.materialize(task['target_md5'], full_path, hash_type)
+            if method:
+                self.op_logger.update_status(f"{prefix}copy_{i}", "completed")
+                # materialize hashed the copy against the target digest before placing it
+                self.engine.record_hash(full_path, task['target_md5'], hash_type)
                 if progress_callback:
-                    progress_callback({'status': 'downloading', **p})
+                    progress_callback({'status': 'copying', 'current': i + 1, 'total': len(copy_tasks),
+                                       'file': task['file'], 'method': method})
+            else:
+                logger.warning(f"{task['file']} is no longer in the content store, downloading it")
+                self.op_logger.update_status(f"{prefix}copy_{i}", "failed")
+                download_tasks.append({
+                    'type': 'download_full', 'file': task['file'], 'target_md5': task['target_md5'],
+                    'hash_type': hash_type, 'url': task['url'],
+                    'priority': task.get('priority', DEFAULT_PRIORITY)
+                })
 
-            success = self.queue.process_all(callback=dl_callback)
-            if not success:
-                return False, "Some downloads failed"
-            
-            # Mark all downloads as completed in log
-            for i in range(len(download_tasks)):
-                self.op_logger.update_status(f"dl_{i}", "completed")
+        # 1. Repair corrupted files by range; anything that cannot be repaired
+        # falls back to a full download
+        repair_tasks = [op for op in operations if op['type'] == 'repair_blocks']
+        for i, task in enumerate(repair_tasks):
+            self.op_logger.log_operation(f"{prefix}repair_{i}", task)
+            success, message = self.repairer.repair(
+                os.path.join(self.game_dir, task['file']),
+                task['url'],
+                task['bad_ranges'],
+                task['block_map'],
+                task['target_md5'],
+                task['expected_size'],
+                progress_callback=progress_callback,
+                hash_type=task.get('hash_type', 'md5')
+            )
+            if success:
+                self.op_logger.update_status(f"{prefix}repair_{i}", "completed")
+            else:
+                logger.warning(f"Repair of {task['file']} failed ({message}), downloading in full")
+                self.op_logger.update_status(f"{prefix}repair_{i}", "failed")
+                download_tasks.append({
+                    'type': 'download_full', 'file': task['file'], 'target_md5': task['target_md5'],
+                    'hash_type': task.get('hash_type', 'md5'), 'url': task['url'],
+                    'priority': task.get('priority', DEFAULT_PRIORITY)
+                })
 
-        # 2. Handle patches
+        # 2. Full downloads run in the background while the delta pipeline
+        # (3.) fetches patch files and applies each as soon as it lands
         patch_tasks = [op for op in operations if op['type'] == 'patch_delta']
-        for i, task in enumerate(patch_tasks):
-            rel_path = task['file']
-            full_path = os.path.join(self.game_dir, rel_path)
-            self.op_logger.log_operation(f"patch_{i}", task)
-            
-            # In a real scenario, patch_file would be downloaded to a temp dir
-            patch_file = os.path.join(self.game_dir, rel_path + ".delta") 
-            
+        # Both download stages report into one aggregated, rate-limited stream
+        measured = {'speed': 0.0, 'bytes': 0}
+
+        def publish_downloads(snapshot):
+            # The smoothed rate while transfers are running feeds the planner
+            if snapshot['active']:
+                measured['speed'] = snapshot['speed']
+            measured['bytes'] = snapshot['current']
             if progress_callback:
-                progress_callback({
-                    'status': 'patching',
-                    'current': i + 1,
-                    'total': len(patch_tasks),
-                    'file': rel_path
-                })
+                progress_callback({'status': 'downloading', **snapshot})
 
-            success, message = self.patcher.apply_patch_safe(full_path, patch_file, task['target_md5'])
-            if not success:
-                return False, f"Patching failed for {rel_path}: {message}"
-            
-            self.op_logger.update_status(f"patch_{i}", "completed")
+        aggregator = ProgressAggregator(publish_downloads, interval=self.progress_interval,
+                                        expected_files=len(download_tasks) + len(patch_tasks))
+        aggregator.start()
+        download_outcome = {'result': (True, None), 'error': None}
+        downloads = None
+        if download_tasks:
+            def run_downloads():
+                try:
+                    download_outcome['result'] = self._download_full(download_tasks, aggregator.ingest, prefix)
+                except Exception as e:
+                    download_outcome['error'] = e
 
-        # Successful completion: cleanup
-        if self.lock_file.exists():
-            self.lock_file.unlink()
-        self.op_logger.clear_log()
+            downloads = threading.Thread(target=run_downloads, name="full-downloads", daemon=True)
+            downloads.start()
 
-        return True, "All operations completed successfully"
+        patch_results = []
+        try:
+            # 3. Handle patches
+            if patch_tasks:
+                # Patches run in parallel; every one is journaled as pending up
+                # front and its outcome recorded in task order
+                self.op_logger.log_operations({f"{prefix}patch_{i}": task for i, task in enumerate(patch_tasks)})
+                cancel = threading.Event()
+
+                def apply_patch(i, task, patch_file=None, stream=None, size=None):
+                    rel_path = task['file']
+
+                    def report(done, total):
+                        if progress_callback:
+                            progress_callback({
+                                'status': 'patching',
+                                'current': i + 1,
+                                'total': len(patch_tasks),
+                                'file': rel_path,
+                                'percentage': round(done * 100 / total, 1) if total else 0
+                            })
+                    report(0, 0)
+                    full_path = os.path.join(self.game_dir, rel_path)
+                    try:
+                        source_bytes = os.path.getsize(full_path)
+                    except OSError:
+                        source_bytes = 0
+                    started = time.monotonic()
+                    # The in-process decoder reports per window; xdelta3 does not
+                    if stream is not None:
+                        success, message = self.patcher.apply_patch_stream(
+                            full_path, stream, task['target_md5'], task.get('hash_type', 'md5'), cancel=cancel,
+                            progress=report, size=size, target_size=task.get('size')
+                        )
+                    else:
+                        success, message = self.patcher.apply_patch_safe(
+                            full_path, patch_file,
+                            task['target_md5'], task.get('hash_type', 'md5'), cancel=cancel, progress=report,
+                            target_size=task.get('size')
+                        )
+                    if success:
+                        self.planner.cost_model.observe_patch(source_bytes, time.monotonic() - started)
+                    return success, message
+
+                def commit_patch(i, task, result):
+                    # Tasks that never ran stay pending for the next session
+                    if result['success']:
+                        self.op_logger.update_status(f"{prefix}patch_{i}", "completed")
+                    elif not result['cancelled']:
+                        self.op_logger.update_status(f"{prefix}patch_{i}", "failed")
+
+                # Deltas in a patch bundle are streamed straight into the decoder;
+                # the rest (or all, if a bundle cannot be read) are fetched one by one
+                results = self._apply_bundled(patch_tasks, apply_patch, commit_patch, cancel, aggregator.ingest)
+                remaining = [i for i in range(len(patch_tasks)) if i not in results]
+                if remaining and cancel.is_set():
+                    for i in remaining:
+                        results[i] = {'file': patch_tasks[i]['file'], 'success': False, 'error': SKIPPED,
+                                      'cancelled': True}
+                elif remaining:
+                    pipeline_results = self.patch_pipeline.run(
+                        [patch_tasks[i] for i in remaining], self.game_dir,
+                        lambda j, task, patch_file: apply_patch(remaining[j], task, patch_file),
+                        callback=aggregator.ingest,
+                        commit=lambda j, task, result: commit_patch(remaining[j], task, result),
+                        cancel=cancel
+                    )
+                    results.update(zip(remaining, pipeline_results))
+                patch_results = [results[i] for i in range(len(patch_tasks))]
+        finally:
+            if downloads is not None:
+                downloads.join()
+            aggregator.stop()
+            self.planner.cost_model.observe_throughput(measured['speed'], measured['bytes'])
+            self.planner.cost_model.save()
+
+        if download_outcome['error'] is not None:
+            raise download_outcome['error']
+        success, message = download_outcome['result']
+        if not success:
+            return False, message
+        failures = [result for result in patch_results if not result['success']]
+        if failures:
+            # Report the failure that cancelled the others, not one of its casualties
+            result = next((r for r in failures if not r['cancelled']), failures[0])
+            return False, f"Patching failed for {result['file']}: {result['error']}"
+        return True, None
+
+    def _apply_bundled(self, patch_tasks, apply_patch, commit_patch, cancel, callback=None) -> dict:
+        """
+        Reads each patch bundle named by patch_tasks once, front to back, and
+        applies every member that matches a task as it streams past.
+
+        A failed patch sets cancel and stops. A bundle that cannot be read
+        (missing, malformed, connection dropped) only leaves its unapplied tasks
+        for the per-file patch pipeline.
+
+        Returns:
+            dict: task index -> result, for the tasks applied from a bundle
+        """
+        results = {}
+        by_bundle = {}
+        for i, task in enumerate(patch_tasks):
+            if task.get('bundle_url') and not task.get('chain'):
+                by_bundle.setdefault(task['bundle_url'], []).append(i)
+
+        for url, wanted in by_bundle.items():
+            if cancel.is_set():
+                break
+            try:
+                with open_bundle(url, callback=callback) as bundle:
+                    for entry, stream in bundle:
+                        i = next((i for i in wanted if i not in results and entry_matches(entry, patch_tasks[i])),
+                                 None)
+                        if i is None:
+                            continue
+                        success, message = apply_patch(i, patch_tasks[i], stream=stream, size=entry.get('size'))
+                        results[i] = {'file': patch_tasks[i]['file'], 'success': success,
+                                      'error': None if success else message, 'cancelled': False}
+                        commit_patch(i, patch_tasks[i], results[i])
+                        if not success:
+                            cancel.set()
+                            return results
+                        if all(j in results for j in wanted):
+                            break
+            except (BundleError, OSError, httpx.HTTPError) as e:
+                logger.warning(f"Patch bundle {url} failed ({e}); fetching its remaining patches individually")
+            else:
+                missing = [i for i in wanted if i not in results]
+                if missing:
+                    logger.info(f"{len(missing)} patch(es) not found in bundle {url}; fetching them individually")
+        return results
+
+    def _download_full(self, download_tasks, download_callback=None, prefix=""):
+        """
+        Downloads whole files through the queue and records their verified hashes.
+
+        download_callback receives the queue's per-file progress events.
+
+        Returns:
+            (success, message); message is None on success
+        """
+        self.queue.clear()
+        for i, task in enumerate(download_tasks):
+            url = task['url']
+            self.queue.add_task(url, self.game_dir, filename=task['file'], checksum=task.get('target_md5'),
+                                checksum_type=task.get('hash_type', 'md5'),
+                                priority=task.get('priority', DEFAULT_PRIORITY))
+            self.op_logger.log_operation(f"{prefix}dl_{i}", task)
+        
+        report = self.queue.process_all(callback=download_callback)
+        if not report:
+            failed = [r['filename'] or r['url'] for r in getattr(report, 'failed', [])]
+            for i, result in enumerate(getattr(report, 'results', [])):
+                self.op_logger.update_status(f"{prefix}dl_{i}", "completed" if result['success'] else "failed")
+            return False, "Some downloads failed" + (f": {', '.join(failed)}" if failed else "")
+        
+        # Mark all downloads as completed in log; the downloader has already
+        # checked each file against its target hash, so record it without
+        # re-reading. Algorithms it cannot check are verified here instead.
+        for i, task in enumerate(download_tasks):
+            hash_type = task.get('hash_type', 'md5')
+            full_path = os.path.join(self.game_dir, task['file'])
+            if task.get('target_md5') and not self.queue.verifies_checksum(hash_type):
+                if self.engine.hash_file(full_path, algorithm=hash_type) != task['target_md5']:
+                    self.op_logger.update_status(f"{prefix}dl_{i}", "failed")
+                    return False, f"{hash_type.upper()} verification failed for {task['file']}"
+            self.op_logger.update_status(f"{prefix}dl_{i}", "completed")
+            if task.get('target_md5'):
+                self.engine.record_hash(full_path, task['target_md5'], hash_type)
+                if self.content_store is not None:
+                    self.content_store.deposit(full_path, task['target_md5'], hash_type)
+        return True, None
 
 class SpaceCalculator:
     """
@@ -243,28 +784,37 @@ class SpaceCalculator:
     @staticmethod
     def estimate(operations: List[dict]) -> dict:
         """
-        Returns {download_size: int, install_size: int} in bytes.
+        Returns {download_size: int, install_size: int, peak_size: int} in bytes.
+
+        Sizes are the manifest's, as filled in by get_operations. peak_size is
+        the largest temporary footprint of any one operation, the least extra
+        space the session needs to make progress (see space.footprint).
         """
         dl_size = 0
         install_size = 0
+        peak_size = 0
         
         for op in operations:
             if op['type'] == 'nothing':
                 continue
             
-            # These sizes should ideally be in the operation data from manifest
-            # For now, we'll assume some placeholder sizes or look for 'size' key
             size = op.get('size', 0)
+            peak_size = max(peak_size, sum(peak for peak, _ in footprint(op).values()))
             if op['type'] == 'download_full':
                 dl_size += size
                 install_size += size
             elif op['type'] == 'patch_delta':
                 dl_size += op.get('patch_size', size // 10) # Delta is usually smaller
                 install_size += size # After patch, it takes full size
+            elif op['type'] == 'repair_blocks':
+                dl_size += op.get('repair_bytes', 0) # File is already in place
+            elif op['type'] == 'copy_from_store':
+                install_size += size # Local copy, nothing to download
                 
         return {
             "download_size": dl_size,
-            "install_size": install_size
+            "install_size": install_size,
+            "peak_size": peak_size
         }
 
     @staticmethod
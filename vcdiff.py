@@ -0,0 +1,430 @@
+"""
+In-process VCDIFF (RFC 3284) decoder.
+
+Provides:
+- decode_file: Applies a VCDIFF delta to a source file, writing the target
+- iter_windows: Decodes a delta held in memory, yielding each target window
+- decode_stream: Applies a delta read sequentially from a stream (e.g. a
+  member of a patch bundle), holding one window in memory at a time
+- VcdiffError / VcdiffUnsupported: Raised for corrupt or unsupported deltas
+
+Covers what xdelta3 writes by default: the default code table, the
+xdelta3 application header and per-window Adler-32 checksums. Deltas that use
+secondary compression (xdelta3 -S djw/fgk/lzma), external compression named in
+the application header, or a custom code table raise VcdiffUnsupported, and
+Patcher falls back to the xdelta3 executable.
+
+Source and delta files are memory-mapped, so only the windows being decoded
+are paged in; each target window is written out before the next is decoded.
+"""
+
+import os
+import mmap
+import zlib
+import traceback
+from typing import Callable, Iterator, Optional
+
+MAGIC = b"\xd6\xc3\xc4"
+
+# Hdr_Indicator bits
+VCD_DECOMPRESS = 0x01
+VCD_CODETABLE = 0x02
+VCD_APPHEADER = 0x04
+# Win_Indicator bits (VCD_ADLER32 is the xdelta3 checksum extension)
+VCD_SOURCE = 0x01
+VCD_TARGET = 0x02
+VCD_ADLER32 = 0x04
+
+NOOP, ADD, RUN, COPY = 0, 1, 2, 3
+NEAR_SIZE = 4
+SAME_SIZE = 3
+
+class VcdiffError(Exception):
+    """The delta is corrupt or does not match the source."""
+
+class VcdiffUnsupported(VcdiffError):
+    """The delta uses a feature this decoder does not implement."""
+
+def _default_code_table():
+    """The 256-entry default instruction code table of RFC 3284 section 5.6."""
+    table = [(RUN, 0, 0, NOOP, 0, 0), (ADD, 0, 0, NOOP, 0, 0)]
+    table += [(ADD, size, 0, NOOP, 0, 0) for size in range(1, 18)]
+    for mode in range(9):
+        table.append((COPY, 0, mode, NOOP, 0, 0))
+        table += [(COPY, size, mode, NOOP, 0, 0) for size in range(4, 19)]
+    for mode in range(6):
+        for add_size in range(1, 5):
+            table += [(ADD, add_size, 0, COPY, copy_size, mode) for copy_size in range(4, 7)]
+    for mode in range(6, 9):
+        table += [(ADD, add_size, 0, COPY, 4, mode) for add_size in range(1, 5)]
+    table += [(COPY, 4, mode, ADD, 1, 0) for mode in range(9)]
+    return table
+
+CODE_TABLE = _default_code_table()
+
+class _Reader:
+    """Cursor over one section of the delta."""
+    __slots__ = ("buf", "pos", "end")
+
+    def __init__(self, buf, pos=0, end=None):
+        self.buf = buf
+        self.pos = pos
+        self.end = len(buf) if end is None else end
+
+    def byte(self) -> int:
+        if self.pos >= self.end:
+            raise VcdiffError("Unexpected end of delta")
+        value = self.buf[self.pos]
+        self.pos += 1
+        return value
+
+    def integer(self) -> int:
+        """Reads a base-128 big-endian integer (RFC 3284 section 2)."""
+        value = 0
+        for _ in range(10):
+            b = self.byte()
+            value = (value << 7) | (b & 0x7F)
+            if not b & 0x80:
+                return value
+        raise VcdiffError("Integer too long")
+
+    def take(self, n: int):
+        if self.pos + n > self.end:
+            raise VcdiffError("Section shorter than declared")
+        chunk = self.buf[self.pos:self.pos + n]
+        self.pos += n
+        return chunk
+
+class _AddressCache:
+    def __init__(self):
+        self.near = [0] * NEAR_SIZE
+        self.next_slot = 0
+        self.same = [0] * (SAME_SIZE * 256)
+
+    def decode(self, addresses: _Reader, here: int, mode: int) -> int:
+        if mode == 0:
+            addr = addresses.integer()
+        elif mode == 1:
+            addr = here - addresses.integer()
+        elif mode < 2 + NEAR_SIZE:
+            addr = self.near[mode - 2] + addresses.integer()
+        else:
+            addr = self.same[(mode - 2 - NEAR_SIZE) * 256 + addresses.byte()]
+        self.near[self.next_slot] = addr
+        self.next_slot = (self.next_slot + 1) % NEAR_SIZE
+        self.same[addr % (SAME_SIZE * 256)] = addr
+        return addr
+
+def _read_header(delta: _Reader):
+    if bytes(delta.take(3)) != MAGIC:
+        raise VcdiffUnsupported("Not a VCDIFF delta")
+    if delta.byte() != 0:
+        raise VcdiffUnsupported("Unsupported VCDIFF version")
+    indicator = delta.byte()
+    if indicator & VCD_DECOMPRESS:
+        # Secondary compressor id; only a problem if a window actually uses it
+        delta.byte()
+    if indicator & VCD_CODETABLE:
+        raise VcdiffUnsupported("Custom code tables are not supported")
+    if indicator & VCD_APPHEADER:
+        _check_appheader(bytes(delta.take(delta.integer())))
+
+def _check_appheader(header: bytes):
+    """
+    Rejects xdelta3 application headers that name an external compressor.
+
+    xdelta3 writes "target/comp" or "target/comp/source/scomp"; a non-empty
+    comp makes xdelta3 -d recompress its output (or decompress the source),
+    which only the executable can do.
+    """
+    fields = header.split(b"/", 3)
+    if len(fields) in (2, 4) and any(fields[1::2]):
+        compressors = ", ".join(f.decode("ascii", "replace") for f in fields[1::2] if f)
+        raise VcdiffUnsupported(f"External compression ({compressors}) is not supported")
+
+def _copy_within(target: bytearray, pos: int, addr: int, size: int):
+    """Copies target[addr:addr+size] to target[pos:], where the ranges may overlap."""
+    while size > 0:
+        # Each pass copies at most the distance between the ranges, which is
+        # already final; overlapping copies replicate that run
+        chunk = min(size, pos - addr)
+        target[pos:pos + chunk] = target[addr:addr + chunk]
+        pos += chunk
+        addr += chunk
+        size -= chunk
+
+def _decode_window(delta: _Reader, source, read_target) -> bytearray:
+    indicator = delta.byte()
+    segment = b""
+    if indicator & (VCD_SOURCE | VCD_TARGET):
+        length = delta.integer()
+        position = delta.integer()
+        if indicator & VCD_SOURCE:
+            if position + length > len(source):
+                raise VcdiffError("Delta refers past the end of the source file")
+            segment = source[position:position + length]
+        else:
+            segment = read_target(position, length)
+    delta.integer()  # Length of the delta encoding
+    target_length = delta.integer()
+    if delta.byte():
+        raise VcdiffUnsupported("Secondary compression is not supported")
+    data_length = delta.integer()
+    inst_length = delta.integer()
+    addr_length = delta.integer()
+    checksum = int.from_bytes(delta.take(4), "big") if indicator & VCD_ADLER32 else None
+
+    data = _Reader(delta.buf, delta.pos, delta.pos + data_length)
+    instructions = _Reader(delta.buf, data.end, data.end + inst_length)
+    addresses = _Reader(delta.buf, instructions.end, instructions.end + addr_length)
+    if addresses.end > delta.end:
+        raise VcdiffError("Window extends past the end of the delta")
+    delta.pos = addresses.end
+
+    target = bytearray(target_length)
+    segment_length = len(segment)
+    cache = _AddressCache()
+    pos = 0
+    while instructions.pos < instructions.end:
+        entry = CODE_TABLE[instructions.byte()]
+        for inst, size, mode in (entry[0:3], entry[3:6]):
+            if inst == NOOP:
+                continue
+            if size == 0:
+                size = instructions.integer()
+            if pos + size > target_length:
+                raise VcdiffError("Instruction writes past the end of the target window")
+            if inst == ADD:
+                target[pos:pos + size] = data.take(size)
+            elif inst == RUN:
+                target[pos:pos + size] = bytes((data.byte(),)) * size
+            else:
+                addr = cache.decode(addresses, segment_length + pos, mode)
+                if addr < 0 or addr >= segment_length + pos:
+                    raise VcdiffError("Copy address out of range")
+                if addr < segment_length:
+                    # From the source segment, possibly running on into the target
+                    n = min(size, segment_length - addr)
+                    target[pos:pos + n] = segment[addr:addr + n]
+                    if n < size:
+                        _copy_within(target, pos + n, 0, size - n)
+                else:
+                    _copy_within(target, pos, addr - segment_length, size)
+            pos += size
+    if pos != target_length:
+        raise VcdiffError("Target window shorter than declared")
+    if checksum is not None and zlib.adler32(target) != checksum:
+        raise VcdiffError("Target window checksum mismatch")
+    return target
+
+def iter_windows(source, delta, read_target: Optional[Callable[[int, int], bytes]] = None) -> Iterator[bytearray]:
+    """
+    Decodes delta against source (any bytes-like object, e.g. an mmap) and
+    yields each target window in order.
+
+    Args:
+        source: The source file contents
+        delta: The VCDIFF delta
+        read_target: read_target(position, length) returns earlier target
+            output, for windows that copy from the target (VCD_TARGET)
+
+    Raises:
+        VcdiffUnsupported: For features outside the supported subset
+        VcdiffError: If the delta is corrupt or does not fit the source
+    """
+    reader = _Reader(delta)
+    for window in _windows(reader, source, read_target):
+        yield window
+
+def _windows(reader: _Reader, source, read_target):
+    _read_header(reader)
+    while reader.pos < reader.end:
+        yield _decode_window(reader, source, read_target or _no_target)
+
+class _StreamReader:
+    """_Reader interface over a readable stream, with an optional window recording."""
+
+    def __init__(self, stream, chunk_size=64 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buf = b""
+        self.pos = 0
+        # Total bytes consumed, for progress reporting
+        self.consumed = 0
+        self._record = None
+
+    def _fill(self, n: int) -> bool:
+        """Ensures n unread bytes are buffered; False at end of stream."""
+        while len(self.buf) - self.pos < n:
+            chunk = self.stream.read(max(self.chunk_size, n))
+            if not chunk:
+                return False
+            self.buf = self.buf[self.pos:] + chunk
+            self.pos = 0
+        return True
+
+    def at_end(self) -> bool:
+        return not self._fill(1)
+
+    def take(self, n: int) -> bytes:
+        if not self._fill(n):
+            raise VcdiffError("Unexpected end of delta")
+        chunk = self.buf[self.pos:self.pos + n]
+        self.pos += n
+        self.consumed += n
+        if self._record is not None:
+            self._record += chunk
+        return chunk
+
+    def byte(self) -> int:
+        return self.take(1)[0]
+
+    integer = _Reader.integer
+
+    def start_recording(self):
+        self._record = bytearray()
+
+    def stop_recording(self) -> bytes:
+        recorded, self._record = bytes(self._record), None
+        return recorded
+
+def _stream_windows(reader: _StreamReader, source, read_target):
+    _read_header(reader)
+    while not reader.at_end():
+        # Read the window's header fields, then its delta encoding in one piece
+        reader.start_recording()
+        indicator = reader.byte()
+        if indicator & (VCD_SOURCE | VCD_TARGET):
+            reader.integer()
+            reader.integer()
+        length = reader.integer()
+        reader.take(length)
+        yield _decode_window(_Reader(reader.stop_recording()), source, read_target)
+
+def _no_target(position, length):
+    raise VcdiffUnsupported("Windows copying from the target need read_target")
+
+def _map(f):
+    """Read-only mapping of an open file (empty files cannot be mapped)."""
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _pread(f, length, position):
+    here = f.tell()
+    try:
+        f.seek(position)
+        return f.read(length)
+    finally:
+        f.seek(here)
+
+def decode_stream(source_path, delta_stream, target_path, on_window: Optional[Callable[[bytes], None]] = None,
+                  progress: Optional[Callable[[int, int], None]] = None, cancel=None,
+                  total: Optional[int] = None) -> int:
+    """
+    Applies a delta read from delta_stream (anything with read(n)) to
+    source_path, writing target_path. The stream is read once, front to back.
+
+    Args:
+        progress: Called as progress(delta_bytes_done, total) after each window
+        total: Delta size for progress, if known
+
+    Returns and raises as decode_file.
+    """
+    written = 0
+    with open(source_path, "rb") as sf, open(target_path, "w+b") as out:
+        source_map = _map(sf)
+        source = memoryview(source_map) if source_map is not None else memoryview(b"")
+
+        def read_target(position, length):
+            if position + length > written:
+                raise VcdiffError("Target copy refers past the decoded output")
+            out.flush()
+            if hasattr(os, "pread"):
+                return os.pread(out.fileno(), length, position)
+            return _pread(out, length, position)
+
+        reader = _StreamReader(delta_stream)
+        windows = _stream_windows(reader, source, read_target)
+        try:
+            for window in windows:
+                if cancel is not None and cancel.is_set():
+                    raise InterruptedError("Decoding cancelled")
+                out.write(window)
+                written += len(window)
+                if on_window:
+                    on_window(window)
+                if progress:
+                    progress(reader.consumed, total or 0)
+        except BaseException as e:
+            traceback.clear_frames(e.__traceback__)
+            raise
+        finally:
+            windows.close()
+            del windows
+            source.release()
+            if source_map is not None:
+                source_map.close()
+    return written
+
+def decode_file(source_path, delta_path, target_path, on_window: Optional[Callable[[bytes], None]] = None,
+                progress: Optional[Callable[[int, int], None]] = None, cancel=None) -> int:
+    """
+    Applies the delta at delta_path to source_path, writing target_path.
+
+    Args:
+        on_window: Called with each decoded target window (e.g. to hash it)
+        progress: Called as progress(delta_bytes_done, delta_bytes_total)
+            after each window
+        cancel: Optional threading.Event; decoding stops at the next window
+            once it is set
+
+    Returns:
+        int: Bytes written to target_path
+
+    Raises:
+        VcdiffUnsupported, VcdiffError: As iter_windows; target_path may then
+        hold partial output
+        InterruptedError: If cancel was set
+    """
+    written = 0
+    with open(source_path, "rb") as sf, open(delta_path, "rb") as df, open(target_path, "w+b") as out:
+        source_map, delta_map = _map(sf), _map(df)
+        # Views slice the mappings without copying; they must be released before the maps close
+        source = memoryview(source_map) if source_map is not None else memoryview(b"")
+        delta = memoryview(delta_map) if delta_map is not None else memoryview(b"")
+
+        def read_target(position, length):
+            if position + length > written:
+                raise VcdiffError("Target copy refers past the decoded output")
+            out.flush()
+            if hasattr(os, "pread"):
+                return os.pread(out.fileno(), length, position)
+            return _pread(out, length, position)
+
+        reader = _Reader(delta)
+        windows = _windows(reader, source, read_target)
+        try:
+            for window in windows:
+                if cancel is not None and cancel.is_set():
+                    raise InterruptedError("Decoding cancelled")
+                out.write(window)
+                written += len(window)
+                if on_window:
+                    on_window(window)
+                if progress:
+                    progress(reader.pos, reader.end)
+        except BaseException as e:
+            # Frames of the failed decode hold slices of the mappings, which
+            # would keep them from closing
+            traceback.clear_frames(e.__traceback__)
+            raise
+        finally:
+            windows.close()
+            del reader, windows
+            source.release()
+            delta.release()
+            for mapping in (source_map, delta_map):
+                if mapping is not None:
+                    mapping.close()
+    return written
@@ -17,6 +17,7 @@ from typing import Optional, List, Tuple, Dict, Set
 from dataclasses import dataclass
 from packaging import version
 from bs4 import BeautifulSoup
+from http_client import get_client
 from logging_system import get_logger
 
 logger = get_logger()
@@ -111,15 +112,16 @@ class GameVersionDetector:
         'elamigos': 'https://elamigos.site/',
     }
 
-    def __init__(self, timeout: float = 10.0):
+    def __init__(self, timeout: float = 10.0, client: Optional[httpx.Client] = None):
         """
         Initialize version detector.
 
         Args:
             timeout: HTTP request timeout in seconds
+            client: HTTP client (default: the shared pooled client)
         """
         self.timeout = timeout
-        self.client = httpx.Client(timeout=timeout)
+        self.client = client or get_client()
         self.discovered_versions: Set[str] = set()
 
     def detect_sims4_latest_version(self) -> Optional[VersionInfo]:
@@ -172,7 +174,7 @@ class GameVersionDetector:
 
         try:
             # Try to fetch official patch notes page
-            response = self.client.get('https://www.thesims.com/news')
+            response = self.client.get('https://www.thesims.com/news', timeout=self.timeout)
             if response.status_code == 200:
                 versions.extend(self._parse_html_for_versions(
                     response.text,
@@ -196,7 +198,8 @@ class GameVersionDetector:
         try:
             response = self.client.get(
                 'https://updatecrackgames.com/',
-                headers={'User-Agent': 'Mozilla/5.0'}
+                headers={'User-Agent': 'Mozilla/5.0'},
+                timeout=self.timeout
             )
 
             if response.status_code == 200:
@@ -241,7 +244,8 @@ class GameVersionDetector:
         try:
             response = self.client.get(
                 'https://fitgirl-repacks.site/',
-                headers={'User-Agent': 'Mozilla/5.0'}
+                headers={'User-Agent': 'Mozilla/5.0'},
+                timeout=self.timeout
             )
 
             if response.status_code == 200:
@@ -268,7 +272,8 @@ class GameVersionDetector:
         try:
             response = self.client.get(
                 'https://elamigos.site/',
-                headers={'User-Agent': 'Mozilla/5.0'}
+                headers={'User-Agent': 'Mozilla/5.0'},
+                timeout=self.timeout
             )
 
             if response.status_code == 200: